@@ -2,4 +2,5 @@ from .trade_handlers import handle_buy, handle_sell
 from .balance_handler import handle_balance
 from .figi_handler import handle_figi_message
 from .position_handler import handle_positions
-from .close_all_handler import handle_close_all
\ No newline at end of file
+from .close_all_handler import handle_close_all
+from .report_handler import handle_report
@@ -1,16 +1,16 @@
 from telegram import Update
 from telegram.ext import ContextTypes
-from trading.tinkoff_client import TinkoffClient
-import os
+from bot.services import get_services, timed
 import logging
 import asyncio  
 
 logger = logging.getLogger(__name__)
 
+@timed("balance")
 async def handle_balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         message = update.message or update.channel_post
-        client = TinkoffClient(os.getenv("TINKOFF_TOKEN"), os.getenv("ACCOUNT_ID"))
+        client = get_services(context).client
         
         balance = await client.get_balance_async()
         logger.debug(f"Raw balance data: {balance}")
@@ -1,9 +1,7 @@
 # app/bot/handlers/close_all_handler.py
 from telegram import Update
 from telegram.ext import ContextTypes
-from trading.tinkoff_client import TinkoffClient
-from trading.order_executor import OrderExecutor
-import os
+from bot.services import get_services, timed
 import logging
 import asyncio
 
@@ -12,6 +10,7 @@ logger = logging.getLogger(__name__)
 class CloseAllError(Exception):
     pass
 
+@timed("close_all")
 async def handle_close_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды закрытия всех позиций и снятия всех ордеров"""
     message = update.message or update.channel_post
@@ -21,11 +20,9 @@ async def handle_close_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         await message.reply_text("🔄 Начинаю закрытие всех позиций и снятие ордеров...")
         
-        tinkoff_token = os.getenv("TINKOFF_TOKEN")
-        account_id = os.getenv("ACCOUNT_ID")
-        
-        client = TinkoffClient(tinkoff_token, account_id)
-        executor = OrderExecutor(tinkoff_token, account_id)
+        services = get_services(context)
+        client = services.client
+        executor = services.new_executor()
         
         # Получаем все открытые позиции
         positions = await client.get_positions_async()
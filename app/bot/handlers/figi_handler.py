@@ -5,8 +5,11 @@ from tinkoff.invest import AsyncClient, InstrumentShort
 import os
 import logging
 
+from bot.services import get_services, timed
+
 logger = logging.getLogger(__name__)
 
+@timed("figi")
 async def handle_figi_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         message = update.message or update.channel_post
@@ -20,13 +23,13 @@ async def handle_figi_message(update: Update, context: ContextTypes.DEFAULT_TYPE
             return
 
         instrument_name = parts[1].strip()
-        await process_figi_request(message, instrument_name)
+        await process_figi_request(message, instrument_name, get_services(context).session)
 
     except Exception as e:
         logger.error(f"Error: {str(e)}", exc_info=True)
         await message.reply_text("⚠️ Ошибка обработки запроса")
 
-async def process_figi_request(message: Message, instrument_name: str):
+async def process_figi_request(message: Message, instrument_name: str, session=None):
     try:
         token = os.getenv("TINKOFF_TOKEN")
         if not token:
@@ -34,7 +37,8 @@ async def process_figi_request(message: Message, instrument_name: str):
             await message.reply_text("❌ Ошибка конфигурации")
             return
 
-        async with AsyncClient(token) as client:
+        # Открытый канал бота, без него — временный AsyncClient
+        async with (session.api() if session is not None else AsyncClient(token)) as client:
             # Ищем инструмент
             response = await client.instruments.find_instrument(query=instrument_name)
             
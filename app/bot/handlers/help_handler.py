@@ -13,6 +13,7 @@ HELP_TEXT = """
 • `positions` — открытые позиции
 • `status` — общий статус счета
 • `settings` — текущие настройки бота
+• `report [дней] [ТИКЕР]` — PnL, прибыльные сделки, TP, проскальзывание (по умолчанию 30 дней)
 
 💹 **ТОРГОВЫЕ ОПЕРАЦИИ:**
 • `buy SBER` — купить SBER по настройкам риска
@@ -24,18 +25,32 @@ HELP_TEXT = """
 • `set risk long 35` — только риск лонга
 • `set risk short 25` — только риск шорта
 • `set sl 0.7` — стоп-лосс (в %)
+• `set sl be on/off` — SL в безубыток после TP
+• `set trail on/off` — трейлинг-стоп
+• `set trail 0.5` / `set trail step 0.1` — дистанция и шаг трейлинга (в %)
 • `set tp 5.0` — базовый тейк-профит (в %)
 
+🛡 **ЛИМИТЫ РИСКА (руб, 0 — без лимита):**
+• `set limit symbol 300000` — позиция на инструмент
+• `set limit total 1000000` — суммарная позиция
+• `set limit daily 3000000` — дневной оборот
+• `set limit margin 200000` — гарантийное обеспечение
+• `set limit trades 5` — входов по инструменту за день
+• `set limit loss 20000` — дневной убыток
+
 🎯 **МУЛЬТИ-TP НАСТРОЙКИ:**
 • `set multi on` — включить мульти-TP
 • `set multi off` — выключить мульти-TP  
 • `set tp levels 0.5,1.0,1.6` — уровни TP (в %)
 • `set tp portions 33,33,34` — доли позиции (в %)
+• `set bracket atr` / `set bracket percent` — SL/TP от ATR или в процентах
+• `set sl atr 1.5` / `set tp atr 1,2,3` — SL и уровни TP в кратных ATR
 
 ⏰ **АВТО-ЛИКВИДАЦИЯ:**
 • `set auto on/off` — включить/выключить
 • `set auto time 21:44` — время закрытия (МСК)
 • `set auto block 30` — окно блокировки (мин)
+• `set auto warmup 30` — прогрев до ликвидации (сек)
 • `set auto days 0,1,2,3,4` — дни (0=Пн, 6=Вс)
 
 🌐 **WEBHOOK API:**
@@ -57,6 +72,7 @@ POST /webhook
 • `risk_percent` — риск в % (опционально)
 • `tp_percent` — кастомный TP в % (отключает мульти-TP)
 • `sl_percent` — кастомный SL в %
+• `price` — цена на момент сигнала (для оценки проскальзывания)
 
 📝 **ПРИМЕРЫ ИСПОЛЬЗОВАНИЯ:**
 
@@ -1,18 +1,18 @@
 from telegram import Update
 from telegram.ext import ContextTypes
-from trading.tinkoff_client import TinkoffClient
-import os
+from bot.services import get_services, timed
 import logging
 
 logger = logging.getLogger(__name__)
 
+@timed("positions")
 async def handle_positions(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message = update.message or update.channel_post  # Исправление ошибки NoneType
     if not message:
         return
 
     try:
-        client = TinkoffClient(os.getenv("TINKOFF_TOKEN"), os.getenv("ACCOUNT_ID"))
+        client = get_services(context).client
         positions = await client.get_positions_async()
 
         if not positions:
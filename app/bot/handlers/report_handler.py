@@ -0,0 +1,30 @@
+# app/bot/handlers/report_handler.py
+from telegram import Update
+from telegram.ext import ContextTypes
+import os
+import logging
+
+from trading.analytics import get_report_engine
+
+logger = logging.getLogger(__name__)
+
+async def handle_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """report [дней] [ТИКЕР] — PnL, доля прибыльных сделок, TP, проскальзывание, просадка"""
+    message = update.message or update.channel_post
+    try:
+        if not os.getenv("DB_URL"):
+            await message.reply_text("❌ База данных не настроена (DB_URL)")
+            return
+
+        days, symbol = 30, None
+        for part in message.text.split()[1:]:
+            if part.isdigit():
+                days = int(part)
+            else:
+                symbol = part.upper()
+
+        report = await get_report_engine().build(days=days, symbol=symbol)
+        await message.reply_text(report.format())
+    except Exception as e:
+        logger.error(f"Report error: {str(e)}", exc_info=True)
+        await message.reply_text("❌ Ошибка построения отчёта")
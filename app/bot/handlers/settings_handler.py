@@ -16,18 +16,53 @@ HELP_TEXT = (
     "• Только лонг: `set risk long 35`\n"
     "• Только шорт: `set risk short 25`\n"
     "• Стоп-лосс: `set sl 0.7` (в %)\n"
+    "• SL в безубыток после TP: `set sl be on/off`\n"
+    "• Трейлинг-стоп: `set trail on/off`\n"
+    "• Дистанция трейлинга: `set trail 0.5` (в %)\n"
+    "• Шаг переноса стопа: `set trail step 0.1` (в %)\n"
     "• Тейк-профит: `set tp 9` (в %)\n\n"
+    "*Лимиты риска (руб, 0 — без лимита):*\n"
+    "• На инструмент: `set limit symbol 300000`\n"
+    "• Суммарная позиция: `set limit total 1000000`\n"
+    "• Дневной оборот: `set limit daily 3000000`\n"
+    "• Гарантийное обеспечение: `set limit margin 200000`\n"
+    "• Входов по инструменту за день: `set limit trades 5`\n"
+    "• Дневной убыток: `set limit loss 20000`\n\n"
     "*Мульти-TP:*\n"
     "• Включить/выключить: `set multi on/off`\n"
     "• Уровни TP: `set tp levels 0.5,1.0,1.6`\n"
     "• Доли позиций: `set tp portions 33,33,34`\n\n"
+    "*SL/TP от волатильности:*\n"
+    "• Режим: `set bracket atr` / `set bracket percent`\n"
+    "• SL: `set sl atr 1.5` (в ATR)\n"
+    "• Уровни TP: `set tp atr 1,2,3` (в ATR)\n\n"
     "*Авто-ликвидация:*\n"
     "• Включить/выключить: `set auto on/off`\n"
     "• Время: `set auto time 21:30`\n"
     "• Окно блокировки: `set auto block 45` (мин)\n"
+    "• Прогрев перед ликвидацией: `set auto warmup 30` (сек, 0 — выкл)\n"
     "• Дни недели: `set auto days 0,1,2,3,4` (0=Пн)"
 )
 
+_LIMIT_FIELDS = {
+    "symbol": "max_symbol_notional",
+    "total": "max_total_notional",
+    "daily": "max_daily_notional",
+    "margin": "max_margin_used",
+    "trades": "max_daily_trades_per_symbol",
+    "loss": "max_daily_loss",
+}
+
+def _fit_atr_levels(levels: list[float], count: int) -> list[float]:
+    """Уровни TP в ATR под новое число долей: лишние отбрасываются, недостающие — с шагом 1 ATR"""
+    levels = list(levels[:count])
+    while len(levels) < count:
+        levels.append((levels[-1] if levels else 0) + 1.0)
+    return levels
+
+def _fmt_limit(value: float) -> str:
+    return f"{value:,.0f} ₽".replace(",", " ") if value else "без лимита"
+
 def _fmt_settings():
     """Форматирует настройки для красивого вывода в Telegram"""
     s = get_settings()
@@ -45,7 +80,19 @@ def _fmt_settings():
         f"• Risk LONG: `{s.risk_long_percent:.1f}%`\n"
         f"• Risk SHORT: `{s.risk_short_percent:.1f}%`\n"
         f"• Stop-Loss: `{s.stop_loss_percent:.2f}%`\n"
-        f"• Take-Profit: `{s.take_profit_percent:.1f}%` (базовый)\n\n"
+        f"• SL в безубыток после TP: {'✅' if s.sl_breakeven_after_tp else '❌'}\n"
+        f"• Трейлинг-стоп: {'✅' if s.trailing_stop_enabled else '❌'} "
+        f"`{s.trailing_stop_percent:.2f}%`, шаг `{s.trailing_step_percent:.2f}%`\n"
+        f"• Take-Profit: `{s.take_profit_percent:.1f}%` (базовый)\n"
+        f"• Режим SL/TP: `{s.bracket_mode}`"
+        f"{f' (SL {s.sl_atr_multiplier:g} ATR, TP ' + ', '.join(f'{l:g}' for l in s.tp_atr_levels) + ' ATR)' if s.bracket_mode == 'atr' else ''}\n\n"
+        f"*Лимиты риска:*\n"
+        f"• На инструмент: `{_fmt_limit(s.max_symbol_notional)}`\n"
+        f"• Суммарная позиция: `{_fmt_limit(s.max_total_notional)}`\n"
+        f"• Дневной оборот: `{_fmt_limit(s.max_daily_notional)}`\n"
+        f"• ГО: `{_fmt_limit(s.max_margin_used)}`\n"
+        f"• Входов по инструменту за день: `{s.max_daily_trades_per_symbol or 'без лимита'}`\n"
+        f"• Дневной убыток: `{_fmt_limit(s.max_daily_loss)}`\n\n"
         f"*Мульти-TP:*\n"
         f"• Статус: {multi_tp_status}\n"
         f"• Уровни: `{tp_levels_str}`\n"
@@ -54,6 +101,7 @@ def _fmt_settings():
         f"• Статус: {'✅ Включена' if s.auto_liquidation_enabled else '❌ Выключена'}\n"
         f"• Время: `{s.auto_liquidation_time}` МСК\n"
         f"• Блокировка: `{s.auto_liquidation_block_minutes}` мин\n"
+        f"• Прогрев: `{s.auto_liquidation_warmup_seconds}` сек\n"
         f"• Дни: `{active_days}`"
     )
 
@@ -110,6 +158,38 @@ async def handle_set(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await message.reply_text("✅ Обновлено:\n" + _fmt_settings(), parse_mode='Markdown')
             return
 
+        # set sl be on/off
+        m = re.match(r'^set\s+sl\s+be\s+(on|off|true|false|1|0)$', text, re.IGNORECASE)
+        if m:
+            enabled = m.group(1).lower() in ['on', 'true', '1']
+            update_settings(sl_breakeven_after_tp=enabled)
+            status = "включён" if enabled else "выключен"
+            await message.reply_text(f"✅ Перенос SL в безубыток {status}\n\n" + _fmt_settings(), parse_mode='Markdown')
+            return
+
+        # set trail on/off
+        m = re.match(r'^set\s+trail\s+(on|off|true|false|1|0)$', text, re.IGNORECASE)
+        if m:
+            enabled = m.group(1).lower() in ['on', 'true', '1']
+            update_settings(trailing_stop_enabled=enabled)
+            status = "включён" if enabled else "выключен"
+            await message.reply_text(f"✅ Трейлинг-стоп {status}\n\n" + _fmt_settings(), parse_mode='Markdown')
+            return
+
+        # set trail 0.5
+        m = re.match(r'^set\s+trail\s+(\d+(?:\.\d+)?)$', text, re.IGNORECASE)
+        if m:
+            update_settings(trailing_stop_percent=float(m.group(1)))
+            await message.reply_text("✅ Обновлено:\n" + _fmt_settings(), parse_mode='Markdown')
+            return
+
+        # set trail step 0.1
+        m = re.match(r'^set\s+trail\s+step\s+(\d+(?:\.\d+)?)$', text, re.IGNORECASE)
+        if m:
+            update_settings(trailing_step_percent=float(m.group(1)))
+            await message.reply_text("✅ Обновлено:\n" + _fmt_settings(), parse_mode='Markdown')
+            return
+
         # set tp 9
         m = re.match(r'^set\s+tp\s+(\d+(?:\.\d+)?)$', text, re.IGNORECASE)
         if m:
@@ -118,6 +198,45 @@ async def handle_set(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await message.reply_text("✅ Обновлено:\n" + _fmt_settings(), parse_mode='Markdown')
             return
 
+        # set limit daily 3000000 (0 — снять лимит)
+        m = re.match(r'^set\s+limit\s+(symbol|total|daily|margin|trades|loss)\s+(\d+(?:\.\d+)?)$', text, re.IGNORECASE)
+        if m:
+            field = _LIMIT_FIELDS[m.group(1).lower()]
+            value = float(m.group(2))
+            update_settings(**{field: int(value) if field == "max_daily_trades_per_symbol" else value})
+            await message.reply_text("✅ Обновлено:\n" + _fmt_settings(), parse_mode='Markdown')
+            return
+
+        # set bracket atr / set bracket percent
+        m = re.match(r'^set\s+bracket\s+(atr|percent)$', text, re.IGNORECASE)
+        if m:
+            update_settings(bracket_mode=m.group(1).lower())
+            await message.reply_text("✅ Обновлено:\n" + _fmt_settings(), parse_mode='Markdown')
+            return
+
+        # set sl atr 1.5
+        m = re.match(r'^set\s+sl\s+atr\s+(\d+(?:\.\d+)?)$', text, re.IGNORECASE)
+        if m:
+            update_settings(sl_atr_multiplier=float(m.group(1)))
+            await message.reply_text("✅ Обновлено:\n" + _fmt_settings(), parse_mode='Markdown')
+            return
+
+        # set tp atr 1,2,3 (по уровню на каждую долю tp_portions)
+        m = re.match(r'^set\s+tp\s+atr\s+([\d\.,\s]+)$', text, re.IGNORECASE)
+        if m:
+            try:
+                levels = [float(l) for l in m.group(1).replace(" ", "").split(",") if l.strip()]
+            except ValueError:
+                await message.reply_text("❌ Неверный формат. Используйте: `set tp atr 1,2,3`")
+                return
+            count = len(get_settings().tp_portions)
+            if len(levels) != count or not all(l > 0 for l in levels):
+                await message.reply_text(f"❌ Нужно {count} положительных уровней — по числу долей TP")
+                return
+            update_settings(tp_atr_levels=levels)
+            await message.reply_text("✅ Обновлено:\n" + _fmt_settings(), parse_mode='Markdown')
+            return
+
         # НОВЫЕ КОМАНДЫ для мульти-TP
         
         # set multi on/off
@@ -141,7 +260,8 @@ async def handle_set(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     base_portion = 1.0 / count
                     portions = [base_portion] * (count - 1) + [1.0 - base_portion * (count - 1)]
                     
-                    update_settings(tp_levels=levels, tp_portions=portions)
+                    update_settings(tp_levels=levels, tp_portions=portions,
+                                    tp_atr_levels=_fit_atr_levels(get_settings().tp_atr_levels, count))
                     await message.reply_text(f"✅ Уровни TP обновлены: {levels}\nДоли автоматически распределены\n\n" + _fmt_settings(), parse_mode='Markdown')
                     return
                 else:
@@ -165,7 +285,8 @@ async def handle_set(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     if len(portions) != len(s.tp_levels):
                         # Создаем равномерные уровни
                         levels = [0.5 + i * 0.5 for i in range(len(portions))]
-                        update_settings(tp_levels=levels, tp_portions=portions)
+                        update_settings(tp_levels=levels, tp_portions=portions,
+                                        tp_atr_levels=_fit_atr_levels(s.tp_atr_levels, len(portions)))
                         await message.reply_text(f"✅ Доли TP обновлены: {portions_pct}%\nУровни автоматически подстроены\n\n" + _fmt_settings(), parse_mode='Markdown')
                     else:
                         update_settings(tp_portions=portions)
@@ -215,6 +336,18 @@ async def handle_set(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await message.reply_text("❌ Окно блокировки должно быть от 1 до 180 минут")
                 return
 
+        # set auto warmup 30
+        m = re.match(r'^set\s+auto\s+warmup\s+(\d+)$', text, re.IGNORECASE)
+        if m:
+            seconds = int(m.group(1))
+            if 0 <= seconds <= 600:
+                update_settings(auto_liquidation_warmup_seconds=seconds)
+                await message.reply_text(f"✅ Прогрев перед авто-ликвидацией: {seconds} сек\n\n" + _fmt_settings(), parse_mode='Markdown')
+                return
+            else:
+                await message.reply_text("❌ Прогрев должен быть от 0 до 600 секунд")
+                return
+
         # set auto days 0,1,2,3,4
         m = re.match(r'^set\s+auto\s+days\s+([0-6,\s]+)$', text, re.IGNORECASE)
         if m:
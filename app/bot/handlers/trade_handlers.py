@@ -1,13 +1,13 @@
 # app/bot/handlers/trade_handlers.py - ИСПРАВЛЕННАЯ ВЕРСИЯ с get_settings()
 from telegram import Update
 from telegram.ext import ContextTypes
-import os
 import logging
 import asyncio
 from decimal import Decimal
 from trading.tinkoff_client import TinkoffClient, Position 
 from trading.order_executor import OrderExecutor
 from trading.settings_manager import get_settings  # ✅ ИСПРАВЛЕНИЕ
+from bot.services import get_services, timed
 
 logger = logging.getLogger(__name__)
 
@@ -24,11 +24,10 @@ async def _process_trade_command(update: Update, context: ContextTypes.DEFAULT_T
         instrument = message.text.split()[1].upper()
         logger.info(f"Processing {action.upper()} command for {instrument}")
 
-        tinkoff_token = os.getenv("TINKOFF_TOKEN")
-        account_id = os.getenv("ACCOUNT_ID")
-        
-        client = TinkoffClient(tinkoff_token, account_id)
-        executor = OrderExecutor(tinkoff_token, account_id)
+        # Общий канал и кэш бота; исполнитель — свой на команду
+        services = get_services(context)
+        client = services.client
+        executor = services.new_executor()
 
         figi = await client.get_figi(instrument)
         if not figi:
@@ -177,10 +176,12 @@ async def _handle_trade_logic(
             'details': ""
         }
 
+@timed("buy")
 async def handle_buy(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды покупки"""
     await _process_trade_command(update, context, 'buy')
 
+@timed("sell")
 async def handle_sell(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды продажи"""
     await _process_trade_command(update, context, 'sell')
\ No newline at end of file
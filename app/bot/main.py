@@ -1,7 +1,6 @@
 # app/bot/main.py - ИСПРАВЛЕННАЯ И РАСШИРЕННАЯ ВЕРСИЯ
 import os
 import re
-import asyncio
 import logging
 from telegram import Update
 from telegram.ext import (
@@ -20,6 +19,7 @@ from bot.handlers import (
     handle_sell,
     handle_positions,
     handle_close_all,
+    handle_report,
 )
 
 # Импорты настроек
@@ -28,9 +28,12 @@ from bot.handlers.settings_handler import handle_settings_command, handle_set
 # НОВЫЙ ИМПОРТ: обработчик справки
 from bot.handlers.help_handler import handle_help_command, handle_help_message
 
-# Торговые компоненты
-from trading.order_executor import OrderExecutor
-from trading.order_watcher import OrderWatcher
+# Торговые компоненты: канал брокера, исполнитель и фоновые задачи — в bot.services
+from bot.services import start_services, stop_services
+from trading.settings_sync import SettingsSync
+from trading.db_logger import start_event_logger, stop_event_logger
+from trading.db_maintenance import run_migrations
+from utils.redis_client import close_redis
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -47,6 +50,25 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         logger.error(f"Ошибка в error_handler: {str(e)}")
 
+settings_sync = SettingsSync()
+
+async def post_init(application):
+    """Запускается после инициализации приложения, внутри работающего event loop"""
+    # Журнал событий пишет колонки из миграций: схема обновляется до его запуска
+    try:
+        await run_migrations()
+    except Exception as e:
+        logger.error(f"Database migrations failed: {e}")
+    await start_event_logger()
+    await settings_sync.start()
+    await start_services(application)
+
+async def post_shutdown(application):
+    await stop_services(application)
+    await settings_sync.stop()
+    await stop_event_logger()
+    await close_redis()
+
 def setup_handlers(application):
     """Настройка всех обработчиков команд"""
     
@@ -78,6 +100,12 @@ def setup_handlers(application):
         handle_positions,
     ))
 
+    # ========== ОТЧЁТ ==========
+    application.add_handler(MessageHandler(
+        filters.TEXT & filters.Regex(re.compile(r"^(report|отч[её]т)(\s+\w+){0,2}$", re.IGNORECASE)),
+        handle_report,
+    ))
+
     # ========== ЗАКРЫТЬ ВСЁ ==========
     application.add_handler(MessageHandler(
         filters.TEXT & filters.Regex(re.compile(
@@ -112,7 +140,7 @@ def setup_handlers(application):
     # Изменить настройки (расширенная регулярка для всех set команд)
     application.add_handler(MessageHandler(
         filters.TEXT & filters.Regex(re.compile(
-            r"^set\s+(risk|sl|tp|multi|auto)", re.IGNORECASE
+            r"^set\s+(risk|sl|tp|multi|auto|trail|limit|bracket)", re.IGNORECASE
         )),
         handle_set,
     ))
@@ -123,7 +151,6 @@ def main():
     token = os.getenv("BOT_TOKEN")
     tinkoff_token = os.getenv("TINKOFF_TOKEN")
     account_id = os.getenv("ACCOUNT_ID")
-    chat_id = os.getenv("TG_CHAT_ID")
 
     # Проверка обязательных переменных
     if not token:
@@ -132,7 +159,13 @@ def main():
         raise ValueError("Не заданы TINKOFF_TOKEN или ACCOUNT_ID")
 
     # Создание приложения
-    application = ApplicationBuilder().token(token).build()
+    application = (
+        ApplicationBuilder()
+        .token(token)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     # Настройка обработчиков
     setup_handlers(application)
@@ -140,20 +173,6 @@ def main():
     # Обработчик ошибок
     application.add_error_handler(error_handler)
 
-    # Инициализация торговых компонентов
-    executor = OrderExecutor(tinkoff_token, account_id)
-    watcher = OrderWatcher(
-        tinkoff_token,
-        account_id,
-        executor,
-        tg_bot=application.bot,
-        chat_id=chat_id,
-    )
-
-    # Запуск OrderWatcher в фоне
-    loop = asyncio.get_event_loop()
-    loop.create_task(watcher.watch_trades())
-
     logger.info("🤖 Telegram бот запущен с поддержкой:")
     logger.info("  📊 Просмотр баланса и позиций")
     logger.info("  💹 Торговые операции (buy/sell)")
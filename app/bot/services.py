@@ -0,0 +1,158 @@
+# app/bot/services.py
+# Сервисы бота, общие для всех обработчиков.
+# Канал брокера (BrokerSession), MarketCache, клиент и исполнитель создаются один раз в post_init
+# и лежат в application.bot_data["services"]; обработчики берут их оттуда, а не открывают
+# новый AsyncClient на каждое сообщение. Фоновые задачи (OrderWatcher, трейлинг, свечи) запускаются
+# там же и останавливаются в post_shutdown вместе с каналом.
+# Сигналы исполняются на всех счетах из TRADING_ACCOUNTS, поэтому OrderWatcher, BracketManager и
+# трейлинг создаются на каждый счёт; команды бота работают со счётом ACCOUNT_ID (или первым).
+# Время ответа на команды пишется в LatencyStats по каждой команде.
+import os
+import time
+import asyncio
+import logging
+import functools
+from dataclasses import dataclass, field
+from typing import Optional
+
+from telegram import Update
+from telegram.ext import Application, ContextTypes
+
+from trading.broker_session import BrokerSession
+from trading.accounts import TradingAccount, load_accounts
+from trading.market_cache import MarketCache
+from trading.tinkoff_client import TinkoffClient
+from trading.order_executor import OrderExecutor
+from trading.order_watcher import OrderWatcher, LatencyStats
+from trading.bracket_manager import BracketManager
+from trading.trailing_stop import TrailingStopEngine
+from trading.candle_store import get_candle_store
+
+logger = logging.getLogger(__name__)
+
+TINKOFF_TOKEN = os.getenv("TINKOFF_TOKEN")
+ACCOUNT_ID = os.getenv("ACCOUNT_ID")
+CHAT_ID = os.getenv("TG_CHAT_ID")
+
+@dataclass
+class AccountServices:
+    """Сопровождение позиций одного счёта: поток сделок, SL/TP и трейлинг"""
+    name: str
+    executor: OrderExecutor
+    brackets: BracketManager
+    trailing: TrailingStopEngine
+    watcher: OrderWatcher
+
+@dataclass
+class BotServices:
+    token: str
+    account_id: str
+    session: BrokerSession
+    market: MarketCache
+    client: TinkoffClient
+    executor: OrderExecutor
+    brackets: BracketManager
+    trailing: TrailingStopEngine
+    watcher: OrderWatcher
+    accounts: list[AccountServices] = field(default_factory=list)
+    timings: dict[str, LatencyStats] = field(default_factory=dict)
+    tasks: list[asyncio.Task] = field(default_factory=list)
+
+    def new_executor(self) -> OrderExecutor:
+        # Исполнитель хранит промежуточное состояние расчёта лотов — свой на каждую команду,
+        # канал и кэш при этом общие
+        return OrderExecutor(self.token, self.account_id, market=self.market, session=self.executor.session)
+
+    def record(self, command: str, elapsed_ms: float) -> LatencyStats:
+        stats = self.timings.setdefault(command, LatencyStats())
+        stats.add(elapsed_ms)
+        return stats
+
+async def start_services(application: Application) -> BotServices:
+    """post_init: открывает канал брокера, собирает сервисы и запускает фоновые задачи"""
+    session = BrokerSession(TINKOFF_TOKEN)
+    try:
+        await session.open()
+    except Exception as e:
+        # Без канала запросы идут через временные AsyncClient — бот остаётся рабочим
+        logger.error(f"Broker session open failed, falling back to per-request channels: {e}")
+
+    market = MarketCache(TINKOFF_TOKEN, session=session)
+    accounts = [_account_services(a, market, session, application) for a in load_accounts(market)]
+    if not accounts:
+        raise RuntimeError("No trading accounts configured")
+    primary = next((a for a in accounts if a.executor.account_id == ACCOUNT_ID), accounts[0])
+    services = BotServices(
+        token=primary.executor.token,
+        account_id=primary.executor.account_id,
+        session=session,
+        market=market,
+        client=primary.executor.client,
+        executor=primary.executor,
+        brackets=primary.brackets,
+        trailing=primary.trailing,
+        watcher=primary.watcher,
+        accounts=accounts,
+    )
+    for account in accounts:
+        services.tasks += [
+            asyncio.create_task(account.watcher.watch_trades()),
+            asyncio.create_task(account.trailing.run()),
+        ]
+    services.tasks.append(asyncio.create_task(get_candle_store(TINKOFF_TOKEN).run()))
+    application.bot_data["services"] = services
+    logger.info(f"Bot services started for accounts: {', '.join(a.name for a in accounts)}")
+    return services
+
+def _account_services(account: TradingAccount, market: MarketCache, session: BrokerSession,
+                      application: Application) -> AccountServices:
+    # Канал бота открыт с TINKOFF_TOKEN — счета с другим токеном ходят через свои AsyncClient
+    shared = session if account.token == TINKOFF_TOKEN else None
+    executor = OrderExecutor(account.token, account.account_id, market=market, session=shared)
+    brackets = BracketManager(account.token, account.account_id, executor, tg_bot=application.bot, chat_id=CHAT_ID)
+    trailing = TrailingStopEngine(account.token, brackets)
+    watcher = OrderWatcher(
+        account.token,
+        account.account_id,
+        executor,
+        tg_bot=application.bot,
+        chat_id=CHAT_ID,
+        brackets=brackets,
+    )
+    return AccountServices(name=account.name, executor=executor, brackets=brackets, trailing=trailing, watcher=watcher)
+
+async def stop_services(application: Application):
+    """post_shutdown: останавливает фоновые задачи и закрывает канал"""
+    services: Optional[BotServices] = application.bot_data.pop("services", None)
+    if services is None:
+        return
+    for task in services.tasks:
+        task.cancel()
+    await asyncio.gather(*services.tasks, return_exceptions=True)
+    await services.session.close()
+    for command, stats in services.timings.items():
+        logger.info(f"Command {command} latency: {stats.summary()}")
+    logger.info("Bot services stopped")
+
+def get_services(context: ContextTypes.DEFAULT_TYPE) -> BotServices:
+    return context.application.bot_data["services"]
+
+def timed(command: str):
+    """Декоратор обработчика: время от получения сообщения до конца обработки, мс"""
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await handler(update, context, *args, **kwargs)
+            finally:
+                elapsed = (time.perf_counter() - started) * 1000
+                services = context.application.bot_data.get("services")
+                if services is not None:
+                    stats = services.record(command, elapsed)
+                    logger.info(
+                        f"Command {command}: {elapsed:.0f} ms "
+                        f"(p50 {stats.percentile(0.5):.0f}, p95 {stats.percentile(0.95):.0f})"
+                    )
+        return wrapper
+    return decorator
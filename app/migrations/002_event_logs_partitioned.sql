@@ -0,0 +1,101 @@
+-- app/migrations/002_event_logs_partitioned.sql
+-- event_logs секционируется по месяцам (event_time, UTC):
+--   event_logs_YYYY_MM — месячные секции, event_logs_default — для строк вне созданных секций.
+-- Индексы объявлены на родительской таблице и создаются в каждой секции автоматически.
+-- Старые секции отключаются и переносятся в схему archive функцией event_logs_archive().
+
+CREATE SCHEMA IF NOT EXISTS archive;
+
+-- Прежняя несекционированная таблица переименовывается, данные переносятся ниже
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'public' AND c.relname = 'event_logs' AND c.relkind = 'r'
+    ) THEN
+        ALTER TABLE public.event_logs RENAME TO event_logs_legacy;
+        IF to_regclass('public.event_logs_pkey') IS NOT NULL THEN
+            ALTER INDEX public.event_logs_pkey RENAME TO event_logs_legacy_pkey;
+        END IF;
+    END IF;
+END $$;
+
+CREATE TABLE IF NOT EXISTS event_logs (
+    id BIGSERIAL,
+    event_time TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+    event_type TEXT NOT NULL,       -- e.g. 'signal', 'trade', 'error'
+    symbol TEXT,                    -- тикер инструмента
+    details JSONB,                  -- произвольные данные
+    message TEXT,                   -- человекочитаемое описание
+    PRIMARY KEY (id, event_time)
+) PARTITION BY RANGE (event_time);
+
+CREATE TABLE IF NOT EXISTS event_logs_default PARTITION OF event_logs DEFAULT;
+
+-- BRIN: время событий растёт монотонно, индекс занимает килобайты на месяц данных
+CREATE INDEX IF NOT EXISTS idx_event_logs_time_brin ON event_logs USING BRIN (event_time);
+-- "все ошибки за неделю", "все события по NG за неделю"
+CREATE INDEX IF NOT EXISTS idx_event_logs_type_time ON event_logs (event_type, event_time DESC);
+CREATE INDEX IF NOT EXISTS idx_event_logs_symbol_time ON event_logs (symbol, event_time DESC);
+-- Поиск по содержимому details: details @> '{"action": "buy"}', '{"order_id": "..."}'
+CREATE INDEX IF NOT EXISTS idx_event_logs_details ON event_logs USING GIN (details jsonb_path_ops);
+
+-- Секция за месяц, в который попадает month_start; возвращает имя секции
+CREATE OR REPLACE FUNCTION event_logs_ensure_partition(month_start DATE) RETURNS TEXT AS $$
+DECLARE
+    first_day DATE := date_trunc('month', month_start)::date;
+    next_day DATE := (date_trunc('month', month_start) + INTERVAL '1 month')::date;
+    part TEXT := 'event_logs_' || to_char(first_day, 'YYYY_MM');
+BEGIN
+    IF to_regclass('public.' || part) IS NULL THEN
+        EXECUTE format(
+            'CREATE TABLE public.%I PARTITION OF public.event_logs FOR VALUES FROM (%L) TO (%L)',
+            part, first_day::text || ' 00:00:00+00', next_day::text || ' 00:00:00+00'
+        );
+    END IF;
+    RETURN part;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Отключает секции, целиком старше retention_months полных месяцев, и переносит их в archive
+CREATE OR REPLACE FUNCTION event_logs_archive(retention_months INT) RETURNS SETOF TEXT AS $$
+DECLARE
+    cutoff DATE := (date_trunc('month', now() AT TIME ZONE 'UTC') - make_interval(months => retention_months))::date;
+    part RECORD;
+BEGIN
+    FOR part IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'public.event_logs'::regclass
+          AND c.relname ~ '^event_logs_[0-9]{4}_[0-9]{2}$'
+        ORDER BY c.relname
+    LOOP
+        IF to_date(right(part.relname, 7), 'YYYY_MM') < cutoff THEN
+            EXECUTE format('ALTER TABLE public.event_logs DETACH PARTITION public.%I', part.relname);
+            EXECUTE format('ALTER TABLE public.%I SET SCHEMA archive', part.relname);
+            RETURN NEXT part.relname;
+        END IF;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Секции под прежние данные, текущий и следующий месяц; перенос данных
+DO $$
+DECLARE
+    m DATE;
+BEGIN
+    IF to_regclass('public.event_logs_legacy') IS NOT NULL THEN
+        FOR m IN
+            SELECT DISTINCT date_trunc('month', event_time AT TIME ZONE 'UTC')::date FROM public.event_logs_legacy
+        LOOP
+            PERFORM event_logs_ensure_partition(m);
+        END LOOP;
+        INSERT INTO event_logs (event_time, event_type, symbol, details, message)
+        SELECT event_time, event_type, symbol, details, message FROM public.event_logs_legacy ORDER BY id;
+        -- Исходная таблица остаётся в archive, пока её не удалят вручную
+        ALTER TABLE public.event_logs_legacy SET SCHEMA archive;
+    END IF;
+    PERFORM event_logs_ensure_partition((now() AT TIME ZONE 'UTC')::date);
+    PERFORM event_logs_ensure_partition((now() AT TIME ZONE 'UTC' + INTERVAL '1 month')::date);
+END $$;
@@ -0,0 +1,15 @@
+-- app/migrations/003_typed_trades_errors.sql
+-- Связь сделок и ошибок с сигналом и поля для записи из кода (trading/db_logger.record_*)
+
+ALTER TABLE trades ADD COLUMN IF NOT EXISTS signal_id UUID;          -- signals.id, NULL для ручных сделок из бота
+ALTER TABLE trades ADD COLUMN IF NOT EXISTS action VARCHAR(10);      -- open / close
+ALTER TABLE trades ADD COLUMN IF NOT EXISTS order_id VARCHAR(64);    -- id рыночной заявки у брокера
+
+ALTER TABLE errors ADD COLUMN IF NOT EXISTS signal_id UUID;
+ALTER TABLE errors ADD COLUMN IF NOT EXISTS symbol VARCHAR(50);
+
+CREATE INDEX IF NOT EXISTS idx_trades_signal_id ON trades (signal_id);
+CREATE INDEX IF NOT EXISTS idx_trades_order_id ON trades (order_id);
+CREATE INDEX IF NOT EXISTS idx_signals_symbol_created_at ON signals (symbol, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_errors_created_at ON errors (created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_errors_signal_id ON errors (signal_id);
@@ -0,0 +1,45 @@
+-- app/migrations/004_broker_operations.sql
+-- Операции брокерского счёта (сделки, комиссии, вариационная маржа), синхронизируемые
+-- trading/operations_sync.py, и контрольная точка синхронизации по счёту.
+
+CREATE TABLE IF NOT EXISTS broker_operations (
+    id TEXT PRIMARY KEY,                 -- id операции у брокера
+    parent_operation_id TEXT,            -- для комиссии — id сделки
+    account_id TEXT NOT NULL,
+    date TIMESTAMP WITH TIME ZONE NOT NULL,
+    type TEXT NOT NULL,                  -- OPERATION_TYPE_BUY, OPERATION_TYPE_BROKER_FEE, OPERATION_TYPE_ACCRUING_VARMARGIN, ...
+    state TEXT,                          -- OPERATION_STATE_EXECUTED / _CANCELED / _PROGRESS
+    figi VARCHAR(64),
+    instrument_uid TEXT,
+    instrument_type TEXT,
+    name TEXT,
+    description TEXT,
+    quantity BIGINT,
+    quantity_done BIGINT,
+    price NUMERIC(20,9),
+    payment NUMERIC(20,9),               -- со знаком: списание отрицательное
+    commission NUMERIC(20,9),
+    yield NUMERIC(20,9),
+    currency VARCHAR(8),
+    trade_id UUID,                       -- trades.id нашей сделки
+    signal_id UUID,                      -- signals.id сигнала, открывшего сделку
+    synced_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_broker_operations_date ON broker_operations (account_id, date DESC);
+CREATE INDEX IF NOT EXISTS idx_broker_operations_figi_date ON broker_operations (figi, date DESC);
+CREATE INDEX IF NOT EXISTS idx_broker_operations_type_date ON broker_operations (type, date DESC);
+CREATE INDEX IF NOT EXISTS idx_broker_operations_parent ON broker_operations (parent_operation_id);
+CREATE INDEX IF NOT EXISTS idx_broker_operations_trade_id ON broker_operations (trade_id);
+CREATE INDEX IF NOT EXISTS idx_broker_operations_signal_id ON broker_operations (signal_id);
+
+-- watermark — до какого момента операции уже загружены; run_* и cursor — незавершённый
+-- прогон, который продолжается со следующей страницы после перезапуска
+CREATE TABLE IF NOT EXISTS broker_sync_state (
+    account_id TEXT PRIMARY KEY,
+    watermark TIMESTAMP WITH TIME ZONE,
+    run_from TIMESTAMP WITH TIME ZONE,
+    run_to TIMESTAMP WITH TIME ZONE,
+    cursor TEXT,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+);
@@ -0,0 +1,6 @@
+-- app/migrations/005_signal_price.sql
+-- Цена на момент сигнала: проскальзывание входа считается как trades.price против signals.price
+-- Обе цены в пунктах инструмента: исполнение фьючерсов переводится из рублей по стоимости пункта
+
+ALTER TABLE signals ADD COLUMN IF NOT EXISTS price NUMERIC(18,6);
+CREATE INDEX IF NOT EXISTS idx_trades_created_at_action ON trades (created_at, action) WHERE status = 'success';
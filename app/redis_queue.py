@@ -1,24 +1,26 @@
-import redis
 from pydantic import BaseModel
 import json
-from config import Settings
-
-settings = Settings()
+from utils.redis_client import get_redis
 
 class RedisQueue:
     def __init__(self):
-        self.redis = redis.Redis.from_url(settings.REDIS_URL)
+        self.redis = get_redis()
         self.channel = 'trading_signals'
 
     async def publish_signal(self, signal: dict):
-        self.redis.publish(self.channel, json.dumps(signal))
+        await self.redis.publish(self.channel, json.dumps(signal))
 
     async def listen_signals(self, callback):
         pubsub = self.redis.pubsub()
-        pubsub.subscribe(self.channel)
-        for message in pubsub.listen():
-            if message['type'] == 'message':
-                callback(json.loads(message['data']))
+        await pubsub.subscribe(self.channel)
+        try:
+            async for message in pubsub.listen():
+                if message['type'] == 'message':
+                    result = callback(json.loads(message['data']))
+                    if hasattr(result, '__await__'):
+                        await result
+        finally:
+            await pubsub.aclose()
 
 class TradeSignal(BaseModel):
     action: str  # buy/sell/balance
@@ -0,0 +1,117 @@
+# app/scripts/backtest.py
+# Бэктест SL/мульти-TP по сигналам из event_logs и подбор параметров по сетке.
+# Запуск: cd app && DB_URL=postgresql://... TINKOFF_TOKEN=... python -m scripts.backtest --days 365
+# Сетка: --sl 0.2:1.5:0.05 --tp-scale 0.5:3:0.05 --portions "33,33,34;50,25,25;20,30,50" --breakeven off,on
+# (уровни TP — текущие tp_levels, умноженные на tp-scale). Без сеточных параметров считается только
+# текущая конфигурация бота. Свечи догружаются в отдельное хранилище db/candles/backtest.
+import argparse
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from itertools import product
+
+from trading.backtest import BracketConfig, build_data, grid, load_signals, run
+from trading.candle_store import CANDLE_STORE_DIR, CandleStore
+from trading.market_cache import instrument_info, resolve_figi
+from trading.settings_manager import get_settings
+
+TOKEN = os.getenv("TINKOFF_TOKEN")
+
+def _values(spec: str) -> list[float]:
+    """'0.2:1.5:0.05' — диапазон включительно, '0.3,0.5' — список"""
+    if ":" in spec:
+        start, stop, step = (float(x) for x in spec.split(":"))
+        count = int(round((stop - start) / step)) + 1
+        return [round(start + i * step, 6) for i in range(count)]
+    return [float(x) for x in spec.split(",") if x]
+
+def _portions(spec: str) -> list[tuple[float, ...]]:
+    sets = []
+    for part in spec.split(";"):
+        pct = [float(x) for x in part.split(",") if x]
+        sets.append(tuple(p / sum(pct) for p in pct))
+    return sets
+
+def _configs(args, settings) -> list[BracketConfig]:
+    base = BracketConfig.from_settings(settings)
+    sls = _values(args.sl) if args.sl else [base.stop_loss_percent]
+    scales = _values(args.tp_scale) if args.tp_scale else [1.0]
+    portion_sets = _portions(args.portions) if args.portions else [base.tp_portions]
+    breakevens = [v.strip() == "on" for v in args.breakeven.split(",")] if args.breakeven else [base.breakeven_after_tp]
+    configs = []
+    for sl, scale, portions, be in product(sls, scales, portion_sets, breakevens):
+        # Число уровней подстраивается под число долей, как в `set tp portions`
+        levels = list(base.tp_levels[:len(portions)])
+        while len(levels) < len(portions):
+            levels.append(levels[-1] + 0.5 if levels else 0.5)
+        configs.append(BracketConfig(sl, tuple(round(l * scale, 6) for l in levels), portions, be))
+    return configs
+
+async def _load(args):
+    now = datetime.now(timezone.utc)
+    signals = await load_signals(now - timedelta(days=args.days), now)
+    store = CandleStore(TOKEN, interval=args.interval, path=CANDLE_STORE_DIR / "backtest",
+                        history_days=args.days + 1, max_bars=10_000_000)
+    bars, lot_sizes = {}, {}
+    for symbol in sorted({s[1] for s in signals}):
+        figi = await resolve_figi(TOKEN, symbol)
+        info = await instrument_info(TOKEN, figi) if figi else None
+        if not info:
+            print(f"{symbol}: инструмент не найден, сигналы пропущены")
+            continue
+        added = await store.refresh(figi)
+        bars[symbol] = store.bars(figi)
+        lot_sizes[symbol] = int(info["lot"] or 1)
+        print(f"{symbol}: {len(bars[symbol])} баров (+{added})")
+    return signals, bars, lot_sizes
+
+def main():
+    parser = argparse.ArgumentParser(description="Бэктест SL/мульти-TP по сигналам из event_logs")
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--interval", default="hour", help="5min, 15min, hour, day")
+    parser.add_argument("--max-hold", type=int, default=48, help="максимум баров в позиции")
+    parser.add_argument("--amount", type=float, default=100_000, help="сумма позиции, руб")
+    parser.add_argument("--fee-bps", type=float, default=4.0, help="комиссия на сторону, б.п.")
+    parser.add_argument("--sl")
+    parser.add_argument("--tp-scale")
+    parser.add_argument("--portions")
+    parser.add_argument("--breakeven")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--json", action="store_true", help="результаты JSON-строками")
+    args = parser.parse_args()
+    if not TOKEN or not os.getenv("DB_URL"):
+        print("Нужны TINKOFF_TOKEN и DB_URL")
+        return
+
+    signals, bars, lot_sizes = asyncio.run(_load(args))
+    started = time.perf_counter()
+    data = build_data(signals, bars, lot_sizes, args.amount, args.max_hold, args.fee_bps)
+    print(f"Сигналов: {len(signals)}, в расчёте: {len(data.entry)}, подготовка {time.perf_counter() - started:.2f} с")
+
+    settings = get_settings()
+    current = run(data, BracketConfig.from_settings(settings))
+    configs = _configs(args, settings)
+    started = time.perf_counter()
+    results = grid(data, configs, workers=args.workers)
+    elapsed = time.perf_counter() - started
+    print(f"Конфигураций: {len(configs)}, {elapsed:.1f} с ({len(configs) / elapsed:.0f}/с)")
+
+    if args.json:
+        for r in [current] + results[:args.top]:
+            print(json.dumps(r.to_dict(), ensure_ascii=False))
+        return
+    print(f"\n{'SL%':>6} {'TP%':<22} {'доли':<18} {'BE':<3} {'PnL':>12} {'сделок':>7} {'win':>6} {'PF':>6} {'DD':>10}")
+    for label, r in [("текущие", current)] + [(str(i + 1), r) for i, r in enumerate(results[:args.top])]:
+        c = r.config
+        print(
+            f"{c.stop_loss_percent:>6.2f} {','.join(f'{l:g}' for l in c.tp_levels):<22} "
+            f"{','.join(f'{p * 100:.0f}' for p in c.tp_portions):<18} {'да' if c.breakeven_after_tp else '—':<3} "
+            f"{r.net_pnl:>12.2f} {r.trades:>7} {(r.win_rate or 0) * 100:>5.0f}% "
+            f"{r.profit_factor or 0:>6.2f} {r.max_drawdown:>10.2f}  {label}"
+        )
+
+if __name__ == "__main__":
+    main()
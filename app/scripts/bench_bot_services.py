@@ -0,0 +1,83 @@
+# app/scripts/bench_bot_services.py
+# Время ответа команд бота без отправки в Telegram, мс.
+# Запуск: cd app && TINKOFF_TOKEN=... ACCOUNT_ID=... python -m scripts.bench_bot_services [N] [SYMBOL]
+# Сравнивает старый путь (TinkoffClient/AsyncClient на каждое сообщение) с общими сервисами
+# бота (один BrokerSession и MarketCache на процесс). Только чтение: баланс, позиции, FIGI.
+import asyncio
+import os
+import sys
+import time
+
+from tinkoff.invest import AsyncClient
+
+from trading.broker_session import BrokerSession
+from trading.market_cache import MarketCache
+from trading.order_executor import OrderExecutor
+from trading.order_watcher import LatencyStats
+from trading.tinkoff_client import TinkoffClient
+
+TOKEN = os.getenv("TINKOFF_TOKEN")
+ACCOUNT_ID = os.getenv("ACCOUNT_ID")
+
+async def _measure(n: int, command) -> LatencyStats:
+    stats = LatencyStats(size=n)
+    for _ in range(n):
+        started = time.perf_counter()
+        await command()
+        stats.add((time.perf_counter() - started) * 1000)
+    return stats
+
+def _legacy_commands(symbol: str) -> dict:
+    async def balance():
+        await TinkoffClient(TOKEN, ACCOUNT_ID).get_balance_async()
+
+    async def positions():
+        await TinkoffClient(TOKEN, ACCOUNT_ID).get_positions_async()
+
+    async def figi():
+        async with AsyncClient(TOKEN) as client:
+            await client.instruments.find_instrument(query=symbol)
+
+    return {"balance": balance, "positions": positions, "figi": figi}
+
+def _shared_commands(session: BrokerSession, symbol: str) -> dict:
+    executor = OrderExecutor(TOKEN, ACCOUNT_ID, market=MarketCache(TOKEN, session=session), session=session)
+
+    async def balance():
+        await executor.client.get_balance_async()
+
+    async def positions():
+        await executor.client.get_positions_async()
+
+    async def figi():
+        async with session.api() as client:
+            await client.instruments.find_instrument(query=symbol)
+
+    return {"balance": balance, "positions": positions, "figi": figi}
+
+async def main(n: int, symbol: str):
+    if not TOKEN or not ACCOUNT_ID:
+        print("Нужны TINKOFF_TOKEN и ACCOUNT_ID")
+        return
+    legacy = {name: await _measure(n, cmd) for name, cmd in _legacy_commands(symbol).items()}
+
+    session = BrokerSession(TOKEN)
+    started = time.perf_counter()
+    await session.open()
+    opened_ms = (time.perf_counter() - started) * 1000
+    try:
+        shared = {name: await _measure(n, cmd) for name, cmd in _shared_commands(session, symbol).items()}
+    finally:
+        await session.close()
+
+    print(f"{'команда':<10} {'путь':<10} {'p50':>8} {'p95':>8}")
+    for name in legacy:
+        for label, stats in (("до", legacy[name]), ("после", shared[name])):
+            print(f"{name:<10} {label:<10} {stats.percentile(0.5):>8.1f} {stats.percentile(0.95):>8.1f}")
+    print(f"открытие канала один раз при старте: {opened_ms:.1f} мс")
+
+if __name__ == "__main__":
+    asyncio.run(main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 20,
+        sys.argv[2] if len(sys.argv) > 2 else "SBER",
+    ))
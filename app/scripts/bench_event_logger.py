@@ -0,0 +1,59 @@
+# app/scripts/bench_event_logger.py
+# Пропускная способность журнала событий, событий в секунду.
+# Запуск: cd app && DB_URL=postgresql://... python -m scripts.bench_event_logger [N]
+# Сравнивает старый путь (соединение + INSERT на каждое событие) с буфером и COPY.
+# Пишет в event_logs события с event_type='bench' и удаляет их после замера.
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+import asyncpg
+
+from trading.db_logger import EventLogger
+
+DSN = os.getenv("DB_URL")
+
+async def legacy(n: int) -> float:
+    started = time.perf_counter()
+    for i in range(n):
+        conn = await asyncpg.connect(DSN)
+        await conn.execute(
+            "INSERT INTO event_logs(event_time, event_type, symbol, details, message) VALUES($1, $2, $3, $4, $5)",
+            datetime.now(timezone.utc), "bench", "BENCH", json.dumps({"i": i}), "legacy",
+        )
+        await conn.close()
+    return time.perf_counter() - started
+
+async def buffered(n: int) -> tuple[float, float]:
+    """Возвращает (время постановки в очередь, время до записи в БД)"""
+    event_logger = EventLogger(DSN)
+    await event_logger.start()
+    started = time.perf_counter()
+    for i in range(n):
+        await event_logger.log("bench", "BENCH", {"i": i}, "buffered")
+    enqueued = time.perf_counter() - started
+    await event_logger.stop(timeout=60)
+    return enqueued, time.perf_counter() - started
+
+async def main(n: int):
+    if not DSN:
+        print("DB_URL не задан")
+        return
+    legacy_n = min(n, 500)
+    t_legacy = await legacy(legacy_n)
+    t_enqueue, t_total = await buffered(n)
+    print(f"{'путь':<22} {'событий':>8} {'соб/с':>12}")
+    print(f"{'connect+INSERT':<22} {legacy_n:>8} {legacy_n / t_legacy:>12.0f}")
+    print(f"{'буфер+COPY (запись)':<22} {n:>8} {n / t_total:>12.0f}")
+    print(f"{'log_event (очередь)':<22} {n:>8} {n / t_enqueue:>12.0f}")
+    print(f"задержка log_event: {t_enqueue / n * 1e6:.1f} мкс против {t_legacy / legacy_n * 1e3:.1f} мс")
+
+    conn = await asyncpg.connect(DSN)
+    await conn.execute("DELETE FROM event_logs WHERE event_type = 'bench'")
+    await conn.close()
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 20_000))
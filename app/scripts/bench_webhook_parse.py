@@ -0,0 +1,38 @@
+# app/scripts/bench_webhook_parse.py
+# Микро-бенчмарк разбора и валидации тела вебхука.
+# Запуск: cd app && python -m scripts.bench_webhook_parse
+import json
+import timeit
+
+from pydantic import ValidationError
+from trading.models import WebhookSignal
+
+PAYLOADS = {
+    "buy_risk": b'{"action": "buy", "symbol": "sber", "risk_percent": 0.4}',
+    "sell_qty": b'{"action": "sell", "symbol": "IBU5", "quantity": 5, "sl_percent": 0.35, "tp_percent": 1.2}',
+    "invalid": b'{"action": "buy", "symbol": "NG", "quantity": "five"}',
+}
+
+def legacy_parse(body: bytes):
+    """Старый путь: json.loads + ручные .get без проверки типов"""
+    data = json.loads(body.decode())
+    action = (data.get("action") or "").lower()
+    symbol = data.get("symbol", "").upper() if data.get("symbol") else None
+    return action, symbol, data.get("risk_percent"), data.get("quantity"), data.get("tp_percent"), data.get("sl_percent")
+
+def schema_parse(body: bytes):
+    try:
+        return WebhookSignal.parse(body)
+    except ValidationError:
+        return None
+
+def main(number: int = 100_000):
+    print(f"{'payload':<10} {'legacy, мкс':>12} {'schema, мкс':>12}")
+    for name, body in PAYLOADS.items():
+        legacy = timeit.timeit(lambda: legacy_parse(body), number=number) / number * 1e6
+        schema = timeit.timeit(lambda: schema_parse(body), number=number) / number * 1e6
+        print(f"{name:<10} {legacy:>12.2f} {schema:>12.2f}")
+    print("legacy не проверяет типы: 'five' лотов дойдёт до OrderExecutor")
+
+if __name__ == "__main__":
+    main()
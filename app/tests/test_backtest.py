@@ -0,0 +1,152 @@
+# app/tests/test_backtest.py
+# Векторный бэктест (trading/backtest.py) против побарной симуляции на синтетических свечах.
+# Запуск: cd app && python -m pytest -q tests
+import numpy as np
+import pytest
+
+from trading.backtest import BracketConfig, build_data, run
+from trading.candle_store import CANDLE_DTYPE
+from trading.settings_manager import BotSettings
+
+BAR = 3600
+
+def _bars(rows: list[tuple[float, float, float, float]], start: int = 0) -> np.ndarray:
+    """(open, high, low, close) по барам подряд"""
+    return np.array([(start + i * BAR, o, h, l, c, 0) for i, (o, h, l, c) in enumerate(rows)], dtype=CANDLE_DTYPE)
+
+def _random_bars(rng: np.random.Generator, n: int, price: float) -> np.ndarray:
+    rows = []
+    for _ in range(n):
+        o = price
+        c = o * (1 + rng.normal(0, 0.006))
+        h = max(o, c) * (1 + abs(rng.normal(0, 0.004)))
+        l = min(o, c) * (1 - abs(rng.normal(0, 0.004)))
+        rows.append((o, h, l, c))
+        price = c
+    return _bars(rows)
+
+def _simulate(signals, bars, lot_sizes, amount, max_hold, fee_bps, config: BracketConfig):
+    """Побарная симуляция тех же правил: SL проверяется раньше TP на том же баре,
+    стоп в безубыток действует со следующего бара после первого TP"""
+    settings = BotSettings(tp_levels=list(config.tp_levels), tp_portions=list(config.tp_portions))
+    by_symbol: dict[str, list] = {}
+    for ts, symbol, action in signals:
+        if symbol in bars and len(bars[symbol]):
+            by_symbol.setdefault(symbol, []).append((ts, 1 if action == "buy" else -1))
+
+    trades = []  # (время сигнала, pnl, tp-исполнений, sl-исполнений)
+    for symbol, items in by_symbol.items():
+        b = bars[symbol]
+        starts = [int(np.searchsorted(b["time"], ts, side="left")) for ts, _ in items]
+        for k, (ts, direction) in enumerate(items):
+            start = starts[k]
+            end = min(starts[k + 1] if k + 1 < len(items) else len(b), start + max_hold)
+            if start >= end:
+                continue
+            entry = float(b["open"][start])
+            lot_size = lot_sizes.get(symbol, 1)
+            lots = int(np.floor(amount / (entry * lot_size)))
+            if lots <= 0:
+                continue
+            split = [0] * len(config.tp_levels)
+            for level, (_, n) in enumerate(settings.get_tp_distribution(lots)[:len(split)]):
+                split[level] = n
+
+            outcome = [None] * len(split)  # % результата по каждому уровню
+            first_tp_bar = None
+            tp_fills = sl_fills = 0
+            for j in range(start, end):
+                up = (float(b["high"][j]) / entry - 1) * 100
+                down = (1 - float(b["low"][j]) / entry) * 100
+                favorable, adverse = (up, down) if direction > 0 else (down, up)
+                breakeven = config.breakeven_after_tp and first_tp_bar is not None and j > first_tp_bar
+                stop = 0.0 if breakeven and adverse >= 0 else config.stop_loss_percent
+                if adverse >= stop:
+                    for level in range(len(split)):
+                        if outcome[level] is None:
+                            outcome[level] = -stop
+                            sl_fills += split[level] > 0
+                    break
+                for level, tp in enumerate(config.tp_levels):
+                    if outcome[level] is None and favorable >= tp:
+                        outcome[level] = tp
+                        tp_fills += split[level] > 0
+                        if first_tp_bar is None:
+                            first_tp_bar = j
+                if all(o is not None for o in outcome):
+                    break
+            exit_pct = (float(b["close"][end - 1]) / entry - 1) * 100 * direction
+            notional = [entry * lot_size * n for n in split]
+            pnl = sum(n * (exit_pct if o is None else o) / 100 for n, o in zip(notional, outcome))
+            pnl -= 2 * fee_bps / 10_000 * sum(notional)
+            trades.append((ts, pnl, tp_fills, sl_fills))
+
+    trades.sort(key=lambda t: t[0])
+    return (
+        sum(t[1] for t in trades), len(trades),
+        sum(t[2] for t in trades), sum(t[3] for t in trades),
+    )
+
+def _check(signals, bars, lot_sizes, config, amount=100_000, max_hold=24, fee_bps=4.0):
+    data = build_data(signals, bars, lot_sizes, amount, max_hold, fee_bps)
+    result = run(data, config)
+    pnl, trades, tp_fills, sl_fills = _simulate(signals, bars, lot_sizes, amount, max_hold, fee_bps, config)
+    assert result.trades == trades
+    assert result.net_pnl == pytest.approx(pnl, abs=0.02)
+    assert (result.tp_fills, result.sl_fills) == (tp_fills, sl_fills)
+    return result
+
+@pytest.mark.parametrize("breakeven", [False, True])
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_matches_bar_by_bar_simulation(seed, breakeven):
+    rng = np.random.default_rng(seed)
+    bars = {"AAA": _random_bars(rng, 400, 100.0), "BBB": _random_bars(rng, 400, 2500.0)}
+    lot_sizes = {"AAA": 10, "BBB": 1}
+    signals = []
+    for symbol in bars:
+        times = np.sort(rng.choice(400 * BAR, size=30, replace=False)).astype(float)
+        signals += [(t, symbol, "buy" if rng.random() < 0.5 else "sell") for t in times]
+    signals.sort()
+    for sl, levels, portions in [
+        (0.5, (0.5, 1.0, 1.6), (0.33, 0.33, 0.34)),
+        (1.2, (0.3, 0.8), (0.5, 0.5)),
+        (0.3, (1.0,), (1.0,)),
+    ]:
+        _check(signals, bars, lot_sizes, BracketConfig(sl, levels, portions, breakeven))
+
+def test_sl_wins_when_tp_and_sl_hit_on_same_bar():
+    # Вход 100; второй бар задевает и TP 1% (101), и SL 1% (99)
+    bars = {"AAA": _bars([(100, 100.2, 99.8, 100), (100, 101.5, 98.5, 100), (100, 100.1, 99.9, 100)])}
+    config = BracketConfig(1.0, (1.0,), (1.0,))
+    result = _check([(0.0, "AAA", "buy")], bars, {"AAA": 1}, config, amount=1000, fee_bps=0)
+    assert (result.tp_fills, result.sl_fills) == (0, 1)
+    assert result.net_pnl == pytest.approx(-10.0)
+
+def test_breakeven_after_first_tp():
+    # TP1 0.5% на втором баре, дальше цена возвращается ко входу, исходный SL 1% не задет
+    bars = {"AAA": _bars([
+        (100, 100.2, 99.9, 100.1),
+        (100.1, 100.6, 100.0, 100.4),
+        (100.4, 100.5, 99.95, 100.0),
+        (100.0, 100.2, 99.5, 99.6),
+    ])}
+    config = BracketConfig(1.0, (0.5, 2.0), (0.5, 0.5), breakeven_after_tp=True)
+    result = _check([(0.0, "AAA", "buy")], bars, {"AAA": 1}, config, amount=1000, fee_bps=0)
+    # 5 лотов по TP1 (+0.5%), 5 — по стопу на входе (0%)
+    assert (result.tp_fills, result.sl_fills) == (1, 1)
+    assert result.net_pnl == pytest.approx(2.5)
+
+    without = _check([(0.0, "AAA", "buy")], bars, {"AAA": 1}, BracketConfig(1.0, (0.5, 2.0), (0.5, 0.5)),
+                     amount=1000, fee_bps=0)
+    # Без переноса вторая половина выходит по закрытию последнего бара (-0.4%)
+    assert without.net_pnl == pytest.approx(2.5 - 2.0)
+
+def test_breakeven_and_original_sl_on_same_bar():
+    # После TP1 бар пробивает и вход, и исходный SL: срабатывает ближний стоп на входе
+    bars = {"AAA": _bars([
+        (100, 100.6, 99.9, 100.4),
+        (100.4, 100.5, 98.0, 98.5),
+    ])}
+    config = BracketConfig(1.0, (0.5, 2.0), (0.5, 0.5), breakeven_after_tp=True)
+    result = _check([(0.0, "AAA", "buy")], bars, {"AAA": 1}, config, amount=1000, fee_bps=0)
+    assert result.net_pnl == pytest.approx(2.5)
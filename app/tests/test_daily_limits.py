@@ -0,0 +1,116 @@
+# app/tests/test_daily_limits.py
+# Резервирование дневных лимитов (_RESERVE_LUA) на fakeredis с Lua (lupa).
+# Запуск: cd app && python -m pytest -q tests
+import asyncio
+from decimal import Decimal
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")
+
+from trading import daily_limits
+from trading.daily_limits import DailyLimits
+from trading.settings_manager import BotSettings
+
+ACCOUNT = "acc"
+
+@pytest.fixture
+def redis(monkeypatch):
+    client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    monkeypatch.setattr(daily_limits, "get_redis", lambda: client)
+    return client
+
+def _run(coro):
+    return asyncio.run(coro)
+
+def _settings(**kwargs) -> BotSettings:
+    return BotSettings(**kwargs)
+
+def test_notional_limit_boundary(redis):
+    limits = DailyLimits()
+    settings = _settings(max_daily_notional=1000)
+
+    async def scenario():
+        first = await limits.reserve(ACCOUNT, "SBER", Decimal("600"), settings)
+        # Ровно до лимита — разрешено
+        second = await limits.reserve(ACCOUNT, "SBER", Decimal("400"), settings)
+        third = await limits.reserve(ACCOUNT, "SBER", Decimal("1"), settings)
+        return first, second, third, await limits.snapshot(ACCOUNT)
+
+    first, second, third, snapshot = _run(scenario())
+    assert first.ok and second.ok
+    assert not third.ok and "дневной оборот" in third.reason
+    assert snapshot == {"notional": 1000}
+
+def test_rejection_reserves_nothing(redis):
+    limits = DailyLimits()
+    settings = _settings(max_daily_notional=1000, max_daily_trades_per_symbol=1)
+
+    async def scenario():
+        assert (await limits.reserve(ACCOUNT, "SBER", Decimal("100"), settings)).ok
+        # Лимит входов по SBER исчерпан: оборот этой заявки тоже не резервируется
+        rejected = await limits.reserve(ACCOUNT, "SBER", Decimal("100"), settings)
+        other = await limits.reserve(ACCOUNT, "GAZP", Decimal("100"), settings)
+        return rejected, other, await limits.snapshot(ACCOUNT)
+
+    rejected, other, snapshot = _run(scenario())
+    assert not rejected.ok and "входов по SBER" in rejected.reason
+    assert other.ok
+    assert snapshot == {"notional": 200, "trades:SBER": 1, "trades:GAZP": 1}
+
+def test_loss_limit_checked_without_increment(redis):
+    limits = DailyLimits()
+    settings = _settings(max_daily_loss=500)
+
+    async def scenario():
+        before = await limits.reserve(ACCOUNT, "SBER", Decimal("100"), settings)
+        await limits.record_loss(ACCOUNT, Decimal("499.2"))
+        # Убыток округляется вверх: 500 ≥ 500 — входы запрещены
+        after = await limits.reserve(ACCOUNT, "SBER", Decimal("100"), settings)
+        return before, after, await limits.snapshot(ACCOUNT)
+
+    before, after, snapshot = _run(scenario())
+    assert before.ok and before.increments == {}
+    assert not after.ok and "дневной убыток" in after.reason
+    assert snapshot == {"loss": 500}
+
+def test_profit_and_duplicate_fill_do_not_count(redis):
+    limits = DailyLimits()
+
+    async def scenario():
+        await limits.record_loss(ACCOUNT, Decimal("-50"))
+        await limits.record_loss(ACCOUNT, Decimal("120"), ref="order-1:trade-1")
+        await limits.record_loss(ACCOUNT, Decimal("120"), ref="order-1:trade-1")
+        await limits.record_loss(ACCOUNT, Decimal("30"), ref="order-2:trade-2")
+        return await limits.snapshot(ACCOUNT)
+
+    assert _run(scenario()) == {"loss": 150}
+
+def test_release_after_failed_order(redis):
+    limits = DailyLimits()
+    settings = _settings(max_daily_notional=1000, max_daily_trades_per_symbol=1, max_daily_loss=500)
+
+    async def scenario():
+        reservation = await limits.reserve(ACCOUNT, "SBER", Decimal("800"), settings)
+        assert reservation.ok
+        # Заявка не исполнилась — резерв возвращается, вход снова доступен
+        await reservation.release()
+        await reservation.release()  # повторный вызов ничего не меняет
+        again = await limits.reserve(ACCOUNT, "SBER", Decimal("1000"), settings)
+        return again, await limits.snapshot(ACCOUNT)
+
+    again, snapshot = _run(scenario())
+    assert again.ok
+    assert snapshot == {"notional": 1000, "trades:SBER": 1}
+
+def test_keys_expire_after_trading_day(redis):
+    limits = DailyLimits()
+
+    async def scenario():
+        await limits.reserve(ACCOUNT, "SBER", Decimal("10"), _settings(max_daily_notional=1000))
+        base, expire_at = limits._keys(ACCOUNT)
+        return await redis.expiretime(f"{base}:notional"), expire_at
+
+    ttl_at, expire_at = _run(scenario())
+    assert ttl_at == expire_at
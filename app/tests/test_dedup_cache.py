@@ -0,0 +1,71 @@
+# app/tests/test_dedup_cache.py
+# Окна подавления повторов вебхука (SignalDeduplicator) на fakeredis.
+# Запуск: cd app && python -m pytest -q tests
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from utils import dedup_cache
+from utils.dedup_cache import SignalDeduplicator
+
+@pytest.fixture
+def redis(monkeypatch):
+    client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    monkeypatch.setattr(dedup_cache, "get_redis", lambda: client)
+    return client
+
+def _job(calls: list):
+    async def job():
+        calls.append(1)
+        return {"success": True, "n": len(calls)}
+    return job
+
+def test_ttl_depends_on_timestamp_or_nonce():
+    dedup = SignalDeduplicator(ttl=600, max_age=120, anonymous_ttl=5)
+    assert dedup.ttl_for(None, None) == 5
+    assert dedup.ttl_for(datetime.now(timezone.utc), None) == 600
+    assert dedup.ttl_for(None, "n-1") == 600
+
+def test_anonymous_repeat_runs_again_after_short_window(redis, monkeypatch):
+    dedup = SignalDeduplicator(ttl=600, max_age=120, anonymous_ttl=5)
+    key = dedup.make_key(b'{"action": "buy", "symbol": "SBER"}')
+    calls = []
+    now = [1000.0]
+    monkeypatch.setattr(dedup_cache.time, "monotonic", lambda: now[0])
+
+    async def scenario():
+        ttl = dedup.ttl_for(None, None)
+        first = await dedup.run_once(key, _job(calls), ttl=ttl)
+        retry = await dedup.run_once(key, _job(calls), ttl=ttl)
+        # Через минуту тот же сигнал без timestamp/nonce — новый вход, а не ретрай
+        now[0] += 60
+        await redis.delete(dedup.prefix + key)  # ключ в Redis истёк по ex=ttl
+        again = await dedup.run_once(key, _job(calls), ttl=ttl)
+        return first, retry, again, await redis.ttl(dedup.prefix + key)
+
+    first, retry, again, redis_ttl = asyncio.run(scenario())
+    assert first == ({"success": True, "n": 1}, False)
+    assert retry == ({"success": True, "n": 1}, True)
+    assert again == ({"success": True, "n": 2}, False)
+    assert 0 < redis_ttl <= 5
+
+def test_identified_repeat_suppressed_for_long_window(redis):
+    dedup = SignalDeduplicator(ttl=600, max_age=120, anonymous_ttl=5)
+    key = dedup.make_key(b'{"action": "buy", "symbol": "SBER", "nonce": "n-1"}')
+    calls = []
+
+    async def scenario():
+        ttl = dedup.ttl_for(None, "n-1")
+        await dedup.run_once(key, _job(calls), ttl=ttl)
+        # Другой воркер: только Redis
+        other = SignalDeduplicator(ttl=600, max_age=120, anonymous_ttl=5)
+        repeat = await other.run_once(key, _job(calls), ttl=ttl)
+        return repeat, await redis.ttl(dedup.prefix + key)
+
+    repeat, redis_ttl = asyncio.run(scenario())
+    assert repeat == ({"success": True, "n": 1}, True)
+    assert len(calls) == 1
+    assert redis_ttl > 5
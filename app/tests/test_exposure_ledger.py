@@ -0,0 +1,28 @@
+# app/tests/test_exposure_ledger.py
+# Предторговые проверки и сверка журнала экспозиции (ExposureLedger).
+# Запуск: cd app && python -m pytest -q tests
+from decimal import Decimal
+
+from trading.exposure_ledger import ExposureLedger
+from trading.settings_manager import BotSettings
+
+FIGI = "FUTSI0000000"
+
+def test_unknown_price_rejected_only_under_notional_limits(tmp_path):
+    ledger = ExposureLedger(tmp_path / "exposure.json")
+    assert ledger.check(FIGI, 1, Decimal(0), settings=BotSettings(max_symbol_notional=100000))
+    assert ledger.check(FIGI, 1, Decimal(0), settings=BotSettings(max_daily_notional=100000))
+    assert ledger.check(FIGI, 1, Decimal(0), settings=BotSettings()) is None
+    assert ledger.check(FIGI, 1, Decimal("90000"), settings=BotSettings(max_symbol_notional=100000)) is None
+
+def test_sync_seeds_price_only_for_unpriced_rows(tmp_path):
+    ledger = ExposureLedger(tmp_path / "exposure.json")
+    ledger.apply_fill("KNOWN", 2, Decimal("1000"))
+    positions = {"KNOWN": 3, FIGI: -4}
+    assert ledger.unpriced(positions) == [FIGI]
+    # Цена из портфеля не перетирает уже известную цену входа
+    assert ledger.sync_positions(positions, {FIGI: Decimal("25000"), "KNOWN": Decimal("1")})
+    assert ledger.get("KNOWN").price_per_lot == Decimal("1000")
+    assert ledger.get(FIGI).price_per_lot == Decimal("25000")
+    assert ledger.total_notional == 3 * Decimal("1000") + 4 * Decimal("25000")
+    assert not ledger.sync_positions(positions)
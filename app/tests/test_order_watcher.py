@@ -0,0 +1,93 @@
+# app/tests/test_order_watcher.py
+# Результат закрытий OrderWatcher в дневной счётчик убытка: пункты → рубли, вход из портфеля.
+# Запуск: cd app && python -m pytest -q tests
+import asyncio
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+
+from trading import order_watcher
+from trading.order_watcher import OrderWatcher
+
+# Фьючерс на индекс РТС: шаг цены 10 пунктов стоит 13.5 руб. — пункт 1.35 руб.
+FIGI = "FUTRTS000000"
+INFO = {"ticker": "RIZ6", "lot": 1, "point_value": Decimal("13.5") / Decimal("10")}
+
+def _q(value) -> SimpleNamespace:
+    value = Decimal(str(value))
+    return SimpleNamespace(units=int(value), nano=int((value - int(value)) * 1_000_000_000))
+
+async def _async(value):
+    return value
+
+class _Executor:
+    def _quotation_to_decimal(self, q) -> Decimal:
+        return Decimal(q.units) + Decimal(q.nano) / Decimal(1_000_000_000)
+
+    async def _get_instrument_info(self, figi: str):
+        return INFO if figi == FIGI else None
+
+class _Limits:
+    def __init__(self):
+        self.losses = []
+
+    async def record_loss(self, account_id: str, loss: Decimal, ref: str = None):
+        self.losses.append(loss)
+
+@pytest.fixture
+def limits(monkeypatch):
+    limits = _Limits()
+    monkeypatch.setattr(order_watcher, "get_daily_limits", lambda: limits)
+    return limits
+
+def _trades(order_id: str) -> SimpleNamespace:
+    return SimpleNamespace(order_id=order_id, trades=[SimpleNamespace(trade_id="t1")])
+
+async def _settle(watcher: OrderWatcher):
+    await asyncio.gather(*watcher._tasks)
+
+def test_stream_close_loss_in_rubles(limits):
+    watcher = OrderWatcher("token", "acc", _Executor())
+
+    async def scenario():
+        watcher._on_position_change(FIGI, 0, 2, Decimal("100000"), _trades("o1"))
+        watcher._on_position_change(FIGI, 2, 0, Decimal("99000"), _trades("o2"))
+        await _settle(watcher)
+
+    asyncio.run(scenario())
+    # 1000 пунктов × 2 лота × 1.35 руб.
+    assert limits.losses == [Decimal("2700")]
+
+def test_entry_seeded_from_portfolio(limits):
+    watcher = OrderWatcher("token", "acc", _Executor())
+    operations = SimpleNamespace(
+        get_positions=lambda account_id: _async(SimpleNamespace(securities=[], futures=[
+            SimpleNamespace(figi=FIGI, balance=-1),
+        ])),
+        # Средняя цена позиции брокера в рублях: 100000 пунктов × 1.35
+        get_portfolio=lambda account_id: _async(SimpleNamespace(positions=[
+            SimpleNamespace(figi=FIGI, average_position_price=_q("135000")),
+        ])),
+    )
+
+    async def scenario():
+        await watcher._reconcile(SimpleNamespace(operations=operations))
+        watcher._on_position_change(FIGI, -1, 0, Decimal("99000"), _trades("o1"))
+        await _settle(watcher)
+
+    asyncio.run(scenario())
+    assert watcher._entries == {}
+    # Шорт закрыт ниже входа: прибыль 1350 руб., в счётчик убытка уходит со знаком минус
+    assert limits.losses == [Decimal("-1350")]
+
+def test_unknown_entry_not_recorded(limits):
+    watcher = OrderWatcher("token", "acc", _Executor())
+
+    async def scenario():
+        watcher._positions[FIGI] = 1
+        watcher._on_position_change(FIGI, 1, 0, Decimal("99000"), _trades("o1"))
+        await _settle(watcher)
+
+    asyncio.run(scenario())
+    assert limits.losses == []
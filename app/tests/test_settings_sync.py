@@ -0,0 +1,73 @@
+# app/tests/test_settings_sync.py
+# Синхронизация настроек через Redis (SettingsSync) на fakeredis с Lua (lupa).
+# Запуск: cd app && python -m pytest -q tests
+import asyncio
+import json
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")
+
+from trading import settings_sync
+from trading.settings_manager import SettingsManager
+from trading.settings_sync import SETTINGS_KEY, SettingsSync
+
+@pytest.fixture
+def redis(monkeypatch):
+    client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    monkeypatch.setattr(settings_sync, "get_redis", lambda: client)
+    return client
+
+def _edit_file(manager: SettingsManager, **changes):
+    data = json.loads(manager.path.read_text(encoding="utf-8"))
+    data.update(changes)
+    manager.path.write_text(json.dumps(data), encoding="utf-8")
+    # mtime в тестах может не успеть измениться — сбрасываем запомненный
+    manager._mtime_ns = None
+
+def test_file_edit_is_published_once(redis, tmp_path):
+    manager = SettingsManager(tmp_path / "bot_settings.json")
+    sync = SettingsSync(manager)
+
+    async def scenario():
+        await sync.start()
+        try:
+            start_version = int(await redis.hget(SETTINGS_KEY, "version"))
+            _edit_file(manager, stop_loss_percent=1.7)
+            manager.reload_now()
+            await asyncio.sleep(0.05)
+            edited = await redis.hgetall(SETTINGS_KEY)
+            # Перезапись файла тем же снимком (apply_remote соседа на общем томе) не публикуется
+            _edit_file(manager)
+            manager.reload_now()
+            await asyncio.sleep(0.05)
+            return start_version, edited, int(await redis.hget(SETTINGS_KEY, "version"))
+        finally:
+            await sync.stop()
+
+    start_version, edited, final_version = asyncio.run(scenario())
+    assert int(edited["version"]) == start_version + 1
+    assert json.loads(edited["data"])["stop_loss_percent"] == 1.7
+    assert final_version == start_version + 1
+    assert manager.version == final_version
+
+def test_remote_version_is_not_republished(redis, tmp_path):
+    manager = SettingsManager(tmp_path / "bot_settings.json")
+    other = SettingsManager(tmp_path / "other" / "bot_settings.json")
+    sync, other_sync = SettingsSync(manager), SettingsSync(other)
+
+    async def scenario():
+        await sync.start()
+        await other_sync.start()
+        try:
+            other.update(stop_loss_percent=2.5)
+            await asyncio.sleep(0.1)
+            return int(await redis.hget(SETTINGS_KEY, "version"))
+        finally:
+            await sync.stop()
+            await other_sync.stop()
+
+    version = asyncio.run(scenario())
+    assert manager.get().stop_loss_percent == 2.5
+    assert manager.version == other.version == version
@@ -0,0 +1,78 @@
+# app/trading/accounts.py
+# Счета, на которые исполняются сигналы.
+# Без конфигурации — один счёт из TINKOFF_TOKEN/ACCOUNT_ID, как раньше.
+# Мультисчётный режим: TRADING_ACCOUNTS_FILE (JSON-список) или TRADING_ACCOUNTS (та же JSON-строка).
+# Токены в файл не пишутся — у счёта указывается имя переменной окружения с токеном:
+#   [{"name": "main", "account_id": "2000...", "token_env": "TINKOFF_TOKEN"},
+#    {"name": "family", "account_id": "2001...", "token_env": "TINKOFF_TOKEN_FAMILY",
+#     "risk_long_percent": 15, "risk_short_percent": 10, "leverage": 2}]
+# Справочные и рыночные данные (MarketCache) общие, исполнитель и клиент — свои у каждого счёта.
+import os
+import json
+import logging
+from decimal import Decimal
+from pathlib import Path
+from typing import Optional
+
+from pydantic import BaseModel, ConfigDict, Field
+
+from .market_cache import MarketCache
+from .order_executor import OrderExecutor
+from .tinkoff_client import TinkoffClient
+
+logger = logging.getLogger(__name__)
+
+class AccountConfig(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    name: str
+    account_id: str
+    token_env: str = "TINKOFF_TOKEN"
+    # Переопределения настроек бота для счёта; None — общие значения из BotSettings / LEVERAGE
+    risk_long_percent: Optional[float] = Field(default=None, ge=0, le=100)
+    risk_short_percent: Optional[float] = Field(default=None, ge=0, le=100)
+    leverage: Optional[Decimal] = Field(default=None, gt=0)
+    enabled: bool = True
+
+class TradingAccount:
+    def __init__(self, config: AccountConfig, token: str, market: MarketCache):
+        self.config = config
+        self.name = config.name
+        self.token = token
+        self.account_id = config.account_id
+        self.market = market
+        self.client = TinkoffClient(token, config.account_id, market=market)
+
+    def new_executor(self) -> OrderExecutor:
+        # Исполнитель хранит промежуточное состояние расчёта лотов — свой на каждую ногу
+        return OrderExecutor(self.token, self.account_id, market=self.market)
+
+    def risk_percent(self, action: str) -> Optional[float]:
+        return self.config.risk_long_percent if action == "buy" else self.config.risk_short_percent
+
+def _load_configs() -> list[AccountConfig]:
+    raw = None
+    path = os.getenv("TRADING_ACCOUNTS_FILE")
+    if path:
+        raw = Path(path).read_text(encoding="utf-8")
+    elif os.getenv("TRADING_ACCOUNTS"):
+        raw = os.getenv("TRADING_ACCOUNTS")
+    if not raw:
+        return [AccountConfig(name="main", account_id=os.getenv("ACCOUNT_ID", ""))]
+    return [AccountConfig(**item) for item in json.loads(raw)]
+
+def load_accounts(market: MarketCache) -> list[TradingAccount]:
+    accounts = []
+    for config in _load_configs():
+        if not config.enabled:
+            continue
+        token = os.getenv(config.token_env)
+        if not token:
+            logger.error(f"Account {config.name}: env {config.token_env} is empty, account skipped")
+            continue
+        accounts.append(TradingAccount(config, token, market))
+    names = [a.name for a in accounts]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate account names in accounts config: {names}")
+    logger.info(f"Trading accounts: {', '.join(names) or 'none'}")
+    return accounts
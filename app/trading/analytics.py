@@ -0,0 +1,410 @@
+# app/trading/analytics.py
+# Отчёт по PnL и качеству исполнения на NumPy.
+# Операции брокера (broker_operations), сделки (trades), сигналы (signals) и выставленные TP
+# (event_logs) загружаются колонками в массивы, все агрегаты считаются векторно.
+# Закрытые дни (старше вчерашнего по МСК) кэшируются: дневные суммы по символам и исполнения
+# догружаются только за дни, которых ещё нет в кэше, открытое окно читается заново.
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, field, asdict
+from datetime import datetime, timezone
+from typing import Optional
+
+import asyncpg
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DATABASE_URL = os.getenv("DB_URL")
+ACCOUNT_ID = os.getenv("ACCOUNT_ID")
+# Сколько дней истории загружается при первом построении
+REPORT_HISTORY_DAYS = int(os.getenv("REPORT_HISTORY_DAYS", "400"))
+# Операции догружаются синхронизацией с перекрытием, поэтому вчерашний день ещё считается открытым
+CLOSED_LAG_DAYS = 1
+# TP выставляются сразу после входа: ищем их в этом окне от первого исполнения (сек)
+TP_MATCH_WINDOW = 60
+
+_MSK_OFFSET = 3 * 3600
+_DAY = 86400
+
+_PNL_SQL = """
+SELECT extract(epoch FROM date)::float8, figi, type, payment::float8
+FROM broker_operations
+WHERE account_id = $1 AND state = 'OPERATION_STATE_EXECUTED' AND figi IS NOT NULL
+  AND (type LIKE '%VARMARGIN%' OR type LIKE '%FEE%')
+  AND date >= $2 AND date < $3
+"""
+
+_FILLS_SQL = """
+SELECT extract(epoch FROM date)::float8, figi, type, COALESCE(NULLIF(quantity_done, 0), quantity)::float8, price::float8
+FROM broker_operations
+WHERE account_id = $1 AND state = 'OPERATION_STATE_EXECUTED' AND figi IS NOT NULL
+  AND type IN ('OPERATION_TYPE_BUY', 'OPERATION_TYPE_SELL')
+  AND date >= $2 AND date < $3
+"""
+
+_TP_SQL = """
+SELECT extract(epoch FROM event_time)::float8, symbol, (details->>'price')::float8
+FROM event_logs
+WHERE event_type = 'tp_order' AND event_time >= $1 AND details ? 'price'
+ORDER BY symbol, event_time
+"""
+
+_SLIPPAGE_SQL = """
+SELECT t.ticker, t.direction, t.price::float8, s.price::float8
+FROM trades t
+JOIN signals s ON s.id = t.signal_id
+WHERE t.action = 'open' AND t.status = 'success'
+  AND t.price IS NOT NULL AND s.price IS NOT NULL AND t.created_at >= $1
+"""
+
+_NAMES_SQL = "SELECT DISTINCT ON (figi) figi, ticker FROM trades WHERE ticker IS NOT NULL ORDER BY figi, created_at DESC"
+
+def _day_start(day: int) -> datetime:
+    """Начало дня МСК с номером day (дни от эпохи) в UTC"""
+    return datetime.fromtimestamp(day * _DAY - _MSK_OFFSET, tz=timezone.utc)
+
+def _day_label(day: int) -> str:
+    # Номер дня считается со сдвигом МСК, поэтому календарная дата — это UTC-дата от day * сутки
+    return datetime.fromtimestamp(day * _DAY, tz=timezone.utc).strftime("%Y-%m-%d")
+
+def _msk_day(ts: np.ndarray) -> np.ndarray:
+    return ((ts + _MSK_OFFSET) // _DAY).astype(np.int64)
+
+def _today() -> int:
+    return int(_msk_day(np.array([time.time()]))[0])
+
+@dataclass
+class SymbolStats:
+    symbol: str
+    pnl: float
+    fees: float
+    trips: int
+    win_rate: Optional[float]
+
+@dataclass
+class PnLReport:
+    date_from: str
+    date_to: str
+    net_pnl: float
+    varmargin: float
+    fees: float
+    max_drawdown: float
+    best_day: Optional[tuple[str, float]]
+    worst_day: Optional[tuple[str, float]]
+    trips: int
+    win_rate: Optional[float]
+    avg_tp_level: Optional[float]
+    tp_trips: int
+    avg_slippage_bps: Optional[float]
+    slippage_samples: int
+    symbols: list[SymbolStats] = field(default_factory=list)
+    days: list[tuple[str, float]] = field(default_factory=list)
+    build_ms: int = 0
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def format(self) -> str:
+        def pct(v: Optional[float]) -> str:
+            return f"{v * 100:.0f}%" if v is not None else "—"
+
+        lines = [
+            f"📈 Отчёт {self.date_from} — {self.date_to}",
+            f"Итог: {self.net_pnl:+.2f} ₽ (вар. маржа {self.varmargin:+.2f}, комиссии {self.fees:+.2f})",
+            f"Макс. просадка: {self.max_drawdown:.2f} ₽",
+        ]
+        if self.best_day and self.worst_day:
+            lines.append(f"Лучший день: {self.best_day[0]} {self.best_day[1]:+.2f}, худший: {self.worst_day[0]} {self.worst_day[1]:+.2f}")
+        lines.append(f"Сделок: {self.trips}, прибыльных: {pct(self.win_rate)}")
+        if self.tp_trips:
+            lines.append(f"Средний достигнутый TP: {self.avg_tp_level:.2f} (сделок с TP: {self.tp_trips})")
+        if self.slippage_samples:
+            lines.append(f"Проскальзывание к цене сигнала: {self.avg_slippage_bps:+.1f} б.п. ({self.slippage_samples} входов)")
+        if self.symbols:
+            lines.append("")
+            for s in self.symbols:
+                lines.append(f"• {s.symbol}: {s.pnl + s.fees:+.2f} ₽, сделок {s.trips}, прибыльных {pct(s.win_rate)}")
+        lines.append(f"\n⏱ {self.build_ms} мс")
+        return "\n".join(lines)
+
+class ReportEngine:
+    def __init__(self, dsn: str = DATABASE_URL, account_id: str = ACCOUNT_ID):
+        self.dsn = dsn
+        self.account_id = account_id
+        self._lock = asyncio.Lock()
+        self._sym_index: dict[str, int] = {}
+        self._figis: list[str] = []
+        self._names: dict[str, str] = {}
+        # Кэш закрытых дней: номер дня МСК, символ, вар. маржа, комиссии
+        self._closed_until: Optional[int] = None
+        self._daily = self._empty_daily()
+        # Кэш исполнений закрытых дней: время, символ, количество со знаком, цена
+        self._fills = self._empty_fills()
+
+    @staticmethod
+    def _empty_daily() -> dict[str, np.ndarray]:
+        return {"day": np.empty(0, np.int64), "sym": np.empty(0, np.int64),
+                "pnl": np.empty(0, np.float64), "fee": np.empty(0, np.float64)}
+
+    @staticmethod
+    def _empty_fills() -> dict[str, np.ndarray]:
+        return {"ts": np.empty(0, np.float64), "sym": np.empty(0, np.int64),
+                "qty": np.empty(0, np.float64), "price": np.empty(0, np.float64)}
+
+    def _intern(self, figis: list) -> np.ndarray:
+        """Индексы символов для колонки FIGI: np.unique + словарь только по уникальным значениям"""
+        if not figis:
+            return np.empty(0, np.int64)
+        uniq, inverse = np.unique(np.asarray(figis, dtype=object), return_inverse=True)
+        ids = np.empty(len(uniq), np.int64)
+        for i, figi in enumerate(uniq):
+            idx = self._sym_index.get(figi)
+            if idx is None:
+                idx = self._sym_index[figi] = len(self._figis)
+                self._figis.append(figi)
+            ids[i] = idx
+        return ids[inverse]
+
+    # ---------- загрузка ----------
+
+    def _aggregate_pnl(self, rows) -> dict[str, np.ndarray]:
+        if not rows:
+            return self._empty_daily()
+        ts = np.fromiter((r[0] for r in rows), np.float64, len(rows))
+        sym = self._intern([r[1] for r in rows])
+        types = np.array([r[2] for r in rows], dtype=str)
+        payment = np.fromiter((r[3] or 0.0 for r in rows), np.float64, len(rows))
+        is_fee = np.char.find(types, "FEE") >= 0
+
+        day = _msk_day(ts)
+        key = (day << 20) | sym
+        keys, inverse = np.unique(key, return_inverse=True)
+        return {
+            "day": keys >> 20,
+            "sym": keys & ((1 << 20) - 1),
+            "pnl": np.bincount(inverse, weights=np.where(is_fee, 0.0, payment), minlength=len(keys)),
+            "fee": np.bincount(inverse, weights=np.where(is_fee, payment, 0.0), minlength=len(keys)),
+        }
+
+    def _parse_fills(self, rows) -> dict[str, np.ndarray]:
+        if not rows:
+            return self._empty_fills()
+        sign = np.array([1.0 if r[2] == "OPERATION_TYPE_BUY" else -1.0 for r in rows])
+        return {
+            "ts": np.fromiter((r[0] for r in rows), np.float64, len(rows)),
+            "sym": self._intern([r[1] for r in rows]),
+            "qty": sign * np.fromiter((r[3] or 0.0 for r in rows), np.float64, len(rows)),
+            "price": np.fromiter((r[4] or 0.0 for r in rows), np.float64, len(rows)),
+        }
+
+    @staticmethod
+    def _concat(a: dict, b: dict) -> dict:
+        return {k: np.concatenate([a[k], b[k]]) for k in a}
+
+    async def _load(self, conn, sql: str, start: int, end: Optional[int]):
+        # Открытое окно — без верхней границы (replace(year=9999) падает 29 февраля)
+        end_dt = _day_start(end) if end is not None else datetime.max.replace(tzinfo=timezone.utc)
+        return await conn.fetch(sql, self.account_id, _day_start(start), end_dt)
+
+    async def _refresh(self, conn) -> tuple[dict, dict]:
+        """Догружает закрытые дни в кэш и возвращает (дневные суммы, исполнения) с открытым окном"""
+        today = _today()
+        cutoff = today - CLOSED_LAG_DAYS
+        start = self._closed_until if self._closed_until is not None else today - REPORT_HISTORY_DAYS
+        if start < cutoff:
+            pnl_rows = await self._load(conn, _PNL_SQL, start, cutoff)
+            fill_rows = await self._load(conn, _FILLS_SQL, start, cutoff)
+            self._daily = self._concat(self._daily, self._aggregate_pnl(pnl_rows))
+            self._fills = self._concat(self._fills, self._parse_fills(fill_rows))
+            self._closed_until = cutoff
+            logger.info(f"Report cache extended to {_day_start(cutoff):%Y-%m-%d}: {len(pnl_rows)} pnl ops, {len(fill_rows)} fills")
+
+        open_pnl = self._aggregate_pnl(await self._load(conn, _PNL_SQL, cutoff, None))
+        open_fills = self._parse_fills(await self._load(conn, _FILLS_SQL, cutoff, None))
+        return self._concat(self._daily, open_pnl), self._concat(self._fills, open_fills)
+
+    # ---------- расчёт ----------
+
+    @staticmethod
+    def _round_trips(fills: dict) -> dict[str, np.ndarray]:
+        """
+        Сделка "вход — выход в ноль" по каждому символу: позиция — накопленная сумма исполнений,
+        новая сделка начинается после нулевой позиции. Результат в пунктах: Σ(-qty·price).
+        """
+        n = len(fills["ts"])
+        if n == 0:
+            return {k: np.empty(0) for k in ("start", "sym", "dir", "points", "exit_hi", "exit_lo")}
+        order = np.lexsort((fills["ts"], fills["sym"]))
+        ts, sym, qty, price = (fills[k][order] for k in ("ts", "sym", "qty", "price"))
+
+        group_start = np.r_[True, sym[1:] != sym[:-1]]
+        csum = np.cumsum(qty)
+        base = (csum - qty)[group_start]
+        pos = csum - np.repeat(base, np.diff(np.r_[np.flatnonzero(group_start), n]))
+        flat = np.isclose(pos, 0.0)
+
+        trip_start = group_start | np.r_[True, flat[:-1]]
+        trip = np.cumsum(trip_start) - 1
+        n_trips = int(trip[-1]) + 1
+        closed = np.zeros(n_trips, bool)
+        closed[trip[flat]] = True
+
+        first = np.flatnonzero(trip_start)
+        direction = np.sign(qty[first])
+        points = np.bincount(trip, weights=-qty * price, minlength=n_trips)
+
+        # Лучшая цена выхода: для лонга — максимальная цена продажи, для шорта — минимальная цена покупки
+        exit_mask = np.sign(qty) == -direction[trip]
+        exit_hi = np.full(n_trips, -np.inf)
+        exit_lo = np.full(n_trips, np.inf)
+        np.maximum.at(exit_hi, trip[exit_mask], price[exit_mask])
+        np.minimum.at(exit_lo, trip[exit_mask], price[exit_mask])
+
+        return {
+            "start": ts[first][closed], "sym": sym[first][closed], "dir": direction[closed],
+            "points": points[closed], "exit_hi": exit_hi[closed], "exit_lo": exit_lo[closed],
+        }
+
+    def _tp_levels(self, trips: dict, tp_rows) -> np.ndarray:
+        """Число достигнутых уровней TP по каждой сделке; -1, если TP для сделки не выставлялись"""
+        hit = np.full(len(trips["start"]), -1, np.int64)
+        if not tp_rows or not len(hit):
+            return hit
+        tp_ts = np.fromiter((r[0] for r in tp_rows), np.float64, len(tp_rows))
+        tp_sym = np.array([r[1] or "" for r in tp_rows], dtype=object)
+        tp_price = np.fromiter((r[2] or 0.0 for r in tp_rows), np.float64, len(tp_rows))
+
+        # Строки отсортированы по (symbol, время): границы групп символов и поиск окна бинарным поиском
+        bounds = {}
+        change = np.flatnonzero(np.r_[True, tp_sym[1:] != tp_sym[:-1], True])
+        for a, b in zip(change[:-1], change[1:]):
+            bounds[tp_sym[a]] = (a, b)
+
+        for i, (start, sym) in enumerate(zip(trips["start"], trips["sym"])):
+            ticker = self._names.get(self._figis[sym])
+            if ticker not in bounds:
+                continue
+            a, b = bounds[ticker]
+            lo = a + np.searchsorted(tp_ts[a:b], start - 5)
+            hi = a + np.searchsorted(tp_ts[a:b], start + TP_MATCH_WINDOW)
+            if lo >= hi:
+                continue
+            levels = tp_price[lo:hi]
+            if trips["dir"][i] > 0:
+                hit[i] = int(np.count_nonzero(levels <= trips["exit_hi"][i]))
+            else:
+                hit[i] = int(np.count_nonzero(levels >= trips["exit_lo"][i]))
+        return hit
+
+    async def build(self, days: int = 30, symbol: Optional[str] = None) -> PnLReport:
+        started = time.monotonic()
+        days = max(1, min(days, REPORT_HISTORY_DAYS))
+        today = _today()
+        first_day = today - days + 1
+        since = _day_start(first_day)
+
+        async with self._lock:
+            conn = await asyncpg.connect(self.dsn)
+            try:
+                self._names = {r["figi"]: r["ticker"] for r in await conn.fetch(_NAMES_SQL)}
+                daily, fills = await self._refresh(conn)
+                tp_rows = await conn.fetch(_TP_SQL, since)
+                slip_rows = await conn.fetch(_SLIPPAGE_SQL, since.replace(tzinfo=None))
+            finally:
+                await conn.close()
+
+            labels = np.array([self._names.get(f, f) for f in self._figis], dtype=object)
+            trips = self._round_trips(fills)
+            tp_hit = self._tp_levels(trips, tp_rows)
+
+        # Фильтр периода и символа
+        mask = daily["day"] >= first_day
+        trip_mask = trips["start"] >= since.timestamp()
+        if symbol:
+            symbol = symbol.upper()
+            sym_ids = np.flatnonzero(labels == symbol) if len(labels) else np.empty(0, np.int64)
+            mask &= np.isin(daily["sym"], sym_ids)
+            trip_mask &= np.isin(trips["sym"], sym_ids)
+            slip_rows = [r for r in slip_rows if r[0] == symbol]
+
+        d_day, d_sym = daily["day"][mask], daily["sym"][mask]
+        d_pnl, d_fee = daily["pnl"][mask], daily["fee"][mask]
+        net = d_pnl + d_fee
+
+        # По дням: ряд без пропусков, просадка по накопленному результату
+        per_day = np.bincount(d_day - first_day, weights=net, minlength=days)[:days]
+        equity = np.r_[0.0, np.cumsum(per_day)]
+        max_dd = float(np.max(np.maximum.accumulate(equity) - equity))
+        active = np.flatnonzero(np.bincount(d_day - first_day, minlength=days)[:days])
+
+        def day_label(i) -> str:
+            return _day_label(first_day + int(i))
+
+        best = worst = None
+        if len(active):
+            b, w = active[np.argmax(per_day[active])], active[np.argmin(per_day[active])]
+            best, worst = (day_label(b), float(per_day[b])), (day_label(w), float(per_day[w]))
+
+        # Сделки
+        t_sym, t_points = trips["sym"][trip_mask], trips["points"][trip_mask]
+        t_hit = tp_hit[trip_mask]
+        win = t_points > 0
+        with_tp = t_hit >= 0
+
+        # Проскальзывание входа к цене сигнала, б.п.; положительное — хуже сигнала
+        slippage, samples = None, len(slip_rows)
+        if samples:
+            fill = np.fromiter((r[2] for r in slip_rows), np.float64, samples)
+            signal = np.fromiter((r[3] for r in slip_rows), np.float64, samples)
+            side = np.array([1.0 if r[1] == "long" else -1.0 for r in slip_rows])
+            slippage = float(np.mean((fill - signal) / signal * side) * 1e4)
+
+        # По символам
+        n_sym = len(self._figis)
+        sym_pnl = np.bincount(d_sym, weights=d_pnl, minlength=n_sym)
+        sym_fee = np.bincount(d_sym, weights=d_fee, minlength=n_sym)
+        sym_trips = np.bincount(t_sym, minlength=n_sym)
+        sym_wins = np.bincount(t_sym, weights=win, minlength=n_sym)
+        present = np.flatnonzero((sym_trips > 0) | (np.bincount(d_sym, minlength=n_sym) > 0))
+        present = present[np.argsort(-(sym_pnl + sym_fee)[present])]
+        symbols = [
+            SymbolStats(
+                symbol=str(labels[i]),
+                pnl=round(float(sym_pnl[i]), 2),
+                fees=round(float(sym_fee[i]), 2),
+                trips=int(sym_trips[i]),
+                win_rate=float(sym_wins[i] / sym_trips[i]) if sym_trips[i] else None,
+            )
+            for i in present
+        ]
+
+        return PnLReport(
+            date_from=day_label(0),
+            date_to=day_label(days - 1),
+            net_pnl=round(float(net.sum()), 2),
+            varmargin=round(float(d_pnl.sum()), 2),
+            fees=round(float(d_fee.sum()), 2),
+            max_drawdown=round(max_dd, 2),
+            best_day=best,
+            worst_day=worst,
+            trips=int(len(t_points)),
+            win_rate=float(win.mean()) if len(t_points) else None,
+            avg_tp_level=float(t_hit[with_tp].mean()) if with_tp.any() else None,
+            tp_trips=int(with_tp.sum()),
+            avg_slippage_bps=slippage,
+            slippage_samples=samples,
+            symbols=symbols,
+            days=[(day_label(i), round(float(per_day[i]), 2)) for i in active],
+            build_ms=int((time.monotonic() - started) * 1000),
+        )
+
+_engine: Optional[ReportEngine] = None
+
+def get_report_engine() -> ReportEngine:
+    global _engine
+    if _engine is None:
+        _engine = ReportEngine()
+    return _engine
@@ -0,0 +1,240 @@
+# app/trading/backtest.py
+# Бэктест правил SL/мульти-TP на истории сигналов.
+# Сигналы (event_logs, event_type='signal') и свечи хранилища CandleStore сводятся в матрицы
+# «сигнал × бар удержания»: благоприятное и неблагоприятное отклонение цены от входа в %.
+# Матрицы не зависят от параметров, поэтому конфигурация SL/TP считается несколькими векторными
+# проходами по всем сигналам сразу, а сетка конфигураций делится между процессами.
+# Размер позиции и доли TP — те же, что у исполнителя: лоты от суммы риска, BotSettings.get_tp_distribution.
+import os
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, asdict, field
+from datetime import datetime
+from typing import Optional
+
+import asyncpg
+import numpy as np
+
+from trading.settings_manager import BotSettings
+
+logger = logging.getLogger(__name__)
+
+DATABASE_URL = os.getenv("DB_URL")
+
+_SIGNALS_SQL = """
+SELECT extract(epoch FROM event_time)::float8, symbol, details->>'action'
+FROM event_logs
+WHERE event_type = 'signal' AND details->>'action' IN ('buy', 'sell') AND symbol IS NOT NULL
+  AND event_time >= $1 AND event_time < $2
+ORDER BY event_time
+"""
+
+@dataclass(frozen=True)
+class BracketConfig:
+    stop_loss_percent: float
+    tp_levels: tuple[float, ...]
+    tp_portions: tuple[float, ...]
+    breakeven_after_tp: bool = False
+
+    @classmethod
+    def from_settings(cls, settings: BotSettings) -> "BracketConfig":
+        if not settings.use_multi_tp:
+            # Один TP на всю позицию — частный случай с одной долей
+            return cls(settings.stop_loss_percent, (settings.take_profit_percent,), (1.0,), settings.sl_breakeven_after_tp)
+        return cls(
+            settings.stop_loss_percent, tuple(settings.tp_levels), tuple(settings.tp_portions),
+            settings.sl_breakeven_after_tp,
+        )
+
+@dataclass
+class BacktestResult:
+    config: BracketConfig
+    net_pnl: float
+    trades: int
+    win_rate: Optional[float]
+    profit_factor: Optional[float]
+    max_drawdown: float
+    tp_fills: int
+    sl_fills: int
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+@dataclass
+class BacktestData:
+    """Матрицы сигналов, общие для всех конфигураций"""
+    times: np.ndarray      # время сигнала, сортировка по нему
+    symbols: np.ndarray
+    entry: np.ndarray      # цена входа (открытие следующего бара)
+    lots: np.ndarray       # лоты по правилам исполнителя
+    lot_size: np.ndarray
+    favorable: np.ndarray  # (N, H) лучшее отклонение за бар, %; -inf за пределами удержания
+    adverse: np.ndarray    # (N, H) худшее отклонение за бар, %
+    exit_pct: np.ndarray   # результат выхода по времени (закрытие последнего бара), %
+    fee_rate: float = 0.0  # комиссия на сторону, доля номинала
+    # Разбиение лотов по уровням зависит только от долей TP — общее для конфигураций с теми же долями
+    splits: dict[tuple[float, ...], np.ndarray] = field(default_factory=dict, repr=False)
+
+def build_data(signals: list[tuple[float, str, str]], bars: dict[str, np.ndarray], lot_sizes: dict[str, int],
+               position_amount: float, max_hold: int, fee_bps: float = 0.0) -> BacktestData:
+    """
+    signals — (unix-время, символ, buy/sell); bars — свечи CandleStore по символу.
+    Вход — открытие первого бара после сигнала, удержание — до следующего сигнала
+    по символу или max_hold баров. Сумма позиции фиксирована (position_amount)
+    """
+    times, symbols, entry, lot_size, fav_rows, adv_rows, exit_pct = [], [], [], [], [], [], []
+    by_symbol: dict[str, list[tuple[float, int]]] = {}
+    for ts, symbol, action in signals:
+        if symbol in bars and len(bars[symbol]):
+            by_symbol.setdefault(symbol, []).append((ts, 1 if action == "buy" else -1))
+
+    for symbol, items in by_symbol.items():
+        b = bars[symbol]
+        t, o, h, l, c = (np.asarray(b[f], dtype=np.float64) for f in ("time", "open", "high", "low", "close"))
+        ts = np.array([i[0] for i in items])
+        dirs = np.array([i[1] for i in items], dtype=np.float64)
+        # Первый бар, открывшийся не раньше сигнала: внутри текущего бара порядок цен неизвестен
+        start = np.searchsorted(t, ts, side="left")
+        end = np.append(start[1:], len(t))  # следующий сигнал закрывает позицию
+        end = np.minimum(end, start + max_hold)
+        ok = start < end
+        if not ok.any():
+            continue
+        start, end, dirs, ts = start[ok], end[ok], dirs[ok], ts[ok]
+
+        idx = start[:, None] + np.arange(max_hold)[None, :]
+        valid = idx < end[:, None]
+        idx = np.minimum(idx, len(t) - 1)
+        px = o[start]
+        up = (h[idx] / px[:, None] - 1) * 100
+        down = (1 - l[idx] / px[:, None]) * 100
+        long = dirs[:, None] > 0
+        fav = np.where(valid, np.where(long, up, down), -np.inf)
+        adv = np.where(valid, np.where(long, down, up), -np.inf)
+        last = c[end - 1]
+
+        times.append(ts)
+        symbols.append(np.full(len(ts), symbol, dtype=object))
+        entry.append(px)
+        lot_size.append(np.full(len(ts), lot_sizes.get(symbol, 1), dtype=np.float64))
+        fav_rows.append(fav)
+        adv_rows.append(adv)
+        exit_pct.append((last / px - 1) * 100 * dirs)
+
+    if not times:
+        empty = np.empty((0, max_hold))
+        return BacktestData(np.empty(0), np.empty(0, dtype=object), np.empty(0), np.empty(0, dtype=np.int64),
+                            np.empty(0), empty, empty, np.empty(0), fee_bps / 10_000)
+
+    order = np.argsort(np.concatenate(times), kind="stable")
+    entry_arr = np.concatenate(entry)[order]
+    lot_arr = np.concatenate(lot_size)[order]
+    lots = np.floor(position_amount / (entry_arr * lot_arr)).astype(np.int64)
+    return BacktestData(
+        times=np.concatenate(times)[order],
+        symbols=np.concatenate(symbols)[order],
+        entry=entry_arr,
+        lots=lots,
+        lot_size=lot_arr,
+        favorable=np.concatenate(fav_rows)[order],
+        adverse=np.concatenate(adv_rows)[order],
+        exit_pct=np.concatenate(exit_pct)[order],
+        fee_rate=fee_bps / 10_000,
+    )
+
+def _first_hit(mask: np.ndarray) -> np.ndarray:
+    """Номер первого True в строке, ширина матрицы — если не было"""
+    hit = mask.argmax(axis=1)
+    hit[~mask.any(axis=1)] = mask.shape[1]
+    return hit
+
+def _distribution(data: BacktestData, config: BracketConfig) -> np.ndarray:
+    """(N, K) лотов на уровень TP — через get_tp_distribution, по разу на уникальное число лотов"""
+    split = data.splits.get(config.tp_portions)
+    if split is not None and split.shape[1] == len(config.tp_levels):
+        return split
+    settings = BotSettings(tp_levels=list(config.tp_levels), tp_portions=list(config.tp_portions))
+    k = len(config.tp_levels)
+    uniq, inverse = np.unique(data.lots, return_inverse=True)
+    table = np.zeros((len(uniq), k), dtype=np.int64)
+    for row, total in enumerate(uniq):
+        for level, (_, n) in enumerate(settings.get_tp_distribution(int(total))[:k]):
+            table[row, level] = n
+    split = data.splits[config.tp_portions] = table[inverse]
+    return split
+
+def run(data: BacktestData, config: BracketConfig) -> BacktestResult:
+    n, horizon = data.favorable.shape
+    levels = np.array(config.tp_levels, dtype=np.float64)
+    split = _distribution(data, config)
+
+    # Бар срабатывания каждого TP и исходного SL; на одном баре с TP первым считается SL
+    tp_bar = np.stack([_first_hit(data.favorable >= lvl) for lvl in levels], axis=1)
+    sl_bar = _first_hit(data.adverse >= config.stop_loss_percent)
+    stop_bar = sl_bar
+    stop_pct = np.full(n, -config.stop_loss_percent)
+    if config.breakeven_after_tp:
+        # После первого TP стоп переносится на вход и действует со следующего бара
+        first_tp = tp_bar.min(axis=1)
+        after = np.arange(horizon)[None, :] > first_tp[:, None]
+        be_bar = _first_hit((data.adverse >= 0) & after)
+        # Стоп на входе ближе исходного: на общем баре срабатывает он
+        moved = be_bar <= sl_bar
+        stop_bar = np.where(moved, be_bar, sl_bar)
+        stop_pct = np.where(moved, 0.0, stop_pct)
+
+    by_tp = tp_bar < stop_bar[:, None]
+    by_stop = ~by_tp & (stop_bar[:, None] < horizon)
+    pct = np.where(by_tp, levels[None, :], np.where(by_stop, stop_pct[:, None], data.exit_pct[:, None]))
+
+    notional = (data.entry * data.lot_size)[:, None] * split
+    pnl = (notional * pct / 100).sum(axis=1) - 2 * data.fee_rate * notional.sum(axis=1)
+    traded = data.lots > 0
+    pnl = pnl[traded]
+
+    equity = np.cumsum(pnl)
+    drawdown = float((np.maximum.accumulate(np.concatenate(([0.0], equity)))[1:] - equity).max()) if len(pnl) else 0.0
+    gains, losses = pnl[pnl > 0].sum(), -pnl[pnl < 0].sum()
+    filled = split[traded] > 0
+    return BacktestResult(
+        config=config,
+        net_pnl=round(float(pnl.sum()), 2),
+        trades=int(len(pnl)),
+        win_rate=round(float((pnl > 0).mean()), 4) if len(pnl) else None,
+        profit_factor=round(float(gains / losses), 3) if losses > 0 else None,
+        max_drawdown=round(drawdown, 2),
+        tp_fills=int((by_tp[traded] & filled).sum()),
+        sl_fills=int((by_stop[traded] & filled).sum()),
+    )
+
+# ---------- сетка параметров ----------
+
+_worker_data: Optional[BacktestData] = None
+
+def _init_worker(data: BacktestData):
+    # Матрицы передаются в процесс один раз, а не с каждой пачкой конфигураций
+    global _worker_data
+    _worker_data = data
+
+def _run_chunk(configs: list[BracketConfig]) -> list[BacktestResult]:
+    return [run(_worker_data, c) for c in configs]
+
+def grid(data: BacktestData, configs: list[BracketConfig], workers: Optional[int] = None,
+         chunk_size: int = 64) -> list[BacktestResult]:
+    """Все конфигурации, по убыванию net_pnl; workers=1 — без пула процессов"""
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(configs) <= chunk_size:
+        results = [run(data, c) for c in configs]
+    else:
+        chunks = [configs[i:i + chunk_size] for i in range(0, len(configs), chunk_size)]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(data,)) as pool:
+            results = [r for part in pool.map(_run_chunk, chunks) for r in part]
+    return sorted(results, key=lambda r: r.net_pnl, reverse=True)
+
+async def load_signals(date_from: datetime, date_to: datetime, dsn: Optional[str] = DATABASE_URL) -> list[tuple[float, str, str]]:
+    conn = await asyncpg.connect(dsn)
+    try:
+        rows = await conn.fetch(_SIGNALS_SQL, date_from, date_to)
+    finally:
+        await conn.close()
+    return [(r[0], r[1].upper(), r[2]) for r in rows]
@@ -0,0 +1,383 @@
+# app/trading/bracket_manager.py
+# Сопровождение брекетов (SL + TP) открытых позиций.
+# Состояние брекета по каждому FIGI держится в памяти и восстанавливается из активных стоп-заявок
+# брокера при (пере)подключении. Об исполнениях сообщает OrderWatcher из потока сделок:
+# после частичного закрытия (сработал TP) SL перевыставляется на оставшийся объём
+# и, если включено в настройках, переносится в безубыток. Опроса нет — только события.
+# Трейлинг-стоп (trailing_stop.py) двигает тот же SL через move_stop().
+# Позиция не остаётся без стопа: новый SL выставляется с повторами, при неудаче возвращается
+# прежний, а если не удаётся и это — стоп восстанавливается в фоне, с уведомлением в Telegram.
+import os
+import logging
+import asyncio
+from dataclasses import dataclass, field
+from decimal import Decimal, ROUND_CEILING, ROUND_FLOOR
+from typing import Optional
+
+from tinkoff.invest import (
+    AsyncClient,
+    StopOrderDirection,
+    StopOrderExpirationType,
+    StopOrderType,
+)
+from .market_cache import instrument_info
+from .order_executor import OrderExecutor
+from trading.settings_manager import get_settings
+from trading.db_logger import log_event, record_error
+
+logger = logging.getLogger(__name__)
+
+# Несколько TP, исполнившихся подряд, сводятся в одно перевыставление SL
+BRACKET_DEBOUNCE_MS = int(os.getenv("BRACKET_DEBOUNCE_MS", "200"))
+# Попытки выставить SL после отмены прежнего и пауза перед повтором (сек, удваивается)
+SL_POST_ATTEMPTS = int(os.getenv("SL_POST_ATTEMPTS", "3"))
+SL_RETRY_DELAY = float(os.getenv("SL_RETRY_DELAY", "0.5"))
+SL_RESTORE_MAX_DELAY = 60.0
+
+@dataclass
+class Bracket:
+    figi: str
+    direction: str  # "long" / "short"
+    position: int = 0  # текущий объём позиции, лоты
+    entry_price: Optional[Decimal] = None
+    sl_order_id: Optional[str] = None
+    sl_price: Optional[Decimal] = None
+    sl_lots: int = 0
+    tp_lots: dict[str, int] = field(default_factory=dict)
+    # Позиция открыта/увеличена после последней загрузки стоп-заявок: новый SL ещё не известен
+    needs_refresh: bool = False
+
+class BracketManager:
+    def __init__(self, token: str, account_id: str, executor: OrderExecutor, tg_bot=None, chat_id=None):
+        self.token = token
+        self.account_id = account_id
+        self.executor = executor
+        self.tg_bot = tg_bot
+        self.chat_id = chat_id
+        self._brackets: dict[str, Bracket] = {}
+        self._increments: dict[str, Decimal] = {}
+        self._running: dict[str, asyncio.Task] = {}
+        self._dirty: set[str] = set()
+        # Перевыставление SL по одному FIGI (сокращение позиции, трейлинг) идёт строго по очереди
+        self._locks: dict[str, asyncio.Lock] = {}
+        # Фоновое восстановление SL позиций, оставшихся без стопа
+        self._restores: dict[str, asyncio.Task] = {}
+
+    @property
+    def brackets(self) -> dict[str, Bracket]:
+        return self._brackets
+
+    # ---------- состояние ----------
+
+    async def hydrate(self, client):
+        """Полная загрузка брекетов: портфель и стоп-заявки счёта, по одному запросу"""
+        portfolio, stop_orders = await asyncio.gather(
+            client.operations.get_portfolio(account_id=self.account_id),
+            client.stop_orders.get_stop_orders(account_id=self.account_id),
+        )
+        brackets = {}
+        for pos in portfolio.positions:
+            qty = int(self.executor._quotation_to_decimal(pos.quantity))
+            if qty == 0 or getattr(pos, "instrument_type", "futures") != "futures":
+                continue
+            brackets[pos.figi] = Bracket(
+                figi=pos.figi,
+                direction="long" if qty > 0 else "short",
+                position=abs(qty),
+                entry_price=self._entry_price(pos),
+            )
+        for so in stop_orders.stop_orders:
+            b = brackets.get(so.figi)
+            if b is not None:
+                self._apply_stop_order(b, so)
+
+        self._brackets = brackets
+        logger.info(f"Brackets hydrated: {len(brackets)} positions")
+        # Исполнения, пропущенные без потока: SL не совпадает с остатком позиции
+        for b in brackets.values():
+            if b.sl_order_id and b.sl_lots != b.position:
+                self._schedule(b.figi)
+
+    async def _refresh(self, client, figi: str):
+        """Перечитывает стоп-заявки одного инструмента"""
+        b = self._brackets.get(figi)
+        if b is None:
+            return
+        stop_orders = await client.stop_orders.get_stop_orders(account_id=self.account_id)
+        b.sl_order_id, b.sl_price, b.sl_lots, b.tp_lots = None, None, 0, {}
+        for so in stop_orders.stop_orders:
+            if so.figi == figi:
+                self._apply_stop_order(b, so)
+        b.needs_refresh = False
+
+    def _apply_stop_order(self, b: Bracket, so):
+        if so.order_type == StopOrderType.STOP_ORDER_TYPE_STOP_LOSS:
+            b.sl_order_id = so.stop_order_id
+            b.sl_price = self.executor._quotation_to_decimal(so.stop_price)
+            b.sl_lots = int(so.lots_requested)
+        elif so.order_type == StopOrderType.STOP_ORDER_TYPE_TAKE_PROFIT:
+            b.tp_lots[so.stop_order_id] = int(so.lots_requested)
+
+    def _entry_price(self, pos) -> Optional[Decimal]:
+        # Для фьючерсов стоп-цены в пунктах — берём среднюю цену в пунктах, если она есть
+        for attr in ("average_position_price_pt", "average_position_price"):
+            value = getattr(pos, attr, None)
+            if value is not None:
+                price = self.executor._quotation_to_decimal(value)
+                if price > 0:
+                    return price
+        return None
+
+    # ---------- события ----------
+
+    def on_fill(self, figi: str, prev: int, current: int, price: Optional[Decimal] = None):
+        """Изменение позиции по FIGI (знаковые лоты) из потока сделок или сверки"""
+        if current == 0:
+            self._brackets.pop(figi, None)
+            return
+
+        b = self._brackets.get(figi)
+        direction = "long" if current > 0 else "short"
+        if b is None or b.direction != direction or prev == 0:
+            # Новая позиция: SL/TP выставляет исполнитель, подхватим их при первом сокращении
+            self._brackets[figi] = Bracket(
+                figi=figi, direction=direction, position=abs(current), entry_price=price, needs_refresh=True
+            )
+            return
+
+        if abs(current) > abs(prev):
+            if price is not None and b.entry_price is not None:
+                added = abs(current) - abs(prev)
+                b.entry_price = (b.entry_price * abs(prev) + price * added) / abs(current)
+            b.position = abs(current)
+            b.needs_refresh = True
+            return
+
+        b.position = abs(current)
+        self._schedule(figi)
+
+    def _schedule(self, figi: str):
+        if figi in self._running:
+            self._dirty.add(figi)
+            return
+        task = asyncio.create_task(self._adjust_loop(figi))
+        self._running[figi] = task
+        task.add_done_callback(lambda _t, f=figi: self._running.pop(f, None))
+
+    async def _adjust_loop(self, figi: str):
+        await asyncio.sleep(BRACKET_DEBOUNCE_MS / 1000)
+        while True:
+            self._dirty.discard(figi)
+            try:
+                await self._adjust(figi)
+            except Exception as e:
+                logger.error(f"Bracket adjust error for {figi}: {e}", exc_info=True)
+            if figi not in self._dirty:
+                break
+
+    # ---------- перевыставление SL ----------
+
+    def _lock(self, figi: str) -> asyncio.Lock:
+        lock = self._locks.get(figi)
+        if lock is None:
+            lock = self._locks[figi] = asyncio.Lock()
+        return lock
+
+    async def _adjust(self, figi: str):
+        b = self._brackets.get(figi)
+        if b is None or b.position <= 0:
+            return
+
+        async with AsyncClient(self.token) as client, self._lock(figi):
+            if b.needs_refresh or b.sl_order_id is None:
+                await self._refresh(client, figi)
+            if b.sl_order_id is None or b.sl_price is None:
+                logger.warning(f"Bracket {figi}: no active SL to adjust")
+                return
+
+            target_price = b.sl_price
+            if get_settings().sl_breakeven_after_tp and b.entry_price is not None:
+                # Округляем в сторону прибыли, чтобы стоп не оказался хуже входа
+                breakeven = await self.round_price(
+                    client, figi, b.entry_price, ROUND_CEILING if b.direction == "long" else ROUND_FLOOR
+                )
+                if self.is_tighter(b, breakeven):
+                    target_price = breakeven
+
+            # Ничего не поменялось — ни одного вызова API
+            if b.sl_lots == b.position and target_price == b.sl_price:
+                return
+            await self._replace_sl(client, b, target_price, "breakeven" if target_price != b.sl_price else "resize")
+
+    async def move_stop(self, client, figi: str, price: Decimal) -> bool:
+        """Подтягивает SL к цене (трейлинг); стоп только ужесточается"""
+        b = self._brackets.get(figi)
+        if b is None or b.position <= 0:
+            return False
+        async with self._lock(figi):
+            if b.sl_order_id is None or b.sl_price is None:
+                return False
+            # Стоп трейлинга округляем от цены, чтобы не подтянуть его ближе заданной дистанции
+            price = await self.round_price(
+                client, figi, price, ROUND_FLOOR if b.direction == "long" else ROUND_CEILING
+            )
+            if not self.is_tighter(b, price):
+                return False
+            return await self._replace_sl(client, b, price, "trailing")
+
+    @staticmethod
+    def is_tighter(b: Bracket, price: Decimal) -> bool:
+        if b.sl_price is None:
+            return False
+        return price > b.sl_price if b.direction == "long" else price < b.sl_price
+
+    async def _replace_sl(self, client, b: Bracket, target_price: Decimal, reason: str) -> bool:
+        figi = b.figi
+        # Стоп-заявку нельзя изменить на месте, минимум — отмена и новая заявка.
+        # Отменяем первой: два активных SL на один остаток могут развернуть позицию
+        old_id, old_lots, old_price = b.sl_order_id, b.sl_lots, b.sl_price
+        try:
+            await client.stop_orders.cancel_stop_order(account_id=self.account_id, stop_order_id=old_id)
+        except Exception as e:
+            # SL уже сработал или снят — новый не ставим, состояние перечитаем при следующем событии
+            logger.warning(f"Bracket {figi}: cannot cancel SL {old_id}: {e}")
+            b.needs_refresh = True
+            return False
+
+        try:
+            order_id = await self._post_sl(client, b, target_price)
+        except Exception as e:
+            logger.error(f"Bracket {figi}: new SL {target_price} failed, restoring {old_price}: {e}")
+            await record_error("bracket_manager", f"SL replace failed for {figi}: {e}", symbol=figi)
+            await self._restore_previous(client, b, old_id, old_price, target_price, e)
+            return False
+
+        b.sl_order_id, b.sl_price, b.sl_lots = order_id, target_price, b.position
+        logger.info(f"Bracket {figi}: SL {old_lots}@{old_price} -> {b.sl_lots}@{b.sl_price} ({reason}, {order_id})")
+        await log_event(
+            event_type="sl_adjust",
+            symbol=figi,
+            details={
+                "order_id": order_id,
+                "replaced_order_id": old_id,
+                "price": str(target_price),
+                "lots": b.sl_lots,
+                "reason": reason,
+            },
+            message=f"SL {figi} {target_price} ({b.sl_lots} лотов)"
+        )
+        return True
+
+    async def _post_sl(self, client, b: Bracket, price: Decimal) -> str:
+        """SL на текущий остаток с повторами; id стоп-заявки или исключение последней попытки"""
+        quotation = self.executor._decimal_to_quotation(price)
+        delay = SL_RETRY_DELAY
+        for attempt in range(1, SL_POST_ATTEMPTS + 1):
+            try:
+                resp = await client.stop_orders.post_stop_order(
+                    figi=b.figi,
+                    quantity=b.position,
+                    price=quotation,
+                    stop_price=quotation,
+                    direction=(
+                        StopOrderDirection.STOP_ORDER_DIRECTION_SELL if b.direction == "long"
+                        else StopOrderDirection.STOP_ORDER_DIRECTION_BUY
+                    ),
+                    account_id=self.account_id,
+                    expiration_type=StopOrderExpirationType.STOP_ORDER_EXPIRATION_TYPE_GOOD_TILL_CANCEL,
+                    stop_order_type=StopOrderType.STOP_ORDER_TYPE_STOP_LOSS
+                )
+                return resp.stop_order_id
+            except Exception as e:
+                if attempt == SL_POST_ATTEMPTS:
+                    raise
+                logger.warning(f"Bracket {b.figi}: SL {price} attempt {attempt}/{SL_POST_ATTEMPTS} failed: {e}")
+                await asyncio.sleep(delay)
+                delay *= 2
+
+    async def _restore_previous(self, client, b: Bracket, old_id: str, old_price: Decimal,
+                                target_price: Decimal, error: Exception):
+        # Прежняя цена на текущий остаток: старый объём после TP развернул бы позицию
+        figi = b.figi
+        try:
+            order_id = await self._post_sl(client, b, old_price)
+        except Exception as e:
+            b.sl_order_id, b.sl_price, b.sl_lots = None, None, 0
+            logger.error(f"Bracket {figi}: previous SL {old_price} not restored, position without SL: {e}")
+            await log_event(
+                event_type="error",
+                symbol=figi,
+                details={"old_order_id": old_id, "price": str(old_price), "target_price": str(target_price)},
+                message=f"Position {figi} left without SL, restoring in background: {e}"
+            )
+            await self._alert(
+                f"🚨 {figi}: SL снят, новый ({target_price}) и прежний ({old_price}) выставить не удалось. "
+                f"Позиция без стопа, повторяю в фоне: {e}"
+            )
+            self._spawn_restore(figi, old_price)
+            return
+
+        b.sl_order_id, b.sl_price, b.sl_lots = order_id, old_price, b.position
+        await log_event(
+            event_type="sl_restore",
+            symbol=figi,
+            details={"order_id": order_id, "replaced_order_id": old_id, "price": str(old_price),
+                     "target_price": str(target_price), "lots": b.sl_lots},
+            message=f"SL {figi} restored at {old_price} after failed move to {target_price}"
+        )
+        await self._alert(f"⚠️ {figi}: SL не перенесён на {target_price} ({error}), прежний {old_price} восстановлен")
+
+    def _spawn_restore(self, figi: str, price: Decimal):
+        if figi in self._restores:
+            return
+        task = asyncio.create_task(self._restore_loop(figi, price))
+        self._restores[figi] = task
+        task.add_done_callback(lambda _t, f=figi: self._restores.pop(f, None))
+
+    async def _restore_loop(self, figi: str, price: Decimal):
+        b = self._brackets.get(figi)
+        delay = SL_RETRY_DELAY
+        while True:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, SL_RESTORE_MAX_DELAY)
+            # Позиция закрыта, открыта заново или стоп уже выставлен другим путём
+            if self._brackets.get(figi) is not b or b.position <= 0 or b.sl_order_id is not None:
+                return
+            try:
+                async with AsyncClient(self.token) as client, self._lock(figi):
+                    if b.sl_order_id is not None:
+                        return
+                    order_id = await self._post_sl(client, b, price)
+            except Exception as e:
+                logger.error(f"Bracket {figi}: SL restore failed, next attempt in {delay:.0f}s: {e}")
+                continue
+            b.sl_order_id, b.sl_price, b.sl_lots = order_id, price, b.position
+            logger.info(f"Bracket {figi}: SL restored {b.sl_lots}@{price} ({order_id})")
+            await log_event(
+                event_type="sl_restore",
+                symbol=figi,
+                details={"order_id": order_id, "price": str(price), "lots": b.sl_lots},
+                message=f"SL {figi} restored at {price}"
+            )
+            await self._alert(f"✅ {figi}: SL восстановлен на {price} ({b.sl_lots} лотов)")
+            return
+
+    async def _alert(self, text: str):
+        if self.tg_bot and self.chat_id:
+            try:
+                await self.tg_bot.send_message(chat_id=self.chat_id, text=text)
+            except Exception as e:
+                logger.error(f"Ошибка при отправке уведомления: {e}")
+
+    async def round_price(self, client, figi: str, price: Decimal, rounding) -> Decimal:
+        """Округление цены до шага инструмента; шаг кешируется"""
+        increment = self._increments.get(figi)
+        if increment is None:
+            info = await instrument_info(self.token, figi)
+            if not info:
+                return price
+            increment = self.executor._quotation_to_decimal(info["min_price_increment"])
+            self._increments[figi] = increment
+        if increment <= 0:
+            return price
+        return (price / increment).quantize(Decimal("1"), rounding=rounding) * increment
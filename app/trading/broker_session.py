@@ -0,0 +1,53 @@
+# app/trading/broker_session.py
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from tinkoff.invest import AsyncClient
+
+logger = logging.getLogger(__name__)
+
+class BrokerSession:
+    """
+    Долгоживущее подключение к API брокера: gRPC-канал открывается один раз
+    и переиспользуется, вместо нового AsyncClient на каждый запрос.
+    """
+
+    def __init__(self, token: str):
+        self.token = token
+        self._client: Optional[AsyncClient] = None
+        self._services = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._services is not None
+
+    async def open(self):
+        async with self._lock:
+            if self._services is None:
+                client = AsyncClient(self.token)
+                self._services = await client.__aenter__()
+                self._client = client
+                logger.info("Broker session opened")
+        return self._services
+
+    async def close(self):
+        async with self._lock:
+            client, self._client, self._services = self._client, None, None
+            if client is not None:
+                try:
+                    await client.__aexit__(None, None, None)
+                except Exception as e:
+                    logger.warning(f"Error closing broker session: {e}")
+                logger.info("Broker session closed")
+
+    @asynccontextmanager
+    async def api(self) -> AsyncIterator:
+        """Открытый канал, если сессия активна, иначе временный AsyncClient"""
+        if self._services is not None:
+            yield self._services
+        else:
+            async with AsyncClient(self.token) as api:
+                yield api
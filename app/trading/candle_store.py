@@ -0,0 +1,224 @@
+# app/trading/candle_store.py
+# Локальное хранилище свечей для волатильностных SL/TP.
+# По каждому FIGI хранится один массив завершённых свечей (numpy, .npy на диске, читается через memmap).
+# Фоновое обновление запрашивает у API только бары после последнего сохранённого,
+# после чего ATR и реализованная волатильность пересчитываются векторно по всему массиву.
+# В момент сигнала исполнитель читает готовые значения из памяти — без запроса истории.
+import os
+import time
+import logging
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from tinkoff.invest import AsyncClient, CandleInterval
+
+logger = logging.getLogger(__name__)
+
+CANDLE_STORE_DIR = Path(os.getenv("CANDLE_STORE_DIR", str(Path(__file__).resolve().parents[1] / "db" / "candles")))
+CANDLE_INTERVAL = os.getenv("CANDLE_INTERVAL", "hour")
+CANDLE_HISTORY_DAYS = int(os.getenv("CANDLE_HISTORY_DAYS", "30"))
+CANDLE_MAX_BARS = int(os.getenv("CANDLE_MAX_BARS", "5000"))
+CANDLE_REFRESH_SECONDS = float(os.getenv("CANDLE_REFRESH_SECONDS", "300"))
+VOLATILITY_WINDOW = int(os.getenv("VOLATILITY_WINDOW", "14"))
+# FIGI, которые обновляются с запуска; остальные добавляются при первом сигнале
+CANDLE_STORE_FIGIS = [f.strip() for f in os.getenv("CANDLE_STORE_FIGIS", "").split(",") if f.strip()]
+
+_INTERVALS = {
+    "5min": (CandleInterval.CANDLE_INTERVAL_5_MIN, 300),
+    "15min": (CandleInterval.CANDLE_INTERVAL_15_MIN, 900),
+    "hour": (CandleInterval.CANDLE_INTERVAL_HOUR, 3600),
+    "day": (CandleInterval.CANDLE_INTERVAL_DAY, 86400),
+}
+
+# Время — unix-секунды начала бара (UTC)
+CANDLE_DTYPE = np.dtype([
+    ("time", "<i8"), ("open", "<f8"), ("high", "<f8"), ("low", "<f8"), ("close", "<f8"), ("volume", "<i8"),
+])
+
+def _to_float(q) -> float:
+    return q.units + q.nano / 1_000_000_000
+
+def rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """Скользящее среднее через кумулятивную сумму; первые window-1 значений — NaN"""
+    out = np.full(len(values), np.nan)
+    if len(values) < window:
+        return out
+    csum = np.cumsum(np.concatenate(([0.0], values)))
+    out[window - 1:] = (csum[window:] - csum[:-window]) / window
+    return out
+
+def true_range(high: np.ndarray, low: np.ndarray, close: np.ndarray) -> np.ndarray:
+    prev_close = np.concatenate(([close[0]], close[:-1])) if len(close) else close
+    return np.maximum(high - low, np.maximum(np.abs(high - prev_close), np.abs(low - prev_close)))
+
+def atr(high: np.ndarray, low: np.ndarray, close: np.ndarray, window: int = VOLATILITY_WINDOW) -> np.ndarray:
+    return rolling_mean(true_range(high, low, close), window)
+
+def realized_volatility(close: np.ndarray, window: int = VOLATILITY_WINDOW) -> np.ndarray:
+    """Стандартное отклонение лог-доходностей за window баров, % на бар; выровнено по close"""
+    out = np.full(len(close), np.nan)
+    if len(close) <= window:
+        return out
+    returns = np.diff(np.log(close))
+    mean = rolling_mean(returns, window)
+    mean_sq = rolling_mean(returns * returns, window)
+    out[1:] = np.sqrt(np.maximum(mean_sq - mean * mean, 0.0)) * 100
+    return out
+
+@dataclass(frozen=True)
+class Volatility:
+    atr: float
+    atr_percent: float  # ATR в % от последнего закрытия
+    realized_percent: float
+    close: float
+    bar_time: int
+    bars: int
+
+class CandleStore:
+    def __init__(self, token: str, interval: str = CANDLE_INTERVAL, path: Path = CANDLE_STORE_DIR,
+                 window: int = VOLATILITY_WINDOW, history_days: int = CANDLE_HISTORY_DAYS,
+                 max_bars: int = CANDLE_MAX_BARS):
+        if interval not in _INTERVALS:
+            raise ValueError(f"Unsupported CANDLE_INTERVAL {interval}, expected one of {', '.join(_INTERVALS)}")
+        self.token = token
+        self.interval = interval
+        self.api_interval, self.bar_seconds = _INTERVALS[interval]
+        self.path = path
+        self.window = window
+        self.history_days = history_days
+        self.max_bars = max_bars
+        self._bars: dict[str, np.ndarray] = {}
+        self._volatility: dict[str, Volatility] = {}
+        self._tracked: set[str] = set(CANDLE_STORE_FIGIS)
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._wakeup = asyncio.Event()
+
+    def _file(self, figi: str) -> Path:
+        return self.path / f"{figi}_{self.interval}.npy"
+
+    # ---------- чтение ----------
+
+    def bars(self, figi: str) -> np.ndarray:
+        """Завершённые свечи FIGI (memmap только для чтения); пустой массив, если истории нет"""
+        bars = self._bars.get(figi)
+        if bars is None:
+            file = self._file(figi)
+            bars = np.load(file, mmap_mode="r") if file.exists() else np.empty(0, dtype=CANDLE_DTYPE)
+            self._bars[figi] = bars
+            if len(bars):
+                self._recompute(figi)
+        return bars
+
+    def volatility(self, figi: str) -> Optional[Volatility]:
+        """Последние ATR и волатильность из памяти. Неизвестный FIGI ставится на обновление"""
+        if figi not in self._tracked:
+            self.track(figi)
+        vol = self._volatility.get(figi)
+        if vol is None and figi not in self._bars:
+            self.bars(figi)
+            vol = self._volatility.get(figi)
+        # Устаревшая история (бот долго не работал) не годится для расчёта стопа
+        if vol is not None and time.time() - vol.bar_time > max(self.bar_seconds * 3, 4 * 86400):
+            return None
+        return vol
+
+    def track(self, figi: str):
+        self._tracked.add(figi)
+        self._wakeup.set()
+
+    def _recompute(self, figi: str):
+        bars = self._bars[figi]
+        if len(bars) <= self.window:
+            self._volatility.pop(figi, None)
+            return
+        high, low, close = (np.asarray(bars[f], dtype=np.float64) for f in ("high", "low", "close"))
+        last_atr = float(atr(high, low, close, self.window)[-1])
+        last_close = float(close[-1])
+        self._volatility[figi] = Volatility(
+            atr=last_atr,
+            atr_percent=last_atr / last_close * 100 if last_close else 0.0,
+            realized_percent=float(realized_volatility(close, self.window)[-1]),
+            close=last_close,
+            bar_time=int(bars["time"][-1]),
+            bars=len(bars),
+        )
+
+    # ---------- обновление ----------
+
+    async def refresh(self, figi: str) -> int:
+        """Догружает завершённые бары после последнего сохранённого; возвращает число новых"""
+        lock = self._locks.setdefault(figi, asyncio.Lock())
+        async with lock:
+            bars = self.bars(figi)
+            now = datetime.now(timezone.utc)
+            if len(bars):
+                start = datetime.fromtimestamp(int(bars["time"][-1]) + self.bar_seconds, tz=timezone.utc)
+            else:
+                start = now - timedelta(days=self.history_days)
+            if now - start < timedelta(seconds=self.bar_seconds):
+                return 0
+
+            rows = []
+            async with AsyncClient(self.token) as client:
+                async for c in client.get_all_candles(figi=figi, from_=start, to=now, interval=self.api_interval):
+                    if not c.is_complete:
+                        continue
+                    rows.append((int(c.time.timestamp()), _to_float(c.open), _to_float(c.high),
+                                 _to_float(c.low), _to_float(c.close), c.volume))
+            if not rows:
+                return 0
+
+            new = np.array(rows, dtype=CANDLE_DTYPE)
+            if len(bars):
+                new = new[new["time"] > bars["time"][-1]]
+                if not len(new):
+                    return 0
+            merged = np.concatenate((np.asarray(bars), new))[-self.max_bars:]
+            await asyncio.to_thread(self._write, figi, merged)
+            self._bars[figi] = np.load(self._file(figi), mmap_mode="r")
+            self._recompute(figi)
+            return len(new)
+
+    def _write(self, figi: str, bars: np.ndarray):
+        self.path.mkdir(parents=True, exist_ok=True)
+        file = self._file(figi)
+        tmp = file.with_name(file.stem + ".tmp.npy")
+        np.save(tmp, bars)
+        tmp.replace(file)
+
+    async def refresh_all(self):
+        figis = list(self._tracked)
+        results = await asyncio.gather(*(self.refresh(f) for f in figis), return_exceptions=True)
+        for figi, res in zip(figis, results):
+            if isinstance(res, Exception):
+                logger.warning(f"Candle refresh failed for {figi}: {res}")
+            elif res:
+                vol = self._volatility.get(figi)
+                logger.info(f"Candles {figi}: +{res} bars, ATR {vol.atr_percent:.2f}%" if vol else f"Candles {figi}: +{res} bars")
+
+    async def run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                await self.refresh_all()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Candle store refresh error: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=CANDLE_REFRESH_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+_store: Optional[CandleStore] = None
+
+def get_candle_store(token: str) -> CandleStore:
+    """Одно хранилище на процесс"""
+    global _store
+    if _store is None:
+        _store = CandleStore(token)
+    return _store
@@ -0,0 +1,159 @@
+# app/trading/daily_limits.py
+# Дневные лимиты, общие для всех воркеров webhook-сервера и бота.
+# Счётчики торгового дня живут в Redis: оборот, число входов по инструменту и реализованный убыток.
+# Перед заявкой Lua-скрипт за один запрос проверяет все лимиты и, только если ни один не нарушен,
+# резервирует объём (INCRBY) — гонки между воркерами исключены без глобальной блокировки.
+# Ключи содержат торговый день (МСК, граница TRADING_DAY_RESET) и истекают после его окончания.
+import os
+import math
+import logging
+from dataclasses import dataclass, field
+from datetime import timedelta
+from decimal import Decimal
+from typing import Optional
+
+from trading.settings_manager import BotSettings, get_settings
+from trading.trading_calendar import trading_day, trading_day_end
+from utils.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# При недоступном Redis: 0 — пропускать заявки (остаётся локальный журнал экспозиции), 1 — отклонять
+DAILY_LIMITS_FAIL_CLOSED = os.getenv("DAILY_LIMITS_FAIL_CLOSED", "0").lower() in ("1", "true", "yes", "on")
+_PREFIX = "risk:daily:"
+
+# KEYS — счётчики; ARGV[1] — unix-время истечения, далее пары (приращение, лимит) по ключам.
+# Лимит 0 — без ограничения; при нулевом приращении лимит считается исчерпанным на границе.
+_RESERVE_LUA = """
+local expire_at = tonumber(ARGV[1])
+for i = 1, #KEYS do
+  local cur = tonumber(redis.call('GET', KEYS[i]) or '0')
+  local inc = tonumber(ARGV[2 * i])
+  local limit = tonumber(ARGV[2 * i + 1])
+  if limit > 0 and ((inc > 0 and cur + inc > limit) or (inc == 0 and cur >= limit)) then
+    return {0, i, tostring(cur)}
+  end
+end
+for i = 1, #KEYS do
+  local inc = tonumber(ARGV[2 * i])
+  if inc ~= 0 then
+    redis.call('INCRBY', KEYS[i], inc)
+  end
+  redis.call('EXPIREAT', KEYS[i], expire_at)
+end
+return {1, 0, ''}
+"""
+
+# KEYS[1] — счётчик убытка, KEYS[2] — метка учтённого исполнения; ARGV — убыток, время истечения.
+# Одно и то же исполнение (повтор потока, второй процесс) учитывается один раз
+_RECORD_LOSS_LUA = """
+if redis.call('SET', KEYS[2], '1', 'NX') then
+  redis.call('EXPIREAT', KEYS[2], ARGV[2])
+  redis.call('INCRBY', KEYS[1], ARGV[1])
+  redis.call('EXPIREAT', KEYS[1], ARGV[2])
+  return 1
+end
+return 0
+"""
+
+@dataclass
+class Reservation:
+    ok: bool
+    reason: Optional[str] = None
+    # Зарезервированные приращения: откатываются, если заявка не исполнилась
+    increments: dict[str, int] = field(default_factory=dict)
+
+    async def release(self):
+        if not self.increments:
+            return
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            for key, inc in self.increments.items():
+                pipe.decrby(key, inc)
+            await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Daily limits release failed: {e}")
+        self.increments = {}
+
+class DailyLimits:
+    def __init__(self):
+        self._script = None
+        self._loss_script = None
+
+    def _keys(self, account_id: str) -> tuple[str, int]:
+        day = trading_day()
+        # Запас в сутки после конца дня — на случай расхождения часов воркеров
+        expire_at = int((trading_day_end() + timedelta(days=1)).timestamp())
+        return f"{_PREFIX}{account_id}:{day.isoformat()}", expire_at
+
+    async def reserve(self, account_id: str, symbol: str, notional: Decimal,
+                      settings: Optional[BotSettings] = None) -> Reservation:
+        """Проверяет дневные лимиты и резервирует оборот и вход за один запрос"""
+        settings = settings or get_settings()
+        base, expire_at = self._keys(account_id)
+        checks = [
+            # (ключ, приращение, лимит, описание)
+            (f"{base}:notional", math.ceil(notional), int(settings.max_daily_notional), "дневной оборот"),
+            (f"{base}:trades:{symbol.upper()}", 1, settings.max_daily_trades_per_symbol, f"входов по {symbol} за день"),
+            (f"{base}:loss", 0, int(settings.max_daily_loss), "дневной убыток"),
+        ]
+        checks = [c for c in checks if c[2] > 0]
+        if not checks:
+            return Reservation(True)
+
+        try:
+            if self._script is None:
+                self._script = get_redis().register_script(_RESERVE_LUA)
+            args = [expire_at]
+            for _, inc, limit, _ in checks:
+                args += [inc, limit]
+            allowed, index, current = await self._script(keys=[c[0] for c in checks], args=args)
+        except Exception as e:
+            logger.warning(f"Daily limits unavailable: {e}")
+            if DAILY_LIMITS_FAIL_CLOSED:
+                return Reservation(False, f"общие дневные лимиты недоступны ({e})")
+            return Reservation(True)
+
+        if int(allowed) == 1:
+            return Reservation(True, increments={key: inc for key, inc, _, _ in checks if inc})
+        key, inc, limit, title = checks[int(index) - 1]
+        return Reservation(False, f"{title}: {current} + {inc} > {limit}" if inc else f"{title}: {current} ≥ {limit}")
+
+    async def record_loss(self, account_id: str, loss: Decimal, ref: Optional[str] = None):
+        """
+        Реализованный убыток закрытия (положительное число) в счётчик дня.
+        ref — идентификатор исполнения: повторная запись с тем же ref не учитывается
+        """
+        if loss <= 0:
+            return
+        base, expire_at = self._keys(account_id)
+        try:
+            if ref is None:
+                pipe = get_redis().pipeline(transaction=False)
+                pipe.incrby(f"{base}:loss", math.ceil(loss))
+                pipe.expireat(f"{base}:loss", expire_at)
+                await pipe.execute()
+                return
+            if self._loss_script is None:
+                self._loss_script = get_redis().register_script(_RECORD_LOSS_LUA)
+            # Метки вне base: snapshot показывает только счётчики
+            ref_key = f"{_PREFIX}refs:{account_id}:{base.rsplit(':', 1)[1]}:{ref}"
+            await self._loss_script(keys=[f"{base}:loss", ref_key], args=[math.ceil(loss), expire_at])
+        except Exception as e:
+            logger.warning(f"Daily loss record failed: {e}")
+
+    async def snapshot(self, account_id: str) -> dict:
+        base, _ = self._keys(account_id)
+        redis = get_redis()
+        result = {}
+        async for key in redis.scan_iter(match=f"{base}:*"):
+            result[key[len(base) + 1:]] = int(await redis.get(key) or 0)
+        return result
+
+_daily_limits: Optional[DailyLimits] = None
+
+def get_daily_limits() -> DailyLimits:
+    global _daily_limits
+    if _daily_limits is None:
+        _daily_limits = DailyLimits()
+    return _daily_limits
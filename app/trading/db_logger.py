@@ -1,44 +1,379 @@
 # app/trading/db_logger.py
+# Журнал событий в event_logs. log_event() только кладёт запись в буфер в памяти,
+# фоновый флашер пишет пачками через COPY из пула соединений asyncpg —
+# запись в БД не добавляет задержки к исполнению ордеров. Пока база недоступна,
+# пачки уходят в локальный журнал trading/event_spill.py и дописываются позже.
+# Повторяются только ошибки соединения и доступности базы; пачка, отклонённая из-за данных
+# или схемы (DataError, UndefinedColumn, нарушение ограничения), откладывается в карантин.
+# Тем же флашером пишутся типизированные строки signals, trades и errors (record_*);
+# каждая таблица пачки записывается в своей транзакции, и ошибка в одной не откатывает остальные.
 import asyncio
 import json
 import logging
 import os
-from datetime import datetime
+import time
+from collections import deque
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Optional
+from uuid import UUID, uuid4
 import asyncpg
 
+from trading.event_spill import SpillLog
+
 logger = logging.getLogger(__name__)
 
 # Получаем URL базы данных из переменных окружения
 DATABASE_URL = os.getenv("DB_URL")
 
+EVENT_LOG_BUFFER = int(os.getenv("EVENT_LOG_BUFFER", "10000"))
+EVENT_LOG_BATCH = int(os.getenv("EVENT_LOG_BATCH", "500"))
+EVENT_LOG_FLUSH_INTERVAL = float(os.getenv("EVENT_LOG_FLUSH_INTERVAL", "0.5"))
+# Сколько log_event может ждать места в полном буфере, прежде чем вытеснить самую старую запись (сек)
+EVENT_LOG_BACKPRESSURE_WAIT = float(os.getenv("EVENT_LOG_BACKPRESSURE_WAIT", "0.05"))
+EVENT_LOG_POOL_SIZE = int(os.getenv("EVENT_LOG_POOL_SIZE", "2"))
+EVENT_LOG_CONNECT_TIMEOUT = float(os.getenv("EVENT_LOG_CONNECT_TIMEOUT", "5"))
+EVENT_SPILL_ENABLED = os.getenv("EVENT_SPILL_ENABLED", "1").lower() in ("1", "true", "yes", "on")
+
+# Классы SQLSTATE, при которых повтор той же пачки не поможет: данные, ограничения, схема
+_POISON_SQLSTATE_CLASSES = ("22", "23", "42")
+
+EVENT_COLUMNS = ("event_time", "event_type", "symbol", "details", "message")
+# Колонки таблиц, которые пишет флашер; порядок совпадает с порядком значений в записи
+TABLE_COLUMNS = {
+    "event_logs": EVENT_COLUMNS,
+    "signals": ("id", "action", "symbol", "risk_percent", "raw_payload", "created_at", "price"),
+    "trades": ("id", "signal_id", "figi", "ticker", "direction", "action", "lots", "amount",
+               "price", "status", "order_id", "details", "created_at"),
+    "errors": ("id", "signal_id", "source", "symbol", "message", "traceback", "created_at"),
+}
+
+def is_poison_error(e: Exception) -> bool:
+    """Ошибка вызвана самими строками пачки, а не доступностью базы"""
+    if isinstance(e, asyncpg.PostgresError):
+        return (e.sqlstate or "")[:2] in _POISON_SQLSTATE_CLASSES
+    # Значение не кодируется в тип колонки на стороне клиента (asyncpg DataError — подкласс ValueError)
+    return isinstance(e, (ValueError, TypeError))
+
+# Порядок записи групп пачки: сигнал попадает в базу раньше своих сделок и ошибок
+_TABLE_ORDER = ("signals", "trades", "errors", "event_logs")
+
+class _UnwrittenRows(Exception):
+    """База недоступна посреди пачки; rows — строки, которые ещё не записаны"""
+
+    def __init__(self, rows: list, error: Exception):
+        super().__init__(str(error))
+        self.rows = rows
+        self.error = error
+
+class EventLogger:
+    def __init__(self, dsn: Optional[str] = DATABASE_URL, buffer_size: int = EVENT_LOG_BUFFER,
+                 batch_size: int = EVENT_LOG_BATCH, flush_interval: float = EVENT_LOG_FLUSH_INTERVAL,
+                 backpressure_wait: float = EVENT_LOG_BACKPRESSURE_WAIT, pool_size: int = EVENT_LOG_POOL_SIZE,
+                 spill: Optional[SpillLog] = None):
+        self.dsn = dsn
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.backpressure_wait = backpressure_wait
+        self.pool_size = pool_size
+        # Если база недоступна, события уходят в локальный журнал на диске, а не теряются
+        self.spill = spill
+        self._buffer: deque = deque()
+        self._pool: Optional[asyncpg.Pool] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._space: Optional[asyncio.Event] = None
+        self._stopping = False
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.spilled = 0
+        self.replayed = 0
+        self.quarantined = 0
+        self._delay = 1.0
+        self._retry_at = 0.0
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    async def start(self):
+        if self.is_running:
+            return
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Event logger started (buffer {self.buffer_size}, batch {self.batch_size})")
+
+    async def stop(self, timeout: float = 10.0):
+        """Останавливает флашер, дописав всё, что осталось в буфере"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+            logger.warning(f"Event logger stopped with {len(self._buffer)} unwritten events")
+        self._task = None
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+        logger.info(
+            f"Event logger stopped: written={self.written}, spilled={self.spilled}, "
+            f"replayed={self.replayed}, quarantined={self.quarantined}, dropped={self.dropped}"
+        )
+
+    async def log(self, event_type: str, symbol: str = None, details: dict = None, message: str = ""):
+        record = (datetime.now(timezone.utc), event_type, symbol, json.dumps(details or {}, default=str), message)
+        await self.write("event_logs", record)
+
+    async def write(self, table: str, record: tuple):
+        """Ставит строку таблицы из TABLE_COLUMNS в очередь на запись"""
+        item = (table, record)
+        if not self.is_running:
+            await self.start()
+        if len(self._buffer) >= self.buffer_size:
+            # Backpressure: коротко ждём флашер, затем вытесняем самую старую запись
+            self._space.clear()
+            self._wakeup.set()
+            try:
+                await asyncio.wait_for(self._space.wait(), self.backpressure_wait)
+            except asyncio.TimeoutError:
+                pass
+            if len(self._buffer) >= self.buffer_size:
+                self._buffer.popleft()
+                self.dropped += 1
+                if self.dropped % 1000 == 1:
+                    logger.warning(f"Event log buffer full, dropped {self.dropped} events so far")
+        self._buffer.append(item)
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            if not self._buffer:
+                if self._stopping:
+                    return
+                await self._wait()
+                if self.spill is not None and self.spill.has_data:
+                    await self._replay()
+                continue
+            if len(self._buffer) < self.batch_size and not self._stopping:
+                # Порог по размеру не набран — даём буферу накопиться до порога по времени
+                await self._wait()
+
+            batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+            self._space.set()
+
+            if self.spill is not None and self.spill.has_data:
+                # На диске есть более старые события: новые встают за ними, чтобы сохранить порядок
+                await self._spill(batch)
+                await self._replay()
+                continue
+            if time.monotonic() < self._retry_at and self.spill is not None:
+                await self._spill(batch)
+                continue
+            try:
+                await self._copy(batch)
+                self._delay = 1.0
+            except asyncio.CancelledError:
+                raise
+            except _UnwrittenRows as e:
+                # Уже записанные таблицы пачки не повторяются
+                batch = e.rows
+                self._backoff(f"Failed to write {len(batch)} events: {e.error}")
+                if self.spill is not None:
+                    await self._spill(batch)
+                else:
+                    self._requeue(batch)
+                    if self._stopping:
+                        logger.error(f"Event logger: database unavailable on shutdown, {len(self._buffer)} events lost")
+                        self.dropped += len(self._buffer)
+                        self._buffer.clear()
+                        return
+                    await asyncio.sleep(self._delay)
+
+    async def _wait(self):
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    def _backoff(self, reason: str):
+        logger.error(f"{reason}; next database attempt in {self._delay:.0f}s")
+        self._retry_at = time.monotonic() + self._delay
+        self._delay = min(self._delay * 2, 30.0)
+
+    async def _spill(self, batch: list):
+        try:
+            await asyncio.to_thread(self.spill.append, batch)
+            self.spilled += len(batch)
+        except Exception as e:
+            logger.error(f"Failed to spill {len(batch)} events to disk: {e}")
+            if self._stopping:
+                self.dropped += len(batch)
+                return
+            self._requeue(batch)
+            await asyncio.sleep(self._delay)
+
+    async def _replay(self):
+        """Дочитывает сегменты с диска в event_logs по порядку, пока база доступна"""
+        if self._stopping or time.monotonic() < self._retry_at:
+            return
+        while self.spill.has_data:
+            path, records = await asyncio.to_thread(self.spill.oldest)
+            try:
+                for i in range(0, len(records), self.batch_size):
+                    await self._copy(records[i:i + self.batch_size])
+            except asyncio.CancelledError:
+                raise
+            except _UnwrittenRows as e:
+                # Частично записанный сегмент повторится целиком: дубли лучше потерь
+                self._backoff(f"Event spill replay of {path.name} failed: {e.error}")
+                return
+            self._delay = 1.0
+            await asyncio.to_thread(self.spill.ack, path)
+            self.replayed += len(records)
+            logger.info(f"Replayed {len(records)} spilled events from {path.name}")
+
+    async def _copy(self, batch: list):
+        """
+        Пишет пачку по таблицам, каждую в своей транзакции. Таблица, отклонённая базой
+        из-за данных или схемы, уходит в карантин, остальные записываются. При ошибке
+        доступности базы — _UnwrittenRows с ещё не записанными строками
+        """
+        if self._pool is None:
+            try:
+                self._pool = await asyncpg.create_pool(
+                    self.dsn, min_size=1, max_size=self.pool_size, timeout=EVENT_LOG_CONNECT_TIMEOUT
+                )
+            except Exception as e:
+                # Ошибка подключения — недоступность базы, а не данные пачки
+                raise _UnwrittenRows(batch, e) from e
+        groups: dict[str, list] = {}
+        for item in batch:
+            groups.setdefault(item[0], []).append(item)
+        ordered = [groups.pop(t) for t in _TABLE_ORDER if t in groups] + list(groups.values())
+        started = time.monotonic()
+        for i, rows in enumerate(ordered):
+            try:
+                await self._copy_table(rows)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if not is_poison_error(e):
+                    raise _UnwrittenRows([item for group in ordered[i:] for item in group], e) from e
+                await self._quarantine(rows, e)
+                continue
+            self.written += len(rows)
+        self.flushes += 1
+        logger.debug(f"Logged {len(batch)} events in {int((time.monotonic() - started) * 1000)} ms")
+
+    async def _copy_table(self, rows: list):
+        table = rows[0][0]
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.copy_records_to_table(
+                    table, records=[record for _, record in rows], columns=TABLE_COLUMNS[table]
+                )
+
+    async def _quarantine(self, batch: list, error: Exception):
+        """Пачку с ошибкой данных или схемы не повторяем: в карантин на диске или в потери"""
+        tables = ", ".join(sorted({table for table, _ in batch}))
+        if self.spill is None:
+            self.dropped += len(batch)
+            logger.error(f"Dropped {len(batch)} rows ({tables}) rejected by the database: {error}")
+            return
+        try:
+            path = await asyncio.to_thread(self.spill.quarantine, batch)
+        except Exception as e:
+            self.dropped += len(batch)
+            logger.error(f"Dropped {len(batch)} rows ({tables}) rejected by the database: {error}; quarantine failed: {e}")
+            return
+        self.quarantined += len(batch)
+        logger.error(f"Quarantined {len(batch)} rows ({tables}) rejected by the database to {path.name}: {error}")
+
+    def _requeue(self, batch: list):
+        # Возвращаем пачку в начало буфера; если места нет — теряем самые старые
+        free = self.buffer_size - len(self._buffer)
+        if free < len(batch):
+            self.dropped += len(batch) - max(free, 0)
+            batch = batch[len(batch) - max(free, 0):]
+        self._buffer.extendleft(reversed(batch))
+
+_event_logger: Optional[EventLogger] = None
+
+def get_event_logger() -> EventLogger:
+    global _event_logger
+    if _event_logger is None:
+        _event_logger = EventLogger(spill=SpillLog() if EVENT_SPILL_ENABLED else None)
+    return _event_logger
+
+async def start_event_logger():
+    if DATABASE_URL:
+        await get_event_logger().start()
+
+async def stop_event_logger():
+    if _event_logger is not None:
+        await _event_logger.stop()
+
 async def log_event(event_type: str, symbol: str = None, details: dict = None, message: str = ""):
-    """Записывает событие в таблицу event_logs"""
+    """Ставит событие в очередь на запись в таблицу event_logs"""
     if not DATABASE_URL:
         logger.warning("DATABASE_URL not configured, skipping event logging")
         return
-        
+
     try:
-        conn = await asyncpg.connect(DATABASE_URL)
-        
-        await conn.execute(
-            """
-            INSERT INTO event_logs(event_time, event_type, symbol, details, message)
-            VALUES($1, $2, $3, $4, $5)
-            """,
-            datetime.utcnow(), 
-            event_type, 
-            symbol, 
-            json.dumps(details or {}), 
-            message
-        )
-        
-        await conn.close()
-        logger.info(f"Logged event: {event_type} - {message}")
-        
+        await get_event_logger().log(event_type, symbol, details, message)
     except Exception as e:
         logger.error(f"Failed to log event to database: {e}")
 
+async def _write_row(table: str, record: tuple):
+    if not DATABASE_URL:
+        return
+    try:
+        await get_event_logger().write(table, record)
+    except Exception as e:
+        logger.error(f"Failed to queue {table} row: {e}")
+
+def _utcnow() -> datetime:
+    # created_at в signals/trades/errors — TIMESTAMP WITHOUT TIME ZONE, храним UTC
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def _decimal(value) -> Optional[Decimal]:
+    return Decimal(str(value)) if value is not None else None
+
+async def record_signal(signal_id: UUID, action: str, symbol: Optional[str],
+                        risk_percent: Optional[float], raw_payload: dict, price: Optional[float] = None):
+    """Строка в signals; id генерируется при приёме вебхука и связывает сигнал с его сделками"""
+    await _write_row("signals", (
+        signal_id, action, symbol, _decimal(risk_percent),
+        json.dumps(raw_payload, ensure_ascii=False, default=str), _utcnow(), _decimal(price),
+    ))
+
+async def record_trade(figi: str, ticker: Optional[str], direction: str, action: str, lots: int,
+                       status: str, signal_id: Optional[UUID] = None, amount=None, price=None,
+                       order_id: Optional[str] = None, details: dict = None):
+    """Строка в trades: action — open/close, direction — направление позиции, price — цена исполнения в пунктах"""
+    await _write_row("trades", (
+        uuid4(), signal_id, figi, ticker, direction, action, int(lots), _decimal(amount), _decimal(price),
+        status, order_id, json.dumps(details or {}, ensure_ascii=False, default=str), _utcnow(),
+    ))
+
+async def record_error(source: str, message: str, traceback: Optional[str] = None,
+                       signal_id: Optional[UUID] = None, symbol: Optional[str] = None):
+    await _write_row("errors", (uuid4(), signal_id, source, symbol, message, traceback, _utcnow()))
+
 # Функция для тестирования
 async def test_logging():
     """Тестовая функция для проверки логирования"""
-    await log_event("test", "TEST_SYMBOL", {"test": True}, "Test log entry")
\ No newline at end of file
+    await log_event("test", "TEST_SYMBOL", {"test": True}, "Test log entry")
@@ -0,0 +1,77 @@
+# app/trading/db_maintenance.py
+# Миграции схемы и обслуживание секций event_logs.
+# SQL-файлы лежат в app/migrations (NNN_описание.sql) и применяются по порядку имён,
+# каждый в своей транзакции; применённые версии записываются в schema_migrations.
+import os
+import logging
+from pathlib import Path
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+DATABASE_URL = os.getenv("DB_URL")
+MIGRATIONS_DIR = Path(__file__).resolve().parents[1] / "migrations"
+# Сколько полных месяцев событий держать в event_logs; 0 — не архивировать
+EVENT_LOG_RETENTION_MONTHS = int(os.getenv("EVENT_LOG_RETENTION_MONTHS", "6"))
+# На сколько месяцев вперёд заранее создавать секции
+EVENT_LOG_PARTITIONS_AHEAD = int(os.getenv("EVENT_LOG_PARTITIONS_AHEAD", "2"))
+
+# Webhook-сервер и Telegram-бот стартуют одновременно — миграции под advisory lock
+_MIGRATION_LOCK_ID = 0x7452_4144  # "tRAD"
+
+async def run_migrations(dsn: str = DATABASE_URL) -> list[str]:
+    """Применяет новые миграции, возвращает их версии"""
+    if not dsn:
+        logger.warning("DATABASE_URL not configured, skipping migrations")
+        return []
+    applied_now = []
+    conn = await asyncpg.connect(dsn)
+    try:
+        await conn.execute("SELECT pg_advisory_lock($1)", _MIGRATION_LOCK_ID)
+        await conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version TEXT PRIMARY KEY,
+                applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+            )
+            """
+        )
+        applied = {r["version"] for r in await conn.fetch("SELECT version FROM schema_migrations")}
+        for path in sorted(MIGRATIONS_DIR.glob("*.sql")):
+            version = path.stem
+            if version in applied:
+                continue
+            async with conn.transaction():
+                await conn.execute(path.read_text(encoding="utf-8"))
+                await conn.execute("INSERT INTO schema_migrations(version) VALUES($1)", version)
+            applied_now.append(version)
+            logger.info(f"Applied migration {version}")
+    finally:
+        try:
+            await conn.execute("SELECT pg_advisory_unlock($1)", _MIGRATION_LOCK_ID)
+        finally:
+            await conn.close()
+    return applied_now
+
+async def maintain_event_logs(dsn: str = DATABASE_URL,
+                              retention_months: int = EVENT_LOG_RETENTION_MONTHS,
+                              ahead: int = EVENT_LOG_PARTITIONS_AHEAD) -> list[str]:
+    """Создаёт секции на месяцы вперёд и переносит устаревшие в схему archive"""
+    if not dsn:
+        return []
+    conn = await asyncpg.connect(dsn)
+    try:
+        for i in range(ahead + 1):
+            await conn.execute(
+                "SELECT event_logs_ensure_partition(((now() AT TIME ZONE 'UTC') + make_interval(months => $1))::date)",
+                i,
+            )
+        archived = []
+        if retention_months > 0:
+            archived = [r[0] for r in await conn.fetch("SELECT * FROM event_logs_archive($1)", retention_months)]
+        if archived:
+            logger.info(f"Archived event_logs partitions: {', '.join(archived)}")
+        return archived
+    finally:
+        await conn.close()
@@ -0,0 +1,179 @@
+# app/trading/event_spill.py
+# Локальный журнал событий на случай недоступности PostgreSQL.
+# Пачки строк (event_logs, signals, trades, errors) дописываются в сегментные файлы
+# events-<N>.log, каждая строка — CRC32 и JSON с именем таблицы.
+# Флашер EventLogger дочитывает сегменты по порядку в базу, когда база снова доступна,
+# и удаляет их после успешной записи. Общий объём на диске ограничен: при переполнении
+# удаляются самые старые сегменты.
+# Пачки, которые база отклонила из-за данных или схемы, не повторяются, а пишутся в карантин
+# quarantine-<N>.log в том же формате; после исправления схемы файл можно вернуть в журнал,
+# переименовав в events-<N>.log с номером меньше текущих сегментов.
+import os
+import json
+import zlib
+import logging
+from datetime import datetime
+from decimal import Decimal
+from pathlib import Path
+from typing import Optional
+from uuid import UUID
+
+logger = logging.getLogger(__name__)
+
+_DEFAULT_DIR = Path(__file__).resolve().parents[1] / "db" / "event_spill"
+EVENT_SPILL_DIR = Path(os.getenv("EVENT_SPILL_DIR", str(_DEFAULT_DIR)))
+EVENT_SPILL_MAX_MB = float(os.getenv("EVENT_SPILL_MAX_MB", "256"))
+EVENT_SPILL_SEGMENT_MB = float(os.getenv("EVENT_SPILL_SEGMENT_MB", "8"))
+
+_PREFIX = "events-"
+_QUARANTINE_PREFIX = "quarantine-"
+_SUFFIX = ".log"
+
+def _encode_value(value):
+    # Типизированные значения строк signals/trades/errors переживают JSON с метками типа
+    if isinstance(value, datetime):
+        return {"$dt": value.isoformat()}
+    if isinstance(value, Decimal):
+        return {"$dec": str(value)}
+    if isinstance(value, UUID):
+        return {"$uuid": str(value)}
+    raise TypeError(f"Unsupported spill value: {type(value).__name__}")
+
+def _decode_value(value):
+    if isinstance(value, dict) and len(value) == 1:
+        (tag, raw), = value.items()
+        if tag == "$dt":
+            return datetime.fromisoformat(raw)
+        if tag == "$dec":
+            return Decimal(raw)
+        if tag == "$uuid":
+            return UUID(raw)
+    return value
+
+def encode_record(item: tuple) -> bytes:
+    """item — (таблица, кортеж значений в порядке колонок)"""
+    table, record = item
+    payload = json.dumps([table, list(record)], ensure_ascii=False, default=_encode_value)
+    data = payload.encode("utf-8")
+    return b"%08x\t" % zlib.crc32(data) + data + b"\n"
+
+def decode_record(line: bytes) -> Optional[tuple]:
+    """(таблица, значения) из строки сегмента или None, если строка повреждена"""
+    try:
+        crc, data = line.rstrip(b"\n").split(b"\t", 1)
+        if int(crc, 16) != zlib.crc32(data):
+            return None
+        table, record = json.loads(data)
+        return table, tuple(_decode_value(v) for v in record)
+    except Exception:
+        return None
+
+class SpillLog:
+    def __init__(self, directory: Path = EVENT_SPILL_DIR, max_bytes: int = int(EVENT_SPILL_MAX_MB * 1024 * 1024),
+                 segment_bytes: int = int(EVENT_SPILL_SEGMENT_MB * 1024 * 1024)):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.dropped = 0
+        self._segments: list[Path] = []
+        self._sizes: dict[Path, int] = {}
+        self._loaded = False
+
+    def _load(self):
+        if self._loaded:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._segments = sorted(self.directory.glob(f"{_PREFIX}*{_SUFFIX}"))
+        self._sizes = {p: p.stat().st_size for p in self._segments}
+        self._loaded = True
+        if self._segments:
+            logger.warning(f"Event spill has {len(self._segments)} segments ({self.size_bytes} bytes) to replay")
+
+    @property
+    def size_bytes(self) -> int:
+        return sum(self._sizes.values())
+
+    @property
+    def has_data(self) -> bool:
+        self._load()
+        return bool(self._segments)
+
+    def _new_segment(self) -> Path:
+        seq = int(self._segments[-1].name[len(_PREFIX):-len(_SUFFIX)]) + 1 if self._segments else 1
+        path = self.directory / f"{_PREFIX}{seq:010d}{_SUFFIX}"
+        self._segments.append(path)
+        self._sizes[path] = 0
+        return path
+
+    def append(self, records: list) -> int:
+        """Дописывает пачку в текущий сегмент с fsync. Блокирующий вызов — запускать через to_thread"""
+        self._load()
+        data = b"".join(encode_record(r) for r in records)
+        if not self._segments or self._sizes[self._segments[-1]] + len(data) > self.segment_bytes:
+            self._new_segment()
+        path = self._segments[-1]
+        with open(path, "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self._sizes[path] += len(data)
+        self._enforce_limit()
+        return len(records)
+
+    def _enforce_limit(self):
+        # Текущий сегмент не трогаем, даже если он один превышает лимит
+        while len(self._segments) > 1 and self.size_bytes > self.max_bytes:
+            oldest = self._segments.pop(0)
+            lost = self._count_lines(oldest)
+            self._sizes.pop(oldest, None)
+            oldest.unlink(missing_ok=True)
+            self.dropped += lost
+            logger.error(f"Event spill exceeds {self.max_bytes} bytes, dropped segment {oldest.name} ({lost} events)")
+
+    @staticmethod
+    def _count_lines(path: Path) -> int:
+        try:
+            with open(path, "rb") as f:
+                return sum(1 for _ in f)
+        except OSError:
+            return 0
+
+    def oldest(self) -> Optional[tuple[Path, list]]:
+        """Самый старый сегмент и его целые записи; повреждённые строки пропускаются"""
+        self._load()
+        if not self._segments:
+            return None
+        path = self._segments[0]
+        records, corrupted = [], 0
+        try:
+            with open(path, "rb") as f:
+                for line in f:
+                    record = decode_record(line)
+                    if record is None:
+                        corrupted += 1
+                    else:
+                        records.append(record)
+        except FileNotFoundError:
+            pass
+        if corrupted:
+            logger.warning(f"Event spill {path.name}: skipped {corrupted} corrupted lines")
+        return path, records
+
+    def quarantine(self, records: list) -> Path:
+        """Отдельный файл для отклонённой базой пачки; в лимит объёма журнала не входит"""
+        self._load()
+        existing = sorted(self.directory.glob(f"{_QUARANTINE_PREFIX}*{_SUFFIX}"))
+        seq = int(existing[-1].name[len(_QUARANTINE_PREFIX):-len(_SUFFIX)]) + 1 if existing else 1
+        path = self.directory / f"{_QUARANTINE_PREFIX}{seq:010d}{_SUFFIX}"
+        with open(path, "wb") as f:
+            f.write(b"".join(encode_record(r) for r in records))
+            f.flush()
+            os.fsync(f.fileno())
+        return path
+
+    def ack(self, path: Path):
+        """Сегмент записан в БД — удаляем"""
+        if path in self._segments:
+            self._segments.remove(path)
+        self._sizes.pop(path, None)
+        path.unlink(missing_ok=True)
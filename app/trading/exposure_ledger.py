@@ -0,0 +1,225 @@
+# app/trading/exposure_ledger.py
+# Учёт открытого риска счёта для предторговых проверок.
+# Позиция, номинал и гарантийное обеспечение по каждому FIGI, их суммы по счёту
+# и дневной оборот ведутся инкрементально: исполнения меняют только свою строку и итоги,
+# поэтому проверка лимитов перед заявкой — несколько сравнений в памяти, без запросов к API.
+# Состояние сохраняется в JSON (атомарная замена файла) и переживает перезапуск.
+import os
+import json
+import logging
+import asyncio
+from dataclasses import dataclass
+from decimal import Decimal
+from pathlib import Path
+from typing import Optional
+
+from tinkoff.invest import AsyncClient
+
+from trading.settings_manager import BotSettings, get_settings
+from trading.trading_calendar import trading_day
+
+logger = logging.getLogger(__name__)
+
+_LEDGER_DIR = Path(os.getenv("EXPOSURE_LEDGER_DIR", str(Path(__file__).resolve().parents[1] / "db")))
+
+@dataclass
+class SymbolExposure:
+    lots: int = 0  # со знаком: >0 лонг, <0 шорт
+    price_per_lot: Decimal = Decimal(0)  # средняя цена входа за лот
+    margin_per_lot: Decimal = Decimal(0)  # ГО на лот, 0 — неизвестно
+
+    @property
+    def notional(self) -> Decimal:
+        return abs(self.lots) * self.price_per_lot
+
+    @property
+    def margin(self) -> Decimal:
+        return abs(self.lots) * self.margin_per_lot
+
+class ExposureLedger:
+    def __init__(self, path: Path):
+        self.path = path
+        self._symbols: dict[str, SymbolExposure] = {}
+        self.total_notional = Decimal(0)
+        self.margin_used = Decimal(0)
+        self.day = trading_day().isoformat()
+        self.daily_notional = Decimal(0)
+        self._persist_lock = asyncio.Lock()
+        self._load()
+
+    # ---------- состояние ----------
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+            for figi, row in data.get("symbols", {}).items():
+                self._set(figi, SymbolExposure(
+                    int(row["lots"]), Decimal(row["price_per_lot"]), Decimal(row.get("margin_per_lot", "0"))
+                ))
+            self.day = data.get("day", self.day)
+            self.daily_notional = Decimal(data.get("daily_notional", "0"))
+            self._roll_day()
+            logger.info(f"Exposure ledger loaded: {len(self._symbols)} symbols, notional {self.total_notional}")
+        except Exception as e:
+            logger.warning(f"Exposure ledger {self.path} is invalid, starting empty: {e}")
+
+    def _dump(self) -> str:
+        return json.dumps({
+            "day": self.day,
+            "daily_notional": str(self.daily_notional),
+            "symbols": {
+                figi: {"lots": e.lots, "price_per_lot": str(e.price_per_lot), "margin_per_lot": str(e.margin_per_lot)}
+                for figi, e in self._symbols.items()
+            },
+        }, indent=2)
+
+    def _write(self, payload: str):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".json.tmp")
+        tmp.write_text(payload, encoding="utf-8")
+        tmp.replace(self.path)
+
+    async def persist(self):
+        # Снимок берётся синхронно, запись файла — вне event loop
+        payload = self._dump()
+        async with self._persist_lock:
+            try:
+                await asyncio.to_thread(self._write, payload)
+            except Exception as e:
+                logger.error(f"Exposure ledger persist failed: {e}")
+
+    def _set(self, figi: str, new: SymbolExposure):
+        """Замена строки FIGI с инкрементальной правкой итогов"""
+        old = self._symbols.get(figi)
+        if old is not None:
+            self.total_notional -= old.notional
+            self.margin_used -= old.margin
+        if new.lots == 0:
+            self._symbols.pop(figi, None)
+            return
+        self._symbols[figi] = new
+        self.total_notional += new.notional
+        self.margin_used += new.margin
+
+    def _roll_day(self):
+        today = trading_day().isoformat()
+        if today != self.day:
+            self.day = today
+            self.daily_notional = Decimal(0)
+
+    def get(self, figi: str) -> SymbolExposure:
+        return self._symbols.get(figi) or SymbolExposure()
+
+    # ---------- проверки и исполнения ----------
+
+    def check(self, figi: str, signed_lots: int, price_per_lot: Decimal,
+              margin_per_lot: Optional[Decimal] = None, settings: Optional[BotSettings] = None) -> Optional[str]:
+        """Причина отказа или None. Сокращение позиции не ограничивается"""
+        settings = settings or get_settings()
+        self._roll_day()
+        cur = self._symbols.get(figi) or SymbolExposure()
+        new_lots = cur.lots + signed_lots
+        if abs(new_lots) <= abs(cur.lots) and (new_lots == 0 or (new_lots > 0) == (cur.lots > 0)):
+            return None
+
+        notional_limits = settings.max_symbol_notional or settings.max_total_notional or settings.max_daily_notional
+        if notional_limits and price_per_lot <= 0:
+            # Без цены номинал заявки равен нулю и прошёл бы любой лимит
+            return "нет цены лота для проверки лимитов номинала"
+
+        added = abs(signed_lots) * price_per_lot
+        symbol_notional = abs(new_lots) * price_per_lot
+        total = self.total_notional - cur.notional + symbol_notional
+
+        if settings.max_symbol_notional and symbol_notional > Decimal(str(settings.max_symbol_notional)):
+            return f"позиция по инструменту {symbol_notional:.0f} > лимита {settings.max_symbol_notional:.0f}"
+        if settings.max_total_notional and total > Decimal(str(settings.max_total_notional)):
+            return f"суммарная позиция {total:.0f} > лимита {settings.max_total_notional:.0f}"
+        if settings.max_daily_notional and self.daily_notional + added > Decimal(str(settings.max_daily_notional)):
+            return f"дневной оборот {self.daily_notional + added:.0f} > лимита {settings.max_daily_notional:.0f}"
+        if settings.max_margin_used and margin_per_lot:
+            margin = self.margin_used - cur.margin + abs(new_lots) * margin_per_lot
+            if margin > Decimal(str(settings.max_margin_used)):
+                return f"гарантийное обеспечение {margin:.0f} > лимита {settings.max_margin_used:.0f}"
+        return None
+
+    def apply_fill(self, figi: str, signed_lots: int, price_per_lot: Decimal, margin_per_lot: Optional[Decimal] = None):
+        if not signed_lots:
+            return
+        self._roll_day()
+        cur = self._symbols.get(figi) or SymbolExposure()
+        new_lots = cur.lots + signed_lots
+        price = price_per_lot if price_per_lot > 0 else cur.price_per_lot
+        if cur.lots and cur.price_per_lot and price_per_lot > 0 and (new_lots > 0) == (cur.lots > 0):
+            if abs(new_lots) > abs(cur.lots):
+                # Доливка: средняя цена входа — по ней считается результат закрытия
+                price = (abs(cur.lots) * cur.price_per_lot + abs(signed_lots) * price_per_lot) / abs(new_lots)
+            else:
+                price = cur.price_per_lot
+        self._set(figi, SymbolExposure(
+            new_lots,
+            price,
+            margin_per_lot if margin_per_lot else cur.margin_per_lot,
+        ))
+        self.daily_notional += abs(signed_lots) * price_per_lot
+
+    def unpriced(self, positions: dict[str, int]) -> list[str]:
+        """FIGI открытых позиций брокера, для которых в журнале нет цены входа"""
+        return [figi for figi, lots in positions.items() if lots and not self.get(figi).price_per_lot]
+
+    def sync_positions(self, positions: dict[str, int], prices: Optional[dict[str, Decimal]] = None) -> bool:
+        """
+        Сверка с позициями брокера (снимок, который исполнитель и так запрашивает):
+        закрытия по TP/SL и сделки из других процессов не проходят через apply_fill.
+        Цены строк сохраняются; строкам без цены берётся цена лота из prices
+        (средняя цена позиции брокера, руб.). Дневной оборот не меняется
+        """
+        prices = prices or {}
+        changed = False
+        for figi in set(self._symbols) | set(positions):
+            lots = positions.get(figi, 0)
+            cur = self._symbols.get(figi)
+            base = cur or SymbolExposure()
+            price = base.price_per_lot or prices.get(figi, Decimal(0))
+            if base.lots != lots or price != base.price_per_lot:
+                self._set(figi, SymbolExposure(lots, price, base.margin_per_lot))
+                changed = True
+        return changed
+
+    def snapshot(self) -> dict:
+        self._roll_day()
+        return {
+            "day": self.day,
+            "total_notional": str(self.total_notional),
+            "margin_used": str(self.margin_used),
+            "daily_notional": str(self.daily_notional),
+            "symbols": {figi: {"lots": e.lots, "notional": str(e.notional)} for figi, e in self._symbols.items()},
+        }
+
+_ledgers: dict[str, ExposureLedger] = {}
+# ГО на лот меняется не чаще раза в торговый день: (figi, день) -> (на покупку, на продажу)
+_margins: dict[tuple[str, str], tuple[Decimal, Decimal]] = {}
+
+async def futures_margin(token: str, figi: str, direction: str) -> Optional[Decimal]:
+    """ГО на лот для направления; один запрос на FIGI в торговый день"""
+    key = (figi, trading_day().isoformat())
+    cached = _margins.get(key)
+    if cached is None:
+        try:
+            async with AsyncClient(token) as api:
+                resp = await api.instruments.get_futures_margin(figi=figi)
+        except Exception as e:
+            logger.warning(f"Futures margin unavailable for {figi}: {e}")
+            return None
+        to_dec = lambda m: Decimal(m.units) + Decimal(m.nano) / Decimal(1_000_000_000)
+        cached = _margins[key] = (to_dec(resp.initial_margin_on_buy), to_dec(resp.initial_margin_on_sell))
+    return cached[0] if direction == "long" else cached[1]
+
+def get_ledger(account_id: str) -> ExposureLedger:
+    """Один журнал на счёт в пределах процесса"""
+    ledger = _ledgers.get(account_id)
+    if ledger is None:
+        ledger = _ledgers[account_id] = ExposureLedger(_LEDGER_DIR / f"exposure_{account_id or 'default'}.json")
+    return ledger
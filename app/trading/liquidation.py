@@ -0,0 +1,252 @@
+# app/trading/liquidation.py
+# Авто-ликвидация в два этапа: прогрев за N секунд до времени ликвидации
+# (канал к брокеру, снимок позиций и ордеров, готовые заявки на закрытие)
+# и исполнение в T-0, где остаются только отправка заявок и отмена ордеров.
+# Закрытия после замера записываются в trades и журнал экспозиции, как у OrderExecutor.
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import Optional
+
+from tinkoff.invest import InstrumentIdType, OrderDirection, OrderType
+
+from trading.broker_session import BrokerSession
+from trading.db_logger import record_trade
+from trading.exposure_ledger import get_ledger
+from trading.market_cache import instrument_info, point_value
+
+logger = logging.getLogger(__name__)
+
+# Целевая длительность исполнения от T-0 до последней отправленной заявки (мс)
+LIQUIDATION_TARGET_MS = int(os.getenv("AUTO_LIQUIDATION_TARGET_MS", "1500"))
+# Прогрев старше этого считается устаревшим и повторяется перед исполнением (сек)
+WARMUP_MAX_AGE_SECONDS = int(os.getenv("AUTO_LIQUIDATION_WARMUP_MAX_AGE", "600"))
+
+@dataclass
+class PreparedClose:
+    figi: str
+    ticker: str
+    lots: int
+    direction: str  # направление позиции: long/short
+
+    @property
+    def order_direction(self):
+        if self.direction == "long":
+            return OrderDirection.ORDER_DIRECTION_SELL
+        return OrderDirection.ORDER_DIRECTION_BUY
+
+@dataclass
+class LiquidationReport:
+    closed: list[str] = field(default_factory=list)
+    failed: list[str] = field(default_factory=list)
+    cancelled_limits: int = 0
+    cancelled_stops: int = 0
+    warmed_up: bool = False
+    duration_ms: int = 0
+    target_ms: int = LIQUIDATION_TARGET_MS
+
+    @property
+    def within_target(self) -> bool:
+        return self.duration_ms <= self.target_ms
+
+class LiquidationRunner:
+    def __init__(self, token: str, account_id: str, target_ms: int = LIQUIDATION_TARGET_MS):
+        self.token = token
+        self.account_id = account_id
+        self.target_ms = target_ms
+        self.session = BrokerSession(token)
+        self._tickers: dict[str, str] = {}
+        self._prepared: dict[str, PreparedClose] = {}
+        self._stop_order_ids: list[str] = []
+        self._limit_order_ids: list[str] = []
+        self._warmed_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def is_warm(self) -> bool:
+        return self._warmed_at is not None and time.monotonic() - self._warmed_at < WARMUP_MAX_AGE_SECONDS
+
+    async def warm_up(self):
+        """Открывает канал, снимает позиции и ордера, готовит заявки на закрытие"""
+        async with self._lock:
+            started = time.monotonic()
+            api = await self.session.open()
+            positions, stop_orders, orders = await asyncio.gather(
+                api.operations.get_positions(account_id=self.account_id),
+                api.stop_orders.get_stop_orders(account_id=self.account_id),
+                api.orders.get_orders(account_id=self.account_id),
+            )
+            signed = self._signed_lots(positions)
+            await self._resolve_tickers(api, list(signed))
+
+            self._prepared = {figi: self._prepare(figi, qty) for figi, qty in signed.items()}
+            self._stop_order_ids = [o.stop_order_id for o in stop_orders.stop_orders]
+            self._limit_order_ids = [o.order_id for o in orders.orders]
+            self._warmed_at = time.monotonic()
+            logger.info(
+                f"Liquidation warm-up done in {int((self._warmed_at - started) * 1000)} ms: "
+                f"{len(self._prepared)} positions, {len(self._stop_order_ids)} stops, {len(self._limit_order_ids)} limits"
+            )
+
+    async def execute(self) -> LiquidationReport:
+        """T-0: отмена ордеров и отправка заявок на закрытие, всё параллельно"""
+        report = LiquidationReport(target_ms=self.target_ms, warmed_up=self.is_warm)
+        started = time.monotonic()
+        if not report.warmed_up:
+            logger.warning("Liquidation runs cold: warm-up missing or stale")
+            await self.warm_up()
+
+        async with self._lock:
+            api = await self.session.open()
+
+            # Позиции перечитываем параллельно с отменой ордеров: за время прогрева их могли закрыть
+            # тейки/стопы, и заготовленная заявка открыла бы позицию в обратную сторону
+            positions, stops_done, limits_done = await asyncio.gather(
+                api.operations.get_positions(account_id=self.account_id),
+                self._cancel_all(api.stop_orders.cancel_stop_order, "stop_order_id", self._stop_order_ids),
+                self._cancel_all(api.orders.cancel_order, "order_id", self._limit_order_ids),
+            )
+            report.cancelled_stops = stops_done
+            report.cancelled_limits = limits_done
+
+            signed = self._signed_lots(positions)
+            missing = [figi for figi in signed if figi not in self._tickers]
+            if missing:
+                await self._resolve_tickers(api, missing)
+            closes = [
+                self._prepared[figi] if self._matches(self._prepared.get(figi), qty) else self._prepare(figi, qty)
+                for figi, qty in signed.items()
+            ]
+
+            results = await asyncio.gather(*(self._submit(api, c) for c in closes), return_exceptions=True)
+            for close, res in zip(closes, results):
+                if isinstance(res, Exception):
+                    logger.error(f"Auto close error {close.ticker}: {res}")
+                    report.failed.append(close.ticker)
+                else:
+                    report.closed.append(close.ticker)
+
+            report.duration_ms = int((time.monotonic() - started) * 1000)
+            self._warmed_at = None
+            self._prepared = {}
+
+            await self._record_closes(closes, results)
+
+            # Вне замера: добираем ордера, выставленные между прогревом и T-0
+            await self._sweep(api, report)
+
+        level = logging.INFO if report.within_target else logging.WARNING
+        logger.log(level, f"Liquidation finished in {report.duration_ms} ms (target {report.target_ms} ms, warm={report.warmed_up})")
+        return report
+
+    async def close(self):
+        self._warmed_at = None
+        await self.session.close()
+
+    def _prepare(self, figi: str, qty: int) -> PreparedClose:
+        return PreparedClose(
+            figi=figi,
+            ticker=self._tickers.get(figi, figi),
+            lots=abs(qty),
+            direction="long" if qty > 0 else "short",
+        )
+
+    @staticmethod
+    def _matches(prepared: Optional[PreparedClose], qty: int) -> bool:
+        if prepared is None:
+            return False
+        return prepared.lots == abs(qty) and prepared.direction == ("long" if qty > 0 else "short")
+
+    @staticmethod
+    def _signed_lots(positions) -> dict[str, int]:
+        # Как в TinkoffClient.get_positions_async: позиция = свободный + заблокированный баланс
+        result = {}
+        for fut in positions.futures:
+            qty = int(getattr(fut, "balance", 0) or 0) + int(getattr(fut, "blocked", 0) or 0)
+            if qty != 0:
+                result[fut.figi] = qty
+        return result
+
+    async def _resolve_tickers(self, api, figis: list[str]):
+        async def resolve(figi: str):
+            try:
+                resp = await api.instruments.get_instrument_by(
+                    id_type=InstrumentIdType.INSTRUMENT_ID_TYPE_FIGI, id=figi
+                )
+                self._tickers[figi] = resp.instrument.ticker
+            except Exception as e:
+                logger.warning(f"Ticker lookup failed for {figi}: {e}")
+        await asyncio.gather(*(resolve(f) for f in figis if f not in self._tickers))
+
+    async def _cancel_all(self, cancel, id_field: str, ids: list[str]) -> int:
+        async def one(order_id: str) -> bool:
+            try:
+                await cancel(account_id=self.account_id, **{id_field: order_id})
+                return True
+            except Exception as e:
+                logger.error(f"Error cancelling {id_field} {order_id}: {e}")
+                return False
+        results = await asyncio.gather(*(one(i) for i in ids))
+        return sum(results)
+
+    async def _sweep(self, api, report: LiquidationReport):
+        try:
+            stop_orders, orders = await asyncio.gather(
+                api.stop_orders.get_stop_orders(account_id=self.account_id),
+                api.orders.get_orders(account_id=self.account_id),
+            )
+            report.cancelled_stops += await self._cancel_all(
+                api.stop_orders.cancel_stop_order, "stop_order_id", [o.stop_order_id for o in stop_orders.stop_orders]
+            )
+            report.cancelled_limits += await self._cancel_all(
+                api.orders.cancel_order, "order_id", [o.order_id for o in orders.orders]
+            )
+        except Exception as e:
+            logger.error(f"Liquidation sweep error: {e}")
+
+    async def _record_closes(self, closes: list[PreparedClose], results: list):
+        """Строки trades и журнал экспозиции: ликвидация идёт мимо OrderExecutor"""
+        ledger = get_ledger(self.account_id)
+        for close, res in zip(closes, results):
+            failed = isinstance(res, Exception)
+            await record_trade(
+                close.figi, close.ticker, close.direction, "close", close.lots,
+                "failed" if failed else "success",
+                price=None if failed else await self._fill_price(close.figi, res),
+                order_id=None if failed else res.order_id,
+                details={"source": "auto_liquidation", **({"message": str(res)} if failed else {})},
+            )
+            if not failed:
+                signed_lots = -close.lots if close.direction == "long" else close.lots
+                ledger.apply_fill(close.figi, signed_lots, ledger.get(close.figi).price_per_lot)
+        await ledger.persist()
+
+    async def _fill_price(self, figi: str, resp) -> Optional[Decimal]:
+        """Цена исполнения в пунктах, как в OrderExecutor"""
+        price_q = getattr(resp, "executed_order_price", None)
+        if price_q is None:
+            return None
+        price = Decimal(price_q.units) + Decimal(price_q.nano) / Decimal(1_000_000_000)
+        if price <= 0:
+            return None
+        try:
+            info = await instrument_info(self.token, figi)
+        except Exception as e:
+            logger.warning(f"Instrument lookup failed for {figi}: {e}")
+            return None
+        return price / point_value(info) if info else None
+
+    async def _submit(self, api, close: PreparedClose):
+        resp = await api.orders.post_order(
+            order_id="",
+            figi=close.figi,
+            quantity=close.lots,
+            direction=close.order_direction,
+            account_id=self.account_id,
+            order_type=OrderType.ORDER_TYPE_MARKET,
+        )
+        logger.info(f"Auto-closed position: {close.ticker} ({close.direction}, {close.lots} lots) order {resp.order_id}")
+        return resp
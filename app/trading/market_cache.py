@@ -0,0 +1,162 @@
+# app/trading/market_cache.py
+# Общие для всех счетов справочные и рыночные данные.
+# Поиск FIGI, параметры инструмента и котировка не зависят от счёта: при рассылке сигнала
+# на несколько счетов они запрашиваются один раз. Одновременные запросы одного ключа
+# сводятся в один вызов API (single-flight), котировки живут MARKET_QUOTE_TTL_MS.
+# FIGI и параметры инструментов хранятся в двухуровневом кэше (память + Redis) и общие
+# для webhook-сервера и бота; без MarketCache ими пользуются resolve_figi / instrument_info.
+# Цены фьючерсов в стакане и сигналах — в пунктах, исполнение брокер отдаёт в рублях:
+# point_value — стоимость пункта (min_price_increment_amount / min_price_increment), для остальных 1.
+import os
+import time
+import logging
+import asyncio
+from decimal import Decimal
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from tinkoff.invest import AsyncClient, InstrumentIdType, Quotation
+
+from utils.tiered_cache import TieredCache
+
+logger = logging.getLogger(__name__)
+
+MARKET_QUOTE_TTL_MS = int(os.getenv("MARKET_QUOTE_TTL_MS", "1000"))
+
+def _to_decimal(q) -> Decimal:
+    return Decimal(q.units) + Decimal(q.nano) / Decimal(1_000_000_000)
+
+def _encode_instrument(info: Dict[str, Any]) -> Dict[str, Any]:
+    inc = info["min_price_increment"]
+    return {**info, "min_price_increment": {"units": inc.units, "nano": inc.nano},
+            "point_value": str(info["point_value"])}
+
+def _decode_instrument(data: Dict[str, Any]) -> Dict[str, Any]:
+    inc = data["min_price_increment"]
+    return {**data, "min_price_increment": Quotation(units=inc["units"], nano=inc["nano"]),
+            "point_value": Decimal(data["point_value"])}
+
+def point_value(info: Dict[str, Any]) -> Decimal:
+    """Рублей за пункт цены инструмента"""
+    return info.get("point_value") or Decimal(1)
+
+figi_cache = TieredCache("figi")
+# v2: в записях появился point_value, старые записи без него не читаем
+instrument_cache = TieredCache("instrument:v2", encode=_encode_instrument, decode=_decode_instrument)
+
+async def _fetch_figi(token: str, symbol: str) -> Optional[str]:
+    async with AsyncClient(token) as api:
+        response = await api.instruments.find_instrument(query=symbol)
+        return response.instruments[0].figi if response.instruments else None
+
+async def _fetch_instrument(token: str, figi: str) -> Optional[Dict[str, Any]]:
+    async with AsyncClient(token) as api:
+        response = await api.instruments.get_instrument_by(
+            id_type=InstrumentIdType.INSTRUMENT_ID_TYPE_FIGI, id=figi
+        )
+        if not response or not response.instrument:
+            return None
+        value = Decimal(1)
+        if response.instrument.instrument_type == "futures":
+            margin = await api.instruments.get_futures_margin(figi=figi)
+            increment = _to_decimal(margin.min_price_increment)
+            if increment > 0:
+                value = _to_decimal(margin.min_price_increment_amount) / increment
+        return {
+            "ticker": response.instrument.ticker,
+            "lot": response.instrument.lot,
+            "currency": response.instrument.currency,
+            "min_price_increment": response.instrument.min_price_increment,
+            "point_value": value,
+        }
+
+async def resolve_figi(token: str, symbol: str) -> Optional[str]:
+    return await figi_cache.get_or_load(symbol.upper(), lambda: _fetch_figi(token, symbol))
+
+async def instrument_info(token: str, figi: str) -> Optional[Dict[str, Any]]:
+    """ticker, lot, currency, min_price_increment (Quotation), point_value (Decimal)"""
+    return await instrument_cache.get_or_load(figi, lambda: _fetch_instrument(token, figi))
+
+class MarketCache:
+    def __init__(self, token: str, quote_ttl_ms: int = MARKET_QUOTE_TTL_MS, session=None):
+        self.token = token
+        # Общая BrokerSession бота: стакан запрашивается по открытому каналу
+        self.session = session
+        self.quote_ttl = quote_ttl_ms / 1000
+        self._quotes: dict[str, tuple[float, Optional[Decimal], Optional[Decimal]]] = {}
+        self._inflight: dict[tuple, asyncio.Future] = {}
+        self.api_calls = 0
+        self.hits = 0
+
+    async def _once(self, key: tuple, factory: Callable[[], Awaitable[Any]]):
+        """Один вызов API на ключ, остальные ждут его результат"""
+        future = self._inflight.get(key)
+        if future is not None:
+            self.hits += 1
+            return await asyncio.shield(future)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await factory()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            # Исключение уже передано ожидающим — не даём ему повиснуть как "never retrieved"
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def get_figi(self, symbol: str) -> Optional[str]:
+        async def fetch():
+            self.api_calls += 1
+            return await _fetch_figi(self.token, symbol)
+
+        return await figi_cache.get_or_load(symbol.upper(), fetch)
+
+    async def get_instrument(self, figi: str) -> Optional[Dict[str, Any]]:
+        """ticker, lot, currency, min_price_increment (Quotation), point_value (Decimal)"""
+        async def fetch():
+            self.api_calls += 1
+            return await _fetch_instrument(self.token, figi)
+
+        return await instrument_cache.get_or_load(figi, fetch)
+
+    async def _quote(self, figi: str) -> tuple[Optional[Decimal], Optional[Decimal]]:
+        cached = self._quotes.get(figi)
+        if cached is not None and cached[0] > time.monotonic():
+            self.hits += 1
+            return cached[1], cached[2]
+
+        async def fetch():
+            self.api_calls += 1
+            async with (self.session.api() if self.session is not None else AsyncClient(self.token)) as api:
+                ob = await api.market_data.get_order_book(figi=figi, depth=1)
+            mid = None
+            if ob.bids and ob.asks and getattr(ob.bids[0], "price", None) and getattr(ob.asks[0], "price", None):
+                mid = (_to_decimal(ob.bids[0].price) + _to_decimal(ob.asks[0].price)) / 2
+            last = _to_decimal(ob.last_price) if getattr(ob, "last_price", None) else None
+            return mid, last
+
+        mid, last = await self._once(("quote", figi), fetch)
+        self._quotes[figi] = (time.monotonic() + self.quote_ttl, mid, last)
+        return mid, last
+
+    async def get_price(self, figi: str) -> Optional[Decimal]:
+        """Середина спреда из стакана, при пустом стакане — последняя цена"""
+        mid, last = await self._quote(figi)
+        price = mid if mid is not None else last
+        return price if price and price > 0 else None
+
+    async def get_last_price(self, figi: str) -> Optional[Decimal]:
+        mid, last = await self._quote(figi)
+        price = last if last is not None else mid
+        return price if price and price > 0 else None
+
+    def metrics(self) -> dict:
+        return {
+            "api_calls": self.api_calls,
+            "quote_hits": self.hits,
+            "figi": figi_cache.metrics(),
+            "instrument": instrument_cache.metrics(),
+        }
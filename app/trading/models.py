@@ -1,5 +1,7 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr, ValidationError, field_validator, model_validator
 from datetime import datetime
+from typing import Literal, Optional
+from uuid import UUID, uuid4
 
 class TradeSignal(BaseModel):
     figi: str
@@ -17,4 +19,83 @@ class InstrumentCache(BaseModel):
     ticker: str
     figi: str
     min_lot: int
-    updated_at: datetime    
+    updated_at: datetime
+
+class WebhookSignal(BaseModel):
+    """
+    Нормализованный сигнал вебхука.
+    Схема компилируется pydantic-core один раз при импорте, а JSON разбирается
+    и валидируется за один проход через model_validate_json (без json.loads).
+    """
+    model_config = ConfigDict(extra="ignore", frozen=True, str_strip_whitespace=True)
+
+    action: Literal["buy", "sell", "balance", "close_all"]
+    symbol: Optional[str] = Field(default=None, min_length=1, max_length=50)
+    risk_percent: Optional[float] = Field(default=None, gt=0, le=1)  # доля: 0.4 = 40%
+    quantity: Optional[int] = Field(default=None, gt=0)
+    tp_percent: Optional[float] = Field(default=None, gt=0, le=100)
+    sl_percent: Optional[float] = Field(default=None, gt=0, le=100)
+    # Цена на момент сигнала ({{close}} в TradingView) — для оценки проскальзывания
+    price: Optional[float] = Field(default=None, gt=0)
+    # Защита от повторов: unix-время или ISO-8601 ({{timenow}} в TradingView) и одноразовый nonce
+    timestamp: Optional[datetime] = None
+    nonce: Optional[str] = Field(default=None, max_length=128)
+    # Назначается при приёме, не из тела запроса: ключ строки в signals и ссылка из trades/errors
+    _id: UUID = PrivateAttr(default_factory=uuid4)
+
+    @field_validator("action", mode="before")
+    @classmethod
+    def _normalize_action(cls, v):
+        return v.strip().lower() if isinstance(v, str) else v
+
+    @field_validator("symbol")
+    @classmethod
+    def _normalize_symbol(cls, v: Optional[str]) -> Optional[str]:
+        return v.upper() if v else None
+
+    @model_validator(mode="after")
+    def _require_symbol_for_trades(self):
+        if self.action in ("buy", "sell") and not self.symbol:
+            raise ValueError("Missing symbol field")
+        return self
+
+    @property
+    def is_trade(self) -> bool:
+        return self.action in ("buy", "sell")
+
+    @property
+    def id(self) -> UUID:
+        return self._id
+
+    @classmethod
+    def parse(cls, body: bytes) -> "WebhookSignal":
+        """Разбор сырого тела запроса; при ошибке бросает ValidationError"""
+        return cls.model_validate_json(body)
+
+class WebhookBatch(BaseModel):
+    """Корзина торговых сигналов под одной подписью (POST /webhook/batch)"""
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
+    signals: list[WebhookSignal] = Field(min_length=1, max_length=20)
+    timestamp: Optional[datetime] = None
+    nonce: Optional[str] = Field(default=None, max_length=128)
+
+    @field_validator("signals")
+    @classmethod
+    def _only_trade_legs(cls, v: list[WebhookSignal]) -> list[WebhookSignal]:
+        for i, leg in enumerate(v):
+            if not leg.is_trade:
+                raise ValueError(f"signals[{i}]: only buy/sell actions are allowed in a batch")
+        return v
+
+    @classmethod
+    def parse(cls, body: bytes) -> "WebhookBatch":
+        return cls.model_validate_json(body)
+
+def format_validation_error(e: ValidationError) -> str:
+    """Короткое описание ошибок валидации для ответа клиенту"""
+    parts = []
+    for err in e.errors(include_url=False):
+        loc = ".".join(str(x) for x in err.get("loc", ())) or "payload"
+        parts.append(f"{loc}: {err.get('msg')}")
+    return "; ".join(parts)
@@ -0,0 +1,213 @@
+# app/trading/operations_sync.py
+# Инкрементальная выгрузка операций счёта в broker_operations.
+# Каждый прогон запрашивает через get_operations_by_cursor только окно [watermark - перекрытие, now],
+# страницы грузятся COPY во временную таблицу и переносятся upsert'ом; курсор страницы
+# сохраняется в broker_sync_state в той же транзакции, поэтому прерванный прогон продолжается
+# с места остановки. После загрузки сделки сопоставляются с нашими trades и signals.
+import os
+import logging
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Optional
+
+import asyncpg
+from tinkoff.invest import AsyncClient, GetOperationsByCursorRequest
+
+logger = logging.getLogger(__name__)
+
+DATABASE_URL = os.getenv("DB_URL")
+BROKER_SYNC_ENABLED = os.getenv("BROKER_SYNC_ENABLED", "1").lower() in ("1", "true", "yes", "on")
+BROKER_SYNC_INTERVAL_MINUTES = int(os.getenv("BROKER_SYNC_INTERVAL_MINUTES", "15"))
+# Перекрытие окна: операции в статусе "исполняется" за это время успевают смениться на итоговый
+BROKER_SYNC_OVERLAP_MINUTES = int(os.getenv("BROKER_SYNC_OVERLAP_MINUTES", "60"))
+# Глубина первой выгрузки, когда контрольной точки ещё нет
+BROKER_SYNC_INITIAL_DAYS = int(os.getenv("BROKER_SYNC_INITIAL_DAYS", "90"))
+# Допуск по времени между операцией брокера и записью в trades при сопоставлении (сек)
+BROKER_SYNC_MATCH_WINDOW = int(os.getenv("BROKER_SYNC_MATCH_WINDOW", "60"))
+PAGE_LIMIT = 1000
+
+OPERATION_COLUMNS = (
+    "id", "parent_operation_id", "account_id", "date", "type", "state", "figi", "instrument_uid",
+    "instrument_type", "name", "description", "quantity", "quantity_done", "price", "payment",
+    "commission", "yield", "currency",
+)
+
+_UPSERT = f"""
+INSERT INTO broker_operations ({", ".join(OPERATION_COLUMNS)})
+SELECT {", ".join(OPERATION_COLUMNS)} FROM broker_operations_stage
+ON CONFLICT (id) DO UPDATE SET
+    {", ".join(f"{c} = EXCLUDED.{c}" for c in OPERATION_COLUMNS if c != "id")},
+    synced_at = now()
+"""
+
+# Сделка брокера ↔ ближайшая по времени успешная запись в trades по тому же FIGI и стороне заявки
+_MATCH_TRADES = """
+UPDATE broker_operations o
+SET trade_id = m.trade_id, signal_id = m.signal_id
+FROM (
+    SELECT DISTINCT ON (op.id) op.id AS op_id, t.id AS trade_id, t.signal_id
+    FROM broker_operations op
+    JOIN trades t
+      ON t.figi = op.figi
+     AND t.status = 'success'
+     AND t.created_at BETWEEN (op.date AT TIME ZONE 'UTC') - make_interval(secs => $3)
+                          AND (op.date AT TIME ZONE 'UTC') + make_interval(secs => $3)
+     AND (
+          (op.type = 'OPERATION_TYPE_BUY'
+           AND ((t.action = 'open' AND t.direction = 'long') OR (t.action = 'close' AND t.direction = 'short')))
+       OR (op.type = 'OPERATION_TYPE_SELL'
+           AND ((t.action = 'open' AND t.direction = 'short') OR (t.action = 'close' AND t.direction = 'long')))
+     )
+    WHERE op.account_id = $1 AND op.date >= $2 AND op.trade_id IS NULL
+    ORDER BY op.id, abs(extract(epoch FROM t.created_at - (op.date AT TIME ZONE 'UTC')))
+) m
+WHERE o.id = m.op_id
+"""
+
+# Комиссия наследует сделку родительской операции
+_MATCH_CHILDREN = """
+UPDATE broker_operations c
+SET trade_id = p.trade_id, signal_id = p.signal_id
+FROM broker_operations p
+WHERE c.parent_operation_id = p.id
+  AND c.account_id = $1 AND c.date >= $2
+  AND c.trade_id IS NULL AND p.trade_id IS NOT NULL
+"""
+
+def _money(value) -> Optional[Decimal]:
+    if value is None:
+        return None
+    return Decimal(str(value.units)) + Decimal(str(value.nano)) / Decimal("1000000000")
+
+def _enum_name(value) -> Optional[str]:
+    return getattr(value, "name", None) or (str(value) if value is not None else None)
+
+def _utc(value: Optional[datetime]) -> Optional[datetime]:
+    if value is None:
+        return None
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+class OperationsSync:
+    def __init__(self, token: str, account_id: str, dsn: str = DATABASE_URL):
+        self.token = token
+        self.account_id = account_id
+        self.dsn = dsn
+
+    async def run(self) -> int:
+        """Один прогон синхронизации; возвращает число загруженных операций"""
+        if not self.dsn:
+            logger.warning("DATABASE_URL not configured, skipping broker operations sync")
+            return 0
+        conn = await asyncpg.connect(self.dsn)
+        try:
+            run_from, run_to, cursor = await self._begin_run(conn)
+            loaded = 0
+            pages = 0
+            async with AsyncClient(self.token) as api:
+                while True:
+                    resp = await api.operations.get_operations_by_cursor(
+                        GetOperationsByCursorRequest(
+                            account_id=self.account_id,
+                            from_=run_from,
+                            to=run_to,
+                            cursor=cursor or "",
+                            limit=PAGE_LIMIT,
+                        )
+                    )
+                    cursor = resp.next_cursor if resp.has_next else None
+                    loaded += await self._store_page(conn, resp.items, run_to, cursor)
+                    pages += 1
+                    if cursor is None:
+                        break
+
+            matched = await self._match(conn, run_from)
+            logger.info(
+                f"Broker operations synced: {loaded} operations in {pages} pages "
+                f"({run_from:%Y-%m-%d %H:%M} .. {run_to:%Y-%m-%d %H:%M} UTC), {matched} matched to trades"
+            )
+            return loaded
+        finally:
+            await conn.close()
+
+    async def _begin_run(self, conn) -> tuple[datetime, datetime, Optional[str]]:
+        row = await conn.fetchrow(
+            "SELECT watermark, run_from, run_to, cursor FROM broker_sync_state WHERE account_id = $1",
+            self.account_id,
+        )
+        if row and row["cursor"] and row["run_from"] and row["run_to"]:
+            logger.info("Resuming interrupted broker operations sync")
+            return row["run_from"], row["run_to"], row["cursor"]
+
+        now = datetime.now(timezone.utc)
+        if row and row["watermark"]:
+            run_from = row["watermark"] - timedelta(minutes=BROKER_SYNC_OVERLAP_MINUTES)
+        else:
+            run_from = now - timedelta(days=BROKER_SYNC_INITIAL_DAYS)
+        await conn.execute(
+            """
+            INSERT INTO broker_sync_state (account_id, run_from, run_to, cursor, updated_at)
+            VALUES ($1, $2, $3, NULL, now())
+            ON CONFLICT (account_id) DO UPDATE
+            SET run_from = EXCLUDED.run_from, run_to = EXCLUDED.run_to, cursor = NULL, updated_at = now()
+            """,
+            self.account_id, run_from, now,
+        )
+        return run_from, now, None
+
+    async def _store_page(self, conn, items, run_to: datetime, next_cursor: Optional[str]) -> int:
+        records = [self._record(item) for item in items]
+        async with conn.transaction():
+            if records:
+                await conn.execute(
+                    "CREATE TEMP TABLE IF NOT EXISTS broker_operations_stage "
+                    "(LIKE broker_operations INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+                )
+                await conn.copy_records_to_table(
+                    "broker_operations_stage", records=records, columns=OPERATION_COLUMNS
+                )
+                await conn.execute(_UPSERT)
+            if next_cursor is None:
+                # Прогон завершён: окно загружено целиком
+                await conn.execute(
+                    """
+                    UPDATE broker_sync_state
+                    SET watermark = $2, run_from = NULL, run_to = NULL, cursor = NULL, updated_at = now()
+                    WHERE account_id = $1
+                    """,
+                    self.account_id, run_to,
+                )
+            else:
+                await conn.execute(
+                    "UPDATE broker_sync_state SET cursor = $2, updated_at = now() WHERE account_id = $1",
+                    self.account_id, next_cursor,
+                )
+        return len(records)
+
+    def _record(self, item) -> tuple:
+        payment = getattr(item, "payment", None)
+        return (
+            item.id,
+            getattr(item, "parent_operation_id", None) or None,
+            self.account_id,
+            _utc(item.date),
+            _enum_name(item.type),
+            _enum_name(getattr(item, "state", None)),
+            getattr(item, "figi", None) or None,
+            getattr(item, "instrument_uid", None) or None,
+            getattr(item, "instrument_type", None) or None,
+            getattr(item, "name", None) or None,
+            getattr(item, "description", None) or None,
+            getattr(item, "quantity", None),
+            getattr(item, "quantity_done", None),
+            _money(getattr(item, "price", None)),
+            _money(payment),
+            _money(getattr(item, "commission", None)),
+            _money(getattr(item, "yield_", None)),
+            getattr(payment, "currency", None) or None,
+        )
+
+    async def _match(self, conn, since: datetime) -> int:
+        result = await conn.execute(_MATCH_TRADES, self.account_id, since, BROKER_SYNC_MATCH_WINDOW)
+        await conn.execute(_MATCH_CHILDREN, self.account_id, since)
+        # asyncpg возвращает статус команды вида "UPDATE 12"
+        return int(result.split()[-1]) if result else 0
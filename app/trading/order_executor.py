@@ -2,9 +2,11 @@
 
 import logging
 import asyncio
+import traceback
 from decimal import Decimal, ROUND_DOWN
 from dataclasses import dataclass
 from typing import Optional, Dict, Any
+from uuid import UUID
 from tinkoff.invest import (
     AsyncClient,
     OrderDirection,
@@ -14,9 +16,13 @@ from tinkoff.invest import (
     StopOrderExpirationType,
     StopOrderType
 )
+from .market_cache import instrument_info, point_value
 from .tinkoff_client import TinkoffClient
 from trading.settings_manager import get_settings
-from trading.db_logger import log_event
+from trading.db_logger import log_event, record_error, record_trade
+from trading.candle_store import get_candle_store
+from trading.daily_limits import get_daily_limits
+from trading.exposure_ledger import futures_margin, get_ledger
 
 logger = logging.getLogger(__name__)
 
@@ -30,12 +36,19 @@ class OrderResult:
     details: Optional[Dict[str, Any]] = None
 
 class OrderExecutor:
-    def __init__(self, token: str, account_id: str):
+    def __init__(self, token: str, account_id: str, market=None, session=None):
         self.token = token
         self.account_id = account_id
-        self.client = TinkoffClient(token, account_id)
+        self.market = market
+        # Общая BrokerSession бота; без неё каждый вызов открывает свой канал
+        self.session = session
+        self.client = TinkoffClient(token, account_id, market=market, session=session)
+        self.ledger = get_ledger(account_id)
         self._last_price_per_lot: Optional[Decimal] = None
 
+    def _api(self):
+        return self.session.api() if self.session is not None else AsyncClient(self.token)
+
     async def execute_smart_order(
         self,
         figi: str,
@@ -44,7 +57,8 @@ class OrderExecutor:
         close_only: bool = False,
         lots_override: int | None = None,
         tp_percent: float | None = None,
-        sl_percent: float | None = None
+        sl_percent: float | None = None,
+        signal_id: UUID | None = None
     ) -> OrderResult:
         ticker = "UNKNOWN"  # Инициализируем тикер для логирования
         try:
@@ -57,9 +71,15 @@ class OrderExecutor:
             ticker = instrument_info.get("ticker", figi)
             positions = await self.client.get_positions_async()
             current_position = next((p for p in positions if p.figi == figi), None)
+            # Снимок позиций уже получен — сверяем с ним журнал риска; портфель запрашивается,
+            # только если у позиций, открытых не этим процессом, ещё нет цены входа
+            signed_positions = {p.figi: p.lots if p.direction == "long" else -p.lots for p in positions}
+            unpriced = self.ledger.unpriced(signed_positions)
+            prices = await self._portfolio_prices(unpriced) if unpriced else None
+            self.ledger.sync_positions(signed_positions, prices)
 
             if close_only:
-                return await self._close_position(current_position, figi, ticker)
+                return await self._close_position(current_position, figi, ticker, signal_id)
 
             # Используем lots_override если указан
             if lots_override is not None:
@@ -82,14 +102,60 @@ class OrderExecutor:
                         message=f"Сумма позиции недостаточна для торговли {ticker}: {self._fmt_money(amount)}"
                     )
 
-            if desired_direction == "long":
-                result = await self._execute_buy_order(figi, lots_to_trade, ticker)
-            elif desired_direction == "short":
-                result = await self._execute_sell_order(figi, lots_to_trade, ticker)
-            else:
+            if desired_direction not in ("long", "short"):
                 return OrderResult(False, f"Неподдерживаемое направление: {desired_direction}")
 
+            # Предторговая проверка лимитов — из памяти, до отправки заявки
+            signed_lots = lots_to_trade if desired_direction == "long" else -lots_to_trade
+            # Лимиты номинала в рублях: цена лота из стакана — в пунктах
+            if self._last_price_per_lot:
+                price_per_lot = self._last_price_per_lot * point_value(instrument_info)
+            else:
+                price_per_lot = amount / lots_to_trade if lots_to_trade else Decimal(0)
+            settings = get_settings()
+            margin_per_lot = await futures_margin(self.token, figi, desired_direction) if settings.max_margin_used else None
+            rejection = self.ledger.check(figi, signed_lots, price_per_lot, margin_per_lot, settings)
+            reservation = None
+            if not rejection:
+                # Общие дневные счётчики: проверка и резерв одним запросом к Redis
+                reservation = await get_daily_limits().reserve(
+                    self.account_id, ticker, abs(signed_lots) * price_per_lot, settings
+                )
+                rejection = reservation.reason
+            if rejection:
+                logger.warning(f"Risk limit rejected {desired_direction.upper()} {ticker} x{lots_to_trade}: {rejection}")
+                await record_trade(
+                    figi, ticker, desired_direction, "open", lots_to_trade, "rejected",
+                    signal_id=signal_id, amount=amount, details={"reason": rejection}
+                )
+                await log_event(
+                    event_type="risk_reject",
+                    symbol=ticker,
+                    details={"direction": desired_direction, "lots": lots_to_trade, "reason": rejection,
+                             "exposure": self.ledger.snapshot()},
+                    message=f"Risk limit rejected {desired_direction.upper()} {ticker}: {rejection}"
+                )
+                return OrderResult(False, f"Отклонено риск-лимитом: {rejection}")
+
+            try:
+                if desired_direction == "long":
+                    result = await self._execute_buy_order(figi, lots_to_trade, ticker)
+                else:
+                    result = await self._execute_sell_order(figi, lots_to_trade, ticker)
+            except BaseException:
+                await reservation.release()
+                raise
+            if not result.success:
+                await reservation.release()
+
             if result.success:
+                lot_size = int(instrument_info.get("lot", 1) or 1)
+                fill_per_lot = (
+                    result.executed_price * point_value(instrument_info) * lot_size
+                    if result.executed_price else price_per_lot
+                )
+                self.ledger.apply_fill(figi, signed_lots, fill_per_lot, margin_per_lot)
+                await self.ledger.persist()
                 result.details = {
                     "ticker": ticker,
                     "direction": desired_direction,
@@ -98,6 +164,11 @@ class OrderExecutor:
                 }
                 result.message = f"{result.message} Торговано: {lots_to_trade} лот(ов)"
 
+                await record_trade(
+                    figi, ticker, desired_direction, "open", lots_to_trade, "success",
+                    signal_id=signal_id, amount=amount, price=result.executed_price,
+                    order_id=result.order_id, details=result.details
+                )
                 # Логируем успешную торговлю
                 await log_event(
                     event_type="trade",
@@ -110,6 +181,14 @@ class OrderExecutor:
                 if not close_only:
                     await self._place_multi_tp_sl_orders(figi, desired_direction, lots_to_trade, result, tp_percent, sl_percent, ticker)
             else:
+                await record_trade(
+                    figi, ticker, desired_direction, "open", lots_to_trade, "failed",
+                    signal_id=signal_id, amount=amount, details={"message": result.message}
+                )
+                await record_error(
+                    "order_executor", f"Error {desired_direction.upper()} {ticker}: {result.message}",
+                    signal_id=signal_id, symbol=ticker
+                )
                 # Логируем ошибку при торговле
                 await log_event(
                     event_type="error",
@@ -124,6 +203,10 @@ class OrderExecutor:
             logger.error(f"Error in execute_smart_order: {e}", exc_info=True)
             # Логируем критическую ошибку
             try:
+                await record_error(
+                    "order_executor", f"Critical error in execute_smart_order {ticker}: {str(e)}",
+                    traceback=traceback.format_exc(), signal_id=signal_id, symbol=ticker
+                )
                 await log_event(
                     event_type="error",
                     symbol=ticker,
@@ -145,23 +228,30 @@ class OrderExecutor:
             else:
                 sl_pct = Decimal(settings.stop_loss_percent) / Decimal(100)
 
-            async with AsyncClient(self.token) as api:
-                # Получаем информацию об инструменте
-                instrument_resp = await api.instruments.get_instrument_by(id_type=1, id=figi)
-                if not instrument_resp or not instrument_resp.instrument:
+            # Режим atr: уровни в кратных ATR из хранилища свечей (значения уже в памяти)
+            tp_levels = None
+            if settings.bracket_mode == "atr":
+                vol = get_candle_store(self.token).volatility(figi)
+                if vol is not None and vol.atr_percent > 0:
+                    if sl_percent is None:
+                        sl_pct = Decimal(str(settings.sl_atr_multiplier * vol.atr_percent)) / Decimal(100)
+                    tp_levels = [m * vol.atr_percent for m in settings.tp_atr_levels]
+                    logger.info(f"ATR brackets {ticker}: ATR {vol.atr_percent:.3f}%, SL {sl_pct * 100:.3f}%, TP {tp_levels}")
+                    result.details["atr_percent"] = round(vol.atr_percent, 4)
+                else:
+                    logger.warning(f"No candle history for {ticker}, using percent brackets")
+
+            async with self._api() as api:
+                # Получаем информацию об инструменте и текущую цену
+                instrument_info, current_price = await self._tp_sl_market_data(api, figi)
+                if not instrument_info:
                     logger.error("Не удалось получить информацию об инструменте для TP/SL")
                     return
-
-                min_price_increment = self._quotation_to_decimal(instrument_resp.instrument.min_price_increment)
-                
-                # Получаем текущую цену
-                last_prices = await api.market_data.get_last_prices(figi=[figi])
-                if not last_prices.last_prices:
+                if current_price is None:
                     logger.error("Не удалось получить текущую цену для TP/SL")
                     return
 
-                price_q = last_prices.last_prices[0].price
-                current_price = self._quotation_to_decimal(price_q)
+                min_price_increment = self._quotation_to_decimal(instrument_info["min_price_increment"])
 
                 # Определяем направление стоп-ордеров
                 if direction == "long":
@@ -216,10 +306,18 @@ class OrderExecutor:
                     tp_price_raw = current_price * (Decimal(1) + tp_pct) if direction == "long" else current_price * (Decimal(1) - tp_pct)
                     tp_price = self._round_to_increment(tp_price_raw, min_price_increment)
                     
-                    await self._place_single_tp(api, figi, lots, tp_price, stop_direction, result, "custom", ticker)
+                    tp_order_id = await self._place_single_tp(api, figi, lots, tp_price, stop_direction, result, "custom", ticker)
+                    if tp_order_id:
+                        result.details["multi_tp_orders"] = [{
+                            "level": "custom",
+                            "percent": tp_percent,
+                            "lots": lots,
+                            "price": str(tp_price),
+                            "order_id": tp_order_id
+                        }]
                 else:
                     # Используем мульти-TP из настроек
-                    tp_distribution = settings.get_tp_distribution(lots)
+                    tp_distribution = settings.get_tp_distribution(lots, tp_levels)
                     logger.info(f"Multi-TP distribution for {lots} lots: {tp_distribution}")
                     
                     placed_tps = []
@@ -253,6 +351,19 @@ class OrderExecutor:
                 message=f"Error placing TP/SL orders for {ticker}: {str(e)}"
             )
 
+    async def _tp_sl_market_data(self, api, figi: str) -> tuple[Optional[Dict[str, Any]], Optional[Decimal]]:
+        if self.market is not None:
+            # Общие для всех счетов инструмент и цена: при рассылке сигнала запрашиваются один раз
+            return await asyncio.gather(self.market.get_instrument(figi), self.market.get_last_price(figi))
+
+        info = await instrument_info(self.token, figi)
+        if not info:
+            return None, None
+        last_prices = await api.market_data.get_last_prices(figi=[figi])
+        if not last_prices.last_prices:
+            return info, None
+        return info, self._quotation_to_decimal(last_prices.last_prices[0].price)
+
     async def _place_single_tp(self, api, figi: str, lots: int, price: Decimal, direction, result: OrderResult, level_name: str, ticker: str) -> str:
         """Размещает один TP ордер"""
         try:
@@ -309,23 +420,41 @@ class OrderExecutor:
 
     async def _get_instrument_info(self, figi: str) -> Optional[Dict[str, Any]]:
         try:
-            async with AsyncClient(self.token) as client:
-                response = await client.instruments.get_instrument_by(id_type=1, id=figi)
-                if response and response.instrument:
-                    return {
-                        "ticker": response.instrument.ticker,
-                        "lot": response.instrument.lot,
-                        "currency": response.instrument.currency,
-                        "min_price_increment": response.instrument.min_price_increment
-                    }
-                return None
+            if self.market is not None:
+                return await self.market.get_instrument(figi)
+            return await instrument_info(self.token, figi)
         except Exception as e:
             logger.error(f"Error getting instrument info for {figi}: {e}")
             return None
 
+    async def _portfolio_prices(self, figis: list[str]) -> Dict[str, Decimal]:
+        """Средняя цена позиции брокера за лот в рублях (average_position_price × лот)"""
+        try:
+            async with self._api() as client:
+                portfolio = await client.operations.get_portfolio(account_id=self.account_id)
+        except Exception as e:
+            logger.warning(f"Portfolio unavailable, exposure prices not seeded: {e}")
+            return {}
+        prices = {}
+        for pos in portfolio.positions:
+            if pos.figi not in figis or getattr(pos, "average_position_price", None) is None:
+                continue
+            price = self._quotation_to_decimal(pos.average_position_price)
+            info = await self._get_instrument_info(pos.figi)
+            if price > 0 and info:
+                prices[pos.figi] = price * int(info.get("lot", 1) or 1)
+        return prices
+
     async def _calculate_lots(self, figi: str, amount: Decimal, instrument_info: Dict) -> int:
         try:
-            async with AsyncClient(self.token) as client:
+            if self.market is not None:
+                current_price = await self.market.get_price(figi)
+                if current_price is None:
+                    logger.error(f"No valid price in orderbook for {figi}")
+                    return 0
+                return self._lots_for_price(figi, amount, current_price, instrument_info)
+
+            async with self._api() as client:
                 ob = await client.market_data.get_order_book(figi=figi, depth=1)
                 current_price: Optional[Decimal] = None
 
@@ -353,19 +482,22 @@ class OrderExecutor:
                     logger.error(f"No valid price in orderbook for {figi}")
                     return 0
 
-                lot_size = int(instrument_info.get("lot", 1) or 1)
-                price_per_lot = (current_price * Decimal(lot_size)).quantize(Decimal("0.01"), rounding=ROUND_DOWN)
-                self._last_price_per_lot = price_per_lot
-
-                lots = int((amount / price_per_lot).to_integral_value(rounding=ROUND_DOWN))
-                logger.info(f"Calculated lots: {lots} (price_per_lot: {price_per_lot}, amount: {amount})")
-                return lots
+                return self._lots_for_price(figi, amount, current_price, instrument_info)
 
         except Exception as e:
             logger.error(f"Error calculating lots: {e}")
             return 0
 
-    async def _close_position(self, position, figi: str, ticker: str) -> OrderResult:
+    def _lots_for_price(self, figi: str, amount: Decimal, current_price: Decimal, instrument_info: Dict) -> int:
+        lot_size = int(instrument_info.get("lot", 1) or 1)
+        price_per_lot = (current_price * Decimal(lot_size)).quantize(Decimal("0.01"), rounding=ROUND_DOWN)
+        self._last_price_per_lot = price_per_lot
+
+        lots = int((amount / price_per_lot).to_integral_value(rounding=ROUND_DOWN))
+        logger.info(f"Calculated lots: {lots} (price_per_lot: {price_per_lot}, amount: {amount})")
+        return lots
+
+    async def _close_position(self, position, figi: str, ticker: str, signal_id: UUID | None = None) -> OrderResult:
         if not position:
             return OrderResult(True, f"Позиция по {ticker} отсутствует, закрытие не требуется")
 
@@ -377,7 +509,19 @@ class OrderExecutor:
             else:
                 result = await self._execute_buy_order(figi, position.lots, ticker, closing=True)
 
+            await record_trade(
+                figi, ticker, position.direction, "close", position.lots,
+                "success" if result.success else "failed", signal_id=signal_id,
+                price=result.executed_price, order_id=result.order_id,
+                details=None if result.success else {"message": result.message}
+            )
             if result.success:
+                signed_lots = -position.lots if position.direction == "long" else position.lots
+                entry_per_lot = self.ledger.get(figi).price_per_lot
+                # Убыток закрытия в дневной счётчик пишет OrderWatcher по потоку сделок —
+                # вместе с закрытиями по SL/TP брокера, которые не проходят через исполнитель
+                self.ledger.apply_fill(figi, signed_lots, entry_per_lot)
+                await self.ledger.persist()
                 result.message = f"Закрыта {position.direction} позиция по {ticker}: {position.lots} лот(ов)"
                 # Логируем закрытие позиции
                 await log_event(
@@ -394,39 +538,45 @@ class OrderExecutor:
 
     async def _cancel_orders_for_figi(self, figi: str):
         try:
-            async with AsyncClient(self.token) as client:
-                # Отменяем стоп-ордера
-                stop_orders = await client.stop_orders.get_stop_orders(account_id=self.account_id)
-                for stop_order in stop_orders.stop_orders:
-                    if stop_order.figi == figi:
-                        try:
-                            await client.stop_orders.cancel_stop_order(
-                                account_id=self.account_id,
-                                stop_order_id=stop_order.stop_order_id
-                            )
-                            logger.info(f"Cancelled stop order for {figi}: {stop_order.stop_order_id}")
-                        except Exception as e:
-                            logger.error(f"Error cancelling stop order {stop_order.stop_order_id}: {e}")
-
-                # Отменяем лимитные ордера
-                orders = await client.orders.get_orders(account_id=self.account_id)
-                for order in orders.orders:
-                    if order.figi == figi:
-                        try:
-                            await client.orders.cancel_order(
-                                account_id=self.account_id,
-                                order_id=order.order_id
-                            )
-                            logger.info(f"Cancelled limit order for {figi}: {order.order_id}")
-                        except Exception as e:
-                            logger.error(f"Error cancelling limit order {order.order_id}: {e}")
+            async with self._api() as client:
+                # API не фильтрует заявки по FIGI: оба списка запрашиваем параллельно,
+                # отмены по инструменту тоже отправляем одной волной
+                stop_orders, orders = await asyncio.gather(
+                    client.stop_orders.get_stop_orders(account_id=self.account_id),
+                    client.orders.get_orders(account_id=self.account_id),
+                )
+
+                async def cancel_stop(stop_order):
+                    try:
+                        await client.stop_orders.cancel_stop_order(
+                            account_id=self.account_id,
+                            stop_order_id=stop_order.stop_order_id
+                        )
+                        logger.info(f"Cancelled stop order for {figi}: {stop_order.stop_order_id}")
+                    except Exception as e:
+                        logger.error(f"Error cancelling stop order {stop_order.stop_order_id}: {e}")
+
+                async def cancel_limit(order):
+                    try:
+                        await client.orders.cancel_order(
+                            account_id=self.account_id,
+                            order_id=order.order_id
+                        )
+                        logger.info(f"Cancelled limit order for {figi}: {order.order_id}")
+                    except Exception as e:
+                        logger.error(f"Error cancelling limit order {order.order_id}: {e}")
+
+                await asyncio.gather(
+                    *(cancel_stop(so) for so in stop_orders.stop_orders if so.figi == figi),
+                    *(cancel_limit(o) for o in orders.orders if o.figi == figi),
+                )
 
         except Exception as e:
             logger.error(f"Error cancelling orders for {figi}: {e}")
 
     async def _execute_buy_order(self, figi: str, lots: int, ticker: str, closing: bool = False) -> OrderResult:
         try:
-            async with AsyncClient(self.token) as client:
+            async with self._api() as client:
                 order_response = await client.orders.post_order(
                     order_id="",
                     figi=figi,
@@ -439,6 +589,7 @@ class OrderExecutor:
                     action_text = "закрытия позиции" if closing else "покупки"
                     return OrderResult(True, f"Ордер {action_text} {ticker} успешно размещен",
                                        order_id=order_response.order_id,
+                                       executed_price=await self._fill_price(figi, order_response),
                                        executed_lots=lots)
                 return OrderResult(False, f"Не удалось разместить ордер покупки {ticker}")
 
@@ -451,7 +602,7 @@ class OrderExecutor:
 
     async def _check_margin_requirements(self, figi: str, direction: str, lots: int) -> tuple[bool, str]:
         try:
-            async with AsyncClient(self.token) as client:
+            async with self._api() as client:
                 trading_status = await client.market_data.get_trading_status(figi=figi)
 
                 if not trading_status.api_trade_available_flag:
@@ -491,7 +642,7 @@ class OrderExecutor:
                 if not margin_ok:
                     return OrderResult(False, f"Маржинальные требования: {margin_msg}")
 
-            async with AsyncClient(self.token) as client:
+            async with self._api() as client:
                 order_response = await client.orders.post_order(
                     order_id="",
                     figi=figi,
@@ -504,6 +655,7 @@ class OrderExecutor:
                     action_text = "закрытия позиции" if closing else "продажи"
                     return OrderResult(True, f"Ордер {action_text} {ticker} успешно размещен",
                                        order_id=order_response.order_id,
+                                       executed_price=await self._fill_price(figi, order_response),
                                        executed_lots=lots)
                 return OrderResult(False, f"Не удалось разместить ордер продажи {ticker}")
 
@@ -520,7 +672,7 @@ class OrderExecutor:
     async def cancel_all_orders(self) -> Dict[str, int]:
         try:
             cancelled = {"limit_orders": 0, "stop_orders": 0}
-            async with AsyncClient(self.token) as client:
+            async with self._api() as client:
                 orders_response = await client.orders.get_orders(account_id=self.account_id)
                 for order in orders_response.orders:
                     try:
@@ -549,5 +701,20 @@ class OrderExecutor:
     def _quotation_to_decimal(self, quotation) -> Decimal:
         return Decimal(str(quotation.units)) + Decimal(str(quotation.nano)) / Decimal("1000000000")
 
+    async def _fill_price(self, figi: str, order_response) -> Optional[Decimal]:
+        """
+        Средняя цена исполнения рыночной заявки в пунктах, как цена в сигнале;
+        None, если заявка ещё не исполнена или не известна стоимость пункта
+        """
+        price_q = getattr(order_response, "executed_order_price", None)
+        if price_q is None:
+            return None
+        price = self._quotation_to_decimal(price_q)
+        if price <= 0:
+            return None
+        # executed_order_price у фьючерсов в рублях
+        info = await self._get_instrument_info(figi)
+        return price / point_value(info) if info else None
+
     def _fmt_money(self, x: Decimal) -> Decimal:
         return x.quantize(Decimal("0.01"), rounding=ROUND_DOWN)
\ No newline at end of file
@@ -1,70 +1,341 @@
-# app/trading/order_watcher.py - ИСПРАВЛЕННАЯ ВЕРСИЯ
+# app/trading/order_watcher.py
+# Снятие "осиротевших" TP/SL после закрытия позиции.
+# Основной режим — поток сделок брокера (orders_stream.trades_stream): позиция по FIGI ведётся
+# в памяти по исполнениям, и как только она уходит в ноль, ордера по инструменту снимаются.
+# Пока поток недоступен, работает опрос позиций; после переподключения позиции сверяются заново.
+# Учитываются только фьючерсы — как и в сверке по positions.futures; исполнения акций и облигаций
+# из потока пропускаются. Периодическая сверка идёт своей задачей, независимо от сообщений потока.
+# Каждое сокращение позиции из потока (закрытие исполнителем, SL/TP брокера) даёт реализованный
+# результат от средней цены входа; убыток уходит в общий дневной счётчик (daily_limits).
+# Цены потока — в пунктах, результат переводится в рубли по стоимости пункта инструмента.
+# Вход позиций, открытых до запуска наблюдателя, берётся при сверке из портфеля брокера.
+import time
 import logging
 import asyncio
-from tinkoff.invest import AsyncClient
+from collections import deque
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Optional
+
+from tinkoff.invest import AsyncClient, InstrumentIdType, OrderDirection
 from .order_executor import OrderExecutor
+from .bracket_manager import BracketManager
+from .market_cache import point_value
+from trading.daily_limits import get_daily_limits
+from trading.db_logger import log_event
 
 logger = logging.getLogger(__name__)
 
+POLL_INTERVAL = 5
+# Сверка позиций с брокером при работающем потоке: страховка от расхождений учёта
+RECONCILE_INTERVAL = 60
+RECONNECT_MAX_DELAY = 60
+
+class LatencyStats:
+    """Скользящее окно задержек (мс) для метрик реакции"""
+
+    def __init__(self, size: int = 200):
+        self._values: deque = deque(maxlen=size)
+        self.count = 0
+
+    def add(self, value_ms: float):
+        self._values.append(value_ms)
+        self.count += 1
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self._values:
+            return None
+        ordered = sorted(self._values)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "last": self._values[-1] if self._values else None,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+        }
 
 class OrderWatcher:
-    def __init__(self, token: str, account_id: str, executor: OrderExecutor, tg_bot=None, chat_id=None):
+    def __init__(self, token: str, account_id: str, executor: OrderExecutor, tg_bot=None, chat_id=None,
+                 brackets: Optional[BracketManager] = None):
         self.token = token
         self.account_id = account_id
         self.executor = executor
+        self.brackets = brackets
         self.tg_bot = tg_bot
         self.chat_id = chat_id
+        self._positions: dict[str, int] = {}
+        # FIGI → фьючерс ли это; заполняется сверкой и справочником для новых FIGI из потока
+        self._is_futures: dict[str, bool] = {}
+        # Счётчик исполнений: сверка не перезаписывает позиции, изменённые потоком во время запроса
+        self._fills = 0
+        # Средняя цена входа (за единицу, в пунктах) по исполнениям из потока или из портфеля брокера
+        self._entries: dict[str, Decimal] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._stream_up = False
+        self._cleanups: set[asyncio.Task] = set()
+        # От времени исполнения на бирже и от получения события до снятия ордеров
+        self.fill_to_cleanup = LatencyStats()
+        self.event_to_cleanup = LatencyStats()
+
+    @property
+    def mode(self) -> str:
+        return "stream" if self._stream_up else "polling"
+
+    def metrics(self) -> dict:
+        return {
+            "mode": self.mode,
+            "fill_to_cleanup_ms": self.fill_to_cleanup.summary(),
+            "event_to_cleanup_ms": self.event_to_cleanup.summary(),
+        }
 
     async def watch_trades(self):
-        """
-        Отслеживает исполненные сделки через периодические проверки.
-        Fallback-версия если stream API недоступен.
-        """
-        logger.info("OrderWatcher запущен в режиме polling...")
-        
-        # Словарь для хранения последних известных позиций
-        last_positions = {}
-        
+        """Поток сделок с переподключением; пока поток лежит — опрос позиций"""
+        logger.info("OrderWatcher запущен в режиме stream")
+        delay = 1.0
+        while True:
+            started = time.monotonic()
+            try:
+                await self._run_stream()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"OrderWatcher stream error: {e}")
+            finally:
+                self._stream_up = False
+
+            # Поток продержался долго — сбой разовый, переподключаемся быстро
+            if time.monotonic() - started > RECONNECT_MAX_DELAY:
+                delay = 1.0
+            logger.warning(f"OrderWatcher: поток недоступен, опрос позиций {delay:.0f} с до переподключения")
+            await self._poll_for(delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    # ---------- поток ----------
+
+    async def _run_stream(self):
+        async with AsyncClient(self.token) as client:
+            # Сверка после (пере)подключения: позиции, закрытые пока потока не было, обрабатываются сразу
+            await self._reconcile(client)
+            if self.brackets:
+                await self.brackets.hydrate(client)
+            self._stream_up = True
+            logger.info("OrderWatcher: поток сделок подключён")
+            reconciler = asyncio.create_task(self._reconcile_loop(client))
+            try:
+                async for response in client.orders_stream.trades_stream(accounts=[self.account_id]):
+                    order_trades = getattr(response, "order_trades", None)
+                    if order_trades and order_trades.trades:
+                        received = time.monotonic()
+                        if await self._futures_figi(client, order_trades.figi):
+                            self._on_order_trades(order_trades, received)
+            finally:
+                reconciler.cancel()
+                await asyncio.gather(reconciler, return_exceptions=True)
+
+    async def _reconcile_loop(self, client):
+        # Сверка по таймеру: в тихом потоке расхождения тоже находятся
+        while True:
+            await asyncio.sleep(RECONCILE_INTERVAL)
+            try:
+                await self._reconcile(client)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"OrderWatcher reconcile error: {e}")
+
+    async def _futures_figi(self, client, figi: str) -> bool:
+        known = self._is_futures.get(figi)
+        if known is not None:
+            return known
+        try:
+            response = await client.instruments.get_instrument_by(
+                id_type=InstrumentIdType.INSTRUMENT_ID_TYPE_FIGI, id=figi
+            )
+            known = response.instrument.instrument_type == "futures"
+        except Exception as e:
+            # Тип неизвестен — исполнение учитываем, расхождение поправит сверка
+            logger.warning(f"OrderWatcher: instrument type lookup failed for {figi}: {e}")
+            return True
+        self._is_futures[figi] = known
+        return known
+
+    def _on_order_trades(self, order_trades, received: float):
+        figi = order_trades.figi
+        qty = sum(int(t.quantity) for t in order_trades.trades)
+        sign = 1 if order_trades.direction == OrderDirection.ORDER_DIRECTION_BUY else -1
+        prev = self._positions.get(figi, 0)
+        current = prev + sign * qty
+        self._positions[figi] = current
+        self._fills += 1
+        logger.info(f"Fill {figi}: {'+' if sign > 0 else '-'}{qty}, position {prev} -> {current}")
+        if qty:
+            price = sum(
+                self.executor._quotation_to_decimal(t.price) * int(t.quantity) for t in order_trades.trades
+            ) / qty
+            self._on_position_change(figi, prev, current, price, order_trades)
+            if self.brackets:
+                self.brackets.on_fill(figi, prev, current, price)
+
+        if prev != 0 and current == 0:
+            fill_time = max((t.date_time for t in order_trades.trades if t.date_time), default=None)
+            self._spawn_cleanup(figi, fill_time, received)
+
+    def _on_position_change(self, figi: str, prev: int, current: int, price: Decimal, order_trades):
+        entry = self._entries.get(figi)
+        # Сокращённая часть позиции; в ноль и при развороте закрывается весь прежний объём
+        if prev == 0:
+            closed = 0
+        elif current != 0 and (current > 0) == (prev > 0):
+            closed = max(abs(prev) - abs(current), 0)
+        else:
+            closed = abs(prev)
+        if current == 0:
+            self._entries.pop(figi, None)
+        elif prev == 0 or (current > 0) != (prev > 0):
+            self._entries[figi] = price
+        elif abs(current) > abs(prev) and entry is not None:
+            self._entries[figi] = (entry * abs(prev) + price * (abs(current) - abs(prev))) / abs(current)
+        if closed:
+            ref = f"{order_trades.order_id}:{order_trades.trades[0].trade_id}"
+            self._spawn(self._record_close(figi, "long" if prev > 0 else "short", closed, price, entry, ref))
+
+    async def _record_close(self, figi: str, direction: str, lots: int, price: Decimal,
+                            entry: Optional[Decimal], ref: str):
+        """Результат закрытия в рублях в дневной счётчик убытка; без цены входа не пишется"""
+        try:
+            if entry is None:
+                logger.warning(f"Close {figi} {lots} lots @ {price}: entry price unknown, daily loss not recorded")
+                return
+            info = await self.executor._get_instrument_info(figi)
+            if not info:
+                logger.warning(f"Close {figi} {lots} lots @ {price}: instrument unknown, daily loss not recorded")
+                return
+            lot_size = int(info["lot"] or 1)
+            pnl = (price - entry) * lot_size * lots * point_value(info)
+            if direction == "short":
+                pnl = -pnl
+            logger.info(f"Realized {figi} {direction} {lots} lots: {pnl:.2f}")
+            await get_daily_limits().record_loss(self.account_id, -pnl, ref=ref)
+        except Exception as e:
+            logger.error(f"Daily loss record for {figi} failed: {e}")
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    # ---------- опрос (fallback) ----------
+
+    async def _poll_for(self, seconds: float):
+        deadline = time.monotonic() + seconds
         while True:
             try:
                 async with AsyncClient(self.token) as client:
-                    # Получаем текущие позиции
-                    positions = await client.operations.get_positions(account_id=self.account_id)
-                    
-                    current_positions = {}
-                    for fut in positions.futures:
-                        figi = fut.figi
-                        # Определяем текущий размер позиции
-                        if hasattr(fut, 'balance'):
-                            signed_qty = int(getattr(fut, 'balance', 0) or 0)
-                        else:
-                            signed_qty = int(getattr(fut, 'quantity', 0) or 0)
-                        
-                        current_positions[figi] = signed_qty
-                    
-                    # Сравниваем с предыдущим состоянием
-                    for figi, prev_qty in last_positions.items():
-                        current_qty = current_positions.get(figi, 0)
-                        
-                        # Если позиция была открыта и теперь закрыта
-                        if prev_qty != 0 and current_qty == 0:
-                            # Отменяем все ордера по этому инструменту через executor
-                            await self.executor._cancel_orders_for_figi(figi)
-                            
-                            msg = f"ℹ️ Позиция по {figi} закрыта. Все стопы и лимиты сняты."
-                            logger.info(msg)
-                            
-                            if self.tg_bot and self.chat_id:
-                                try:
-                                    await self.tg_bot.send_message(chat_id=self.chat_id, text=msg)
-                                except Exception as e:
-                                    logger.error(f"Ошибка при отправке уведомления: {e}")
-                    
-                    # Обновляем состояние
-                    last_positions = current_positions
-                    
+                    await self._reconcile(client)
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
                 logger.error(f"Ошибка в OrderWatcher polling: {e}", exc_info=True)
-            
-            # Ждем 5 секунд до следующей проверки
-            await asyncio.sleep(5)
\ No newline at end of file
+            if time.monotonic() + POLL_INTERVAL > deadline:
+                break
+            await asyncio.sleep(POLL_INTERVAL)
+        await asyncio.sleep(max(0.0, deadline - time.monotonic()))
+
+    async def _reconcile(self, client):
+        """Снимок позиций у брокера; по инструментам, ушедшим в ноль, снимаем ордера"""
+        fills = self._fills
+        positions = await client.operations.get_positions(account_id=self.account_id)
+        if self._fills != fills:
+            # Поток изменил позиции во время запроса: снимок мог устареть, сверим в следующий раз
+            logger.debug("OrderWatcher: reconcile skipped, fills arrived during snapshot")
+            return
+        current = {}
+        for security in getattr(positions, "securities", None) or []:
+            self._is_futures.setdefault(security.figi, False)
+        for fut in positions.futures:
+            self._is_futures[fut.figi] = True
+            if hasattr(fut, 'balance'):
+                signed_qty = int(getattr(fut, 'balance', 0) or 0)
+            else:
+                signed_qty = int(getattr(fut, 'quantity', 0) or 0)
+            if signed_qty != 0:
+                current[fut.figi] = signed_qty
+
+        received = time.monotonic()
+        for figi, prev_qty in self._positions.items():
+            if prev_qty != 0 and current.get(figi, 0) == 0:
+                self._spawn_cleanup(figi, None, received)
+        if self.brackets:
+            # Изменения, замеченные сверкой (опрос без потока), идут в брекеты как исполнения без цены
+            for figi in set(self._positions) | set(current):
+                prev_qty, qty = self._positions.get(figi, 0), current.get(figi, 0)
+                if prev_qty != qty:
+                    self.brackets.on_fill(figi, prev_qty, qty)
+        self._positions = current
+        unknown = [figi for figi in current if figi not in self._entries]
+        if unknown:
+            await self._seed_entries(client, unknown)
+
+    async def _seed_entries(self, client, figis: list[str]):
+        """Цена входа позиций, открытых до запуска наблюдателя: средняя цена позиции брокера"""
+        try:
+            portfolio = await client.operations.get_portfolio(account_id=self.account_id)
+        except Exception as e:
+            logger.warning(f"OrderWatcher: portfolio unavailable, entry prices not seeded: {e}")
+            return
+        for pos in portfolio.positions:
+            if pos.figi not in figis or getattr(pos, "average_position_price", None) is None:
+                continue
+            # average_position_price у фьючерсов в рублях — переводим в пункты, как цены потока
+            price = self.executor._quotation_to_decimal(pos.average_position_price)
+            info = await self.executor._get_instrument_info(pos.figi)
+            if price > 0 and info and pos.figi in self._positions:
+                self._entries.setdefault(pos.figi, price / point_value(info))
+
+    # ---------- снятие ордеров ----------
+
+    def _spawn_cleanup(self, figi: str, fill_time: Optional[datetime], received: float):
+        # Чтение потока не ждёт отмены ордеров
+        task = asyncio.create_task(self._cleanup(figi, fill_time, received))
+        self._cleanups.add(task)
+        task.add_done_callback(self._cleanups.discard)
+
+    async def _cleanup(self, figi: str, fill_time: Optional[datetime], received: float):
+        try:
+            await self.executor._cancel_orders_for_figi(figi)
+        except Exception as e:
+            logger.error(f"Ошибка снятия ордеров по {figi}: {e}")
+            return
+
+        event_ms = (time.monotonic() - received) * 1000
+        self.event_to_cleanup.add(event_ms)
+        fill_ms = None
+        if fill_time is not None:
+            if fill_time.tzinfo is None:
+                fill_time = fill_time.replace(tzinfo=timezone.utc)
+            fill_ms = (datetime.now(timezone.utc) - fill_time).total_seconds() * 1000
+            self.fill_to_cleanup.add(fill_ms)
+
+        msg = f"ℹ️ Позиция по {figi} закрыта. Все стопы и лимиты сняты."
+        logger.info(
+            f"{msg} mode={self.mode}, event->cleanup {event_ms:.0f} ms"
+            + (f", fill->cleanup {fill_ms:.0f} ms" if fill_ms is not None else "")
+        )
+        await log_event(
+            event_type="watcher_cleanup",
+            symbol=figi,
+            details={
+                "mode": self.mode,
+                "event_to_cleanup_ms": round(event_ms, 1),
+                "fill_to_cleanup_ms": round(fill_ms, 1) if fill_ms is not None else None,
+            },
+            message=f"Orders cleaned up after position close {figi}"
+        )
+
+        if self.tg_bot and self.chat_id:
+            try:
+                await self.tg_bot.send_message(chat_id=self.chat_id, text=msg)
+            except Exception as e:
+                logger.error(f"Ошибка при отправке уведомления: {e}")
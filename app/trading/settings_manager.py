@@ -1,15 +1,26 @@
 # app/trading/settings_manager.py - РАСШИРЕННАЯ ВЕРСИЯ с мульти-TP
 from __future__ import annotations
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from pathlib import Path
+from typing import Callable, Literal
+import os
 import json
+import time
+import logging
 import threading
 
+logger = logging.getLogger(__name__)
+
 # Путь: /app/db/bot_settings.json (если рабочая директория /app)
 _SETTINGS_PATH = Path(__file__).resolve().parents[1] / "db" / "bot_settings.json"
 _LOCK = threading.RLock()
+# Как часто фоновый поток проверяет mtime файла настроек (сек)
+_WATCH_INTERVAL = float(os.getenv("SETTINGS_WATCH_INTERVAL", "1.0"))
 
 class BotSettings(BaseModel):
+    # Снимок неизменяем: изменения только через update_settings()
+    model_config = ConfigDict(frozen=True)
+
     # Проценты указываются как человек видит: 40 означает 40%
     risk_long_percent: float = Field(default=30.0, ge=0, le=100)
     risk_short_percent: float = Field(default=30.0, ge=0, le=100)
@@ -20,27 +31,50 @@ class BotSettings(BaseModel):
     take_profit_percent: float = Field(default=5.7, ge=0, le=100)  # Старое поле для совместимости
     tp_levels: list[float] = [0.5, 1.0, 1.6]  # Уровни TP в процентах
     tp_portions: list[float] = [0.33, 0.33, 0.34]  # Доли позиции для каждого TP (в сумме ~1.0)
+    sl_breakeven_after_tp: bool = False  # После исполнения TP переносить SL в безубыток
+
+    # Режим SL/TP: percent — проценты выше, atr — кратные ATR из локального хранилища свечей
+    bracket_mode: Literal["percent", "atr"] = "percent"
+    sl_atr_multiplier: float = Field(default=1.5, gt=0, le=50)
+    tp_atr_levels: list[float] = [1.0, 2.0, 3.0]  # Уровни TP в ATR, доли — tp_portions
+
+    # Лимиты открытого риска (в рублях), 0 — без лимита
+    max_symbol_notional: float = Field(default=0, ge=0)
+    max_total_notional: float = Field(default=0, ge=0)
+    max_daily_notional: float = Field(default=0, ge=0)
+    max_margin_used: float = Field(default=0, ge=0)
+    # Дневные лимиты, общие для всех процессов (счётчики в Redis): входы по инструменту и убыток
+    max_daily_trades_per_symbol: int = Field(default=0, ge=0)
+    max_daily_loss: float = Field(default=0, ge=0)
+
+    # Трейлинг-стоп: дистанция от лучшей цены и минимальный шаг переноса SL (в %)
+    trailing_stop_enabled: bool = False
+    trailing_stop_percent: float = Field(default=0.5, gt=0, le=100)
+    trailing_step_percent: float = Field(default=0.1, ge=0, le=100)
     
     # Авто-ликвидация
     auto_liquidation_enabled: bool = True
     auto_liquidation_time: str = "21:44"
     auto_liquidation_block_minutes: int = 30
     auto_liquidation_days: list[int] = [0, 1, 2, 3, 4]
+    auto_liquidation_warmup_seconds: int = Field(default=30, ge=0, le=600)  # прогрев до T-0, 0 — выключен
 
-    def get_tp_distribution(self, total_lots: int) -> list[tuple[float, int]]:
+    def get_tp_distribution(self, total_lots: int, levels: list[float] | None = None) -> list[tuple[float, int]]:
         """
         Возвращает распределение лотов по уровням TP.
+        levels — уровни в процентах вместо tp_levels (режим atr).
         Returns: [(tp_percent, lots), ...]
         """
         if not self.use_multi_tp or total_lots <= 0:
-            return [(self.take_profit_percent, total_lots)]
+            return [(levels[-1] if levels else self.take_profit_percent, total_lots)]
+        levels = levels or self.tp_levels
         
         distribution = []
         remaining_lots = total_lots
         
         # Распределяем лоты по порциям
-        for i, (tp_percent, portion) in enumerate(zip(self.tp_levels, self.tp_portions)):
-            if i == len(self.tp_levels) - 1:  # Последний уровень получает все оставшиеся лоты
+        for i, (tp_percent, portion) in enumerate(zip(levels, self.tp_portions)):
+            if i == len(levels) - 1:  # Последний уровень получает все оставшиеся лоты
                 lots = remaining_lots
             else:
                 lots = max(1, round(total_lots * portion))  # Минимум 1 лот
@@ -56,16 +90,37 @@ class BotSettings(BaseModel):
         return distribution
 
 class SettingsManager:
-    def __init__(self, path: Path):
+    """
+    Хранит неизменяемый снимок настроек в памяти.
+    Фоновый поток следит за mtime файла и атомарно подменяет снимок при изменении,
+    поэтому чтение на горячем пути — это просто обращение к атрибуту без I/O и блокировок.
+    """
+
+    def __init__(self, path: Path, watch_interval: float = _WATCH_INTERVAL):
         self.path = path
         self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.watch_interval = watch_interval
+        self._mtime_ns: int | None = None
+        self._watcher: threading.Thread | None = None
+        self._listeners: list[Callable[[BotSettings, str], None]] = []
+        # Версия снимка в общем хранилище (Redis); 0 — известен только локальный файл
+        self.version = 0
         self._settings = self._load_or_default()
 
+    def _stat_mtime(self) -> int | None:
+        try:
+            return self.path.stat().st_mtime_ns
+        except OSError:
+            return None
+
     def _load_or_default(self) -> BotSettings:
         if self.path.exists():
             try:
+                mtime = self._stat_mtime()
                 data = json.loads(self.path.read_text(encoding="utf-8"))
-                return BotSettings(**data)
+                settings = BotSettings(**data)
+                self._mtime_ns = mtime
+                return settings
             except Exception:
                 pass
         # defaults
@@ -78,19 +133,91 @@ class SettingsManager:
         data = settings.model_dump()
         tmp.write_text(json.dumps(data, indent=2, ensure_ascii=False), encoding="utf-8")
         tmp.replace(self.path)
+        self._mtime_ns = self._stat_mtime()
 
-    def get(self, reload: bool = False) -> BotSettings:
+    def _reload_if_changed(self) -> bool:
+        """Перечитывает файл, если изменился mtime. Битый файл не затирает текущий снимок"""
+        mtime = self._stat_mtime()
+        if mtime is None or mtime == self._mtime_ns:
+            return False
         with _LOCK:
-            if reload:
-                self._settings = self._load_or_default()
-            return self._settings
+            if mtime == self._mtime_ns:
+                return False
+            try:
+                data = json.loads(self.path.read_text(encoding="utf-8"))
+                settings = BotSettings(**data)
+            except Exception as e:
+                logger.warning(f"Settings file {self.path} is invalid, keeping previous snapshot: {e}")
+                self._mtime_ns = mtime
+                return False
+            self._settings = settings
+            self._mtime_ns = mtime
+        logger.info("Settings reloaded from disk")
+        self._notify(settings, "file")
+        return True
+
+    def add_listener(self, callback: Callable[[BotSettings, str], None]):
+        """
+        callback(settings, source) вызывается после каждой подмены снимка.
+        source: "update" — локальный update(), "file" — изменение файла, "remote" — из Redis.
+        Может вызываться из фонового потока — колбэк должен быть потокобезопасным.
+        """
+        self._listeners.append(callback)
+
+    def _notify(self, settings: BotSettings, source: str):
+        for callback in list(self._listeners):
+            try:
+                callback(settings, source)
+            except Exception as e:
+                logger.error(f"Settings listener error: {e}")
+
+    def _watch(self):
+        while True:
+            time.sleep(self.watch_interval)
+            try:
+                self._reload_if_changed()
+            except Exception as e:
+                logger.error(f"Settings watcher error: {e}")
+
+    def _ensure_watcher(self):
+        with _LOCK:
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch, name="settings-watcher", daemon=True)
+                self._watcher.start()
+
+    def get(self, reload: bool = False) -> BotSettings:
+        # reload=True больше не читает файл на каждый вызов: изменения подхватывает фоновый поток
+        if reload and self._watcher is None:
+            self._ensure_watcher()
+        return self._settings
+
+    def reload_now(self) -> BotSettings:
+        """Принудительная проверка файла (например, в тестах или скриптах)"""
+        self._reload_if_changed()
+        return self._settings
 
     def update(self, **kwargs) -> BotSettings:
         with _LOCK:
             updated = self._settings.model_copy(update=kwargs)
             self._persist(updated)
             self._settings = updated
-            return updated
+        self._notify(updated, "update")
+        return updated
+
+    def apply_remote(self, settings: BotSettings, version: int) -> bool:
+        """Применяет версию из общего хранилища; файл остаётся резервной копией"""
+        with _LOCK:
+            if version <= self.version:
+                return False
+            try:
+                self._persist(settings)
+            except Exception as e:
+                logger.warning(f"Failed to persist remote settings to {self.path}: {e}")
+            self._settings = settings
+            self.version = version
+        logger.info(f"Settings updated from shared store, version {version}")
+        self._notify(settings, "remote")
+        return True
 
 _manager = SettingsManager(_SETTINGS_PATH)
 
@@ -98,4 +225,8 @@ def get_settings(reload: bool = True) -> BotSettings:
     return _manager.get(reload=reload)
 
 def update_settings(**kwargs) -> BotSettings:
-    return _manager.update(**kwargs)
\ No newline at end of file
+    return _manager.update(**kwargs)
+
+def get_settings_manager() -> SettingsManager:
+    return _manager
+
@@ -0,0 +1,135 @@
+# app/trading/settings_sync.py
+# Общие настройки бота в Redis: версионированный снимок + уведомления через pub/sub.
+# Telegram-бот и webhook-сервер держат локальную копию и получают изменения за миллисекунды,
+# JSON-файл остаётся резервным хранилищем, если Redis недоступен. Ручная правка файла тоже
+# публикуется новой версией — у процессов разные тома /app/db, и иначе они разойдутся.
+import os
+import json
+import asyncio
+import logging
+from typing import Optional
+
+from trading.settings_manager import BotSettings, SettingsManager, get_settings_manager
+from utils.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+SETTINGS_SYNC_ENABLED = os.getenv("SETTINGS_REDIS_SYNC", "1").lower() in ("1", "true", "yes", "on")
+SETTINGS_KEY = "bot_settings"
+SETTINGS_CHANNEL = "bot_settings:changed"
+
+# Атомарно: новая версия + данные + уведомление подписчиков
+_PUBLISH_SCRIPT = """
+local v = redis.call('HINCRBY', KEYS[1], 'version', 1)
+redis.call('HSET', KEYS[1], 'data', ARGV[1])
+redis.call('PUBLISH', ARGV[2], v)
+return v
+"""
+
+class SettingsSync:
+    def __init__(self, manager: Optional[SettingsManager] = None):
+        self.manager = manager or get_settings_manager()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._listener_task: Optional[asyncio.Task] = None
+        self._publish_script = None
+        self._registered = False
+        # Последний снимок, совпадающий с версией в Redis: запись файла им же — не новое изменение
+        self._synced: Optional[BotSettings] = None
+
+    async def start(self):
+        if not SETTINGS_SYNC_ENABLED:
+            logger.info("Settings redis sync disabled, using JSON file only")
+            return
+        self._loop = asyncio.get_running_loop()
+        redis = get_redis()
+        self._publish_script = redis.register_script(_PUBLISH_SCRIPT)
+
+        try:
+            await self._pull()
+        except Exception as e:
+            logger.warning(f"Settings sync: redis unavailable at startup, using JSON file: {e}")
+
+        if not self._registered:
+            self.manager.add_listener(self._on_local_change)
+            self._registered = True
+        self._listener_task = asyncio.create_task(self._listen())
+        logger.info("Settings redis sync started")
+
+    async def stop(self):
+        if self._listener_task:
+            self._listener_task.cancel()
+            try:
+                await self._listener_task
+            except asyncio.CancelledError:
+                pass
+            self._listener_task = None
+
+    async def _pull(self):
+        """Подтягивает версию из Redis; если её там нет — публикует локальный файл"""
+        raw = await get_redis().hgetall(SETTINGS_KEY)
+        if not raw or "data" not in raw:
+            await self.publish(self.manager.get(reload=False))
+            return
+        version = int(raw.get("version", 0))
+        if version > self.manager.version:
+            settings = BotSettings(**json.loads(raw["data"]))
+            self._synced = settings
+            self.manager.apply_remote(settings, version)
+        elif version == self.manager.version:
+            self._synced = BotSettings(**json.loads(raw["data"]))
+
+    async def publish(self, settings: BotSettings) -> int:
+        data = json.dumps(settings.model_dump(), ensure_ascii=False)
+        version = int(await self._publish_script(keys=[SETTINGS_KEY], args=[data, SETTINGS_CHANNEL]))
+        self._synced = settings
+        # Своё же уведомление придёт позже — версия уже учтена, повторно не применяем
+        if version > self.manager.version:
+            self.manager.version = version
+        logger.info(f"Settings published to redis, version {version}")
+        return version
+
+    def _on_local_change(self, settings: BotSettings, source: str):
+        # Применённые удалённые версии не переотправляем. Изменение файла публикуем, только если
+        # снимок отличается от версии в Redis: при общем томе файл перезаписывает и apply_remote
+        # соседнего процесса, и без этой проверки процессы пересылали бы друг другу одну версию.
+        if source not in ("update", "file") or self._loop is None:
+            return
+        self._loop.call_soon_threadsafe(lambda: asyncio.ensure_future(self._publish_safe(settings, source)))
+
+    async def _publish_safe(self, settings: BotSettings, source: str = "update"):
+        if source == "file" and settings == self._synced:
+            return
+        try:
+            await self.publish(settings)
+        except Exception as e:
+            logger.warning(f"Settings sync: failed to publish update, JSON file only: {e}")
+
+    async def _listen(self):
+        delay = 1.0
+        while True:
+            pubsub = get_redis().pubsub()
+            try:
+                await pubsub.subscribe(SETTINGS_CHANNEL)
+                # После (пере)подключения могли пропустить уведомления — сверяем версию
+                await self._pull()
+                delay = 1.0
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    try:
+                        version = int(message["data"])
+                    except (TypeError, ValueError):
+                        continue
+                    if version > self.manager.version:
+                        await self._pull()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Settings sync listener error, retry in {delay:.0f}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
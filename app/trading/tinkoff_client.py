@@ -1,7 +1,6 @@
 from dataclasses import dataclass
 from tinkoff.invest import (
     AsyncClient,
-    InstrumentResponse,        
     PortfolioResponse,
     InstrumentIdType,
     MoneyValue
@@ -10,6 +9,8 @@ from decimal import Decimal
 from typing import List, Optional
 import logging
 
+from .market_cache import instrument_info, resolve_figi
+
 
 logger = logging.getLogger(__name__)
 
@@ -21,30 +22,36 @@ class Position:
     direction: str
 
 class TinkoffClient:
-    def __init__(self, token: str, account_id: str):
+    def __init__(self, token: str, account_id: str, market=None, session=None):
         self.token = token
         self.account_id = account_id
+        # Общий MarketCache (мультисчётный режим): справочные данные без запросов от каждого счёта
+        self.market = market
+        # Общая BrokerSession (бот): запросы идут по уже открытому каналу
+        self.session = session
         self.RUB_FIGI = "BBG0013HGFT4"
 
+    def _api(self):
+        return self.session.api() if self.session is not None else AsyncClient(self.token)
+
     async def _get_ticker_by_figi(self, figi: str) -> Optional[str]:
         """Получает тикер инструмента по FIGI"""
-        async with AsyncClient(self.token) as client:
-            try:
-                instrument: InstrumentResponse = await client.instruments.get_instrument_by(
-                    id_type=InstrumentIdType.INSTRUMENT_ID_TYPE_FIGI,
-                    id=figi
-                )
-                return instrument.instrument.ticker
-            except Exception as e:
-                logger.error(f"Ошибка получения тикера для FIGI {figi}: {str(e)}")
-                return None
+        try:
+            if self.market is not None:
+                info = await self.market.get_instrument(figi)
+            else:
+                info = await instrument_info(self.token, figi)
+            return info["ticker"] if info else None
+        except Exception as e:
+            logger.error(f"Ошибка получения тикера для FIGI {figi}: {str(e)}")
+            return None
 
     async def get_margin_attributes(self):
-        async with AsyncClient(self.token) as client:
+        async with self._api() as client:
             return await client.operations.get_margin_attributes(account_id=self.account_id)
 
     async def get_positions_async(self) -> List[Position]:
-        async with AsyncClient(self.token) as client:
+        async with self._api() as client:
             response = await client.operations.get_positions(account_id=self.account_id)
             positions = []
             
@@ -95,7 +102,7 @@ class TinkoffClient:
             return positions
 
     async def get_balance_async(self) -> Decimal:
-        async with AsyncClient(self.token) as client:
+        async with self._api() as client:
             try:
                 # Получаем информацию по валютам
                 positions = await client.operations.get_positions(account_id=self.account_id)
@@ -123,7 +130,7 @@ class TinkoffClient:
                 raise
 
     async def _get_instrument_by_figi(self, figi: str):
-        async with AsyncClient(self.token) as client:
+        async with self._api() as client:
             return await client.instruments.get_instrument_by(
                 id_type=InstrumentIdType.INSTRUMENT_ID_TYPE_FIGI,
                 id=figi
@@ -145,10 +152,9 @@ class TinkoffClient:
         return self._money_value_to_decimal(cash.current_price) if cash else Decimal(0)
 
     async def get_figi(self, instrument: str) -> Optional[str]:
-        async with AsyncClient(self.token) as client:
-            # Убрали некорректный параметр instrument_status
-            response = await client.instruments.find_instrument(query=instrument)
-            return response.instruments[0].figi if response.instruments else None
+        if self.market is not None:
+            return await self.market.get_figi(instrument)
+        return await resolve_figi(self.token, instrument)
 
 
     @staticmethod
@@ -159,7 +165,7 @@ class TinkoffClient:
 
     async def get_balance_async(self) -> Decimal:
         """Получение доступного RUB баланса"""
-        async with AsyncClient(self.token) as client:
+        async with self._api() as client:
             try:
                 positions = await client.operations.get_positions(account_id=self.account_id)
                 rub_balance = Decimal(0)
@@ -0,0 +1,228 @@
+# app/trading/trading_calendar.py
+# Календарь торговых сессий биржи для авто-ликвидации.
+# Расписание запрашивается у брокера раз в день и кэшируется в db/trading_calendar.json,
+# окна блокировки и моменты ликвидации на неделю вперёд считаются заранее,
+# поэтому проверка "в окне ли мы сейчас" — бинарный поиск по отсортированным интервалам.
+import os
+import json
+import bisect
+import logging
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Optional
+
+from tinkoff.invest import AsyncClient
+
+from trading.settings_manager import BotSettings
+
+logger = logging.getLogger(__name__)
+
+try:
+    from zoneinfo import ZoneInfo  # Python 3.9+
+    MSK = ZoneInfo("Europe/Moscow")
+except ImportError:
+    MSK = timezone(timedelta(hours=3))  # fallback
+
+CALENDAR_EXCHANGE = os.getenv("TRADING_CALENDAR_EXCHANGE", "FORTS")
+# За сколько минут до фактического закрытия сессии ликвидировать, если сессия сокращённая
+CLOSE_OFFSET_MINUTES = int(os.getenv("AUTO_LIQUIDATION_CLOSE_OFFSET", "5"))
+HORIZON_DAYS = 7
+# Граница торгового дня для дневных лимитов и счётчиков (МСК). На срочном рынке МосБиржи
+# вечерняя сессия после клиринга относится уже к следующему торговому дню
+TRADING_DAY_RESET = os.getenv("TRADING_DAY_RESET", "19:00")
+_CACHE_PATH = Path(__file__).resolve().parents[1] / "db" / "trading_calendar.json"
+
+@dataclass(frozen=True)
+class TradingDay:
+    day: date
+    is_trading: bool
+    start: Optional[datetime] = None  # МСК
+    end: Optional[datetime] = None    # МСК, с учётом вечерней сессии
+
+@dataclass(frozen=True)
+class _Plan:
+    starts: tuple[float, ...] = ()
+    ends: tuple[float, ...] = ()
+    liquidations: tuple[datetime, ...] = ()
+
+def _parse_hhmm(value: str) -> tuple[int, int]:
+    try:
+        hh, mm = map(int, value.split(":"))
+        return hh, mm
+    except Exception:
+        return 21, 44
+
+def _ts(value) -> Optional[datetime]:
+    """Пустые даты в ответах API приходят как 1970-01-01 — считаем их отсутствующими"""
+    if not value or value.year <= 1970:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(MSK)
+
+def trading_day(now: Optional[datetime] = None) -> date:
+    """Торговый день, к которому относится момент now (по умолчанию — сейчас)"""
+    now = (now or datetime.now(MSK)).astimezone(MSK)
+    hh, mm = _parse_hhmm(TRADING_DAY_RESET)
+    if (now.hour, now.minute) >= (hh, mm) and (hh, mm) != (0, 0):
+        return now.date() + timedelta(days=1)
+    return now.date()
+
+def trading_day_end(now: Optional[datetime] = None) -> datetime:
+    """Момент (МСК), когда начнётся следующий торговый день"""
+    hh, mm = _parse_hhmm(TRADING_DAY_RESET)
+    day = trading_day(now)
+    if (hh, mm) == (0, 0):
+        day += timedelta(days=1)
+    return datetime.combine(day, datetime.min.time(), tzinfo=MSK) + timedelta(hours=hh, minutes=mm)
+
+class TradingCalendar:
+    def __init__(self, token: str, exchange: str = CALENDAR_EXCHANGE, cache_path: Path = _CACHE_PATH):
+        self.token = token
+        self.exchange = exchange
+        self.cache_path = cache_path
+        self._days: dict[date, TradingDay] = {}
+        self._fetched: Optional[date] = None
+        self._plan = _Plan()
+
+    # ---------- расписание ----------
+
+    async def refresh(self, force: bool = False) -> bool:
+        """Обновляет расписание не чаще раза в день. Возвращает True, если данные изменились"""
+        today = datetime.now(MSK).date()
+        if not force and self._fetched == today:
+            return False
+        if not force and self._load_cache(today):
+            return True
+        try:
+            days = await self._fetch(today)
+        except Exception as e:
+            logger.warning(f"Trading schedule fetch failed for {self.exchange}, using weekday rules: {e}")
+            return False
+        self._days = days
+        self._fetched = today
+        self._save_cache()
+        logger.info(f"Trading schedule for {self.exchange} loaded: {sum(d.is_trading for d in days.values())} trading days ahead")
+        return True
+
+    async def _fetch(self, today: date) -> dict[date, TradingDay]:
+        start = datetime.combine(today - timedelta(days=1), datetime.min.time(), tzinfo=MSK)
+        end = start + timedelta(days=HORIZON_DAYS + 1)
+        async with AsyncClient(self.token) as api:
+            resp = await api.instruments.trading_schedules(
+                exchange=self.exchange,
+                from_=start.astimezone(timezone.utc),
+                to=end.astimezone(timezone.utc),
+            )
+        days: dict[date, TradingDay] = {}
+        for schedule in resp.exchanges:
+            for d in schedule.days:
+                day = _ts(d.date).date() if _ts(d.date) else None
+                if day is None:
+                    continue
+                session_end = max(filter(None, [_ts(d.end_time), _ts(getattr(d, "evening_end_time", None))]), default=None)
+                days[day] = TradingDay(
+                    day=day,
+                    is_trading=bool(d.is_trading_day),
+                    start=_ts(d.start_time),
+                    end=session_end,
+                )
+        return days
+
+    def _load_cache(self, today: date) -> bool:
+        try:
+            raw = json.loads(self.cache_path.read_text(encoding="utf-8"))
+            if raw.get("exchange") != self.exchange or raw.get("fetched") != today.isoformat():
+                return False
+            self._days = {
+                date.fromisoformat(k): TradingDay(
+                    day=date.fromisoformat(k),
+                    is_trading=v["trading"],
+                    start=datetime.fromisoformat(v["start"]) if v.get("start") else None,
+                    end=datetime.fromisoformat(v["end"]) if v.get("end") else None,
+                )
+                for k, v in raw.get("days", {}).items()
+            }
+            self._fetched = today
+            return True
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.warning(f"Trading calendar cache is invalid: {e}")
+            return False
+
+    def _save_cache(self):
+        data = {
+            "exchange": self.exchange,
+            "fetched": self._fetched.isoformat() if self._fetched else None,
+            "days": {
+                d.day.isoformat(): {
+                    "trading": d.is_trading,
+                    "start": d.start.isoformat() if d.start else None,
+                    "end": d.end.isoformat() if d.end else None,
+                }
+                for d in self._days.values()
+            },
+        }
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.cache_path.with_suffix(".json.tmp")
+            tmp.write_text(json.dumps(data, indent=2, ensure_ascii=False), encoding="utf-8")
+            tmp.replace(self.cache_path)
+        except Exception as e:
+            logger.warning(f"Failed to save trading calendar cache: {e}")
+
+    # ---------- предрасчёт ----------
+
+    def rebuild(self, settings: BotSettings, now: Optional[datetime] = None):
+        """
+        Пересчитывает моменты ликвидации и окна блокировки на HORIZON_DAYS вперёд.
+        Без расписания (нет токена, API недоступно) работает по дням недели из настроек.
+        """
+        if not settings.auto_liquidation_enabled:
+            self._plan = _Plan()
+            return
+
+        now = now or datetime.now(MSK)
+        hh, mm = _parse_hhmm(settings.auto_liquidation_time)
+        block = timedelta(minutes=int(settings.auto_liquidation_block_minutes))
+        close_offset = timedelta(minutes=CLOSE_OFFSET_MINUTES)
+
+        starts, ends, liquidations = [], [], []
+        first = now.astimezone(MSK).date() - timedelta(days=1)
+        for i in range(HORIZON_DAYS + 1):
+            day = first + timedelta(days=i)
+            if day.weekday() not in settings.auto_liquidation_days:
+                continue
+            info = self._days.get(day)
+            if info is not None and not info.is_trading:
+                continue  # праздник / выходной биржи
+            at = datetime(day.year, day.month, day.day, hh, mm, tzinfo=MSK)
+            if info is not None and info.end is not None and info.end - close_offset < at:
+                # Сокращённая сессия: ликвидируем до фактического закрытия
+                at = info.end - close_offset
+            liquidations.append(at)
+            starts.append(at.timestamp())
+            ends.append((at + block).timestamp())
+
+        self._plan = _Plan(tuple(starts), tuple(ends), tuple(liquidations))
+
+    def block_until(self, now: Optional[datetime] = None) -> Optional[datetime]:
+        """Конец текущего окна блокировки или None, если сейчас не в окне"""
+        plan = self._plan
+        ts = (now or datetime.now(timezone.utc)).timestamp()
+        i = bisect.bisect_right(plan.starts, ts) - 1
+        if i >= 0 and ts < plan.ends[i]:
+            return datetime.fromtimestamp(plan.ends[i], MSK)
+        return None
+
+    def next_liquidation(self, now: Optional[datetime] = None) -> Optional[datetime]:
+        plan = self._plan
+        now = now or datetime.now(MSK)
+        i = bisect.bisect_right(plan.liquidations, now)
+        return plan.liquidations[i] if i < len(plan.liquidations) else None
+
+    def is_trading_day(self, day: date) -> Optional[bool]:
+        info = self._days.get(day)
+        return info.is_trading if info else None
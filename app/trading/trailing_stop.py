@@ -0,0 +1,167 @@
+# app/trading/trailing_stop.py
+# Трейлинг-стоп поверх брекетов BracketManager.
+# Последние цены приходят из потока рыночных данных (подписка только на FIGI открытых позиций),
+# по каждой позиции ведётся лучшая цена с момента подписки. SL подтягивается, только когда
+# желаемый стоп ушёл от текущего не меньше чем на шаг. Правки копятся по FIGI (последняя цена
+# побеждает) и отправляются пачками через ограничитель частоты, общий для всех инструментов.
+import os
+import time
+import logging
+import asyncio
+from decimal import Decimal
+
+from tinkoff.invest import AsyncClient, LastPriceInstrument
+from .bracket_manager import BracketManager
+from trading.settings_manager import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Каждая правка — отмена и новая стоп-заявка, т.е. два запроса к сервису стоп-заявок
+TRAILING_AMENDS_PER_MINUTE = float(os.getenv("TRAILING_AMENDS_PER_MINUTE", "20"))
+TRAILING_BURST = int(os.getenv("TRAILING_BURST", "5"))
+TRAILING_FLUSH_MS = int(os.getenv("TRAILING_FLUSH_MS", "500"))
+RECONNECT_MAX_DELAY = 60
+
+class TrailingStopEngine:
+    def __init__(self, token: str, brackets: BracketManager,
+                 amends_per_minute: float = TRAILING_AMENDS_PER_MINUTE, burst: int = TRAILING_BURST):
+        self.token = token
+        self.brackets = brackets
+        self.rate = amends_per_minute / 60
+        self.burst = burst
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        self._stream = None
+        self._subscribed: set[str] = set()
+        # Лучшая цена в сторону позиции (максимум для лонга, минимум для шорта)
+        self._best: dict[str, Decimal] = {}
+        # Желаемый стоп по FIGI, ожидающий отправки
+        self._pending: dict[str, Decimal] = {}
+        self.amended = 0
+        self.deferred = 0
+
+    async def run(self):
+        flusher = asyncio.create_task(self._flush_loop())
+        delay = 1.0
+        try:
+            while True:
+                started = time.monotonic()
+                try:
+                    await self._run_stream()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Trailing stop stream error: {e}")
+                if time.monotonic() - started > RECONNECT_MAX_DELAY:
+                    delay = 1.0
+                # Без потока стоп у брокера остаётся на месте — позиция защищена последним SL
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+        finally:
+            flusher.cancel()
+
+    # ---------- цены ----------
+
+    async def _run_stream(self):
+        async with AsyncClient(self.token) as client:
+            stream = client.create_market_data_stream()
+            self._stream = stream
+            self._subscribed = set()
+            self._sync_subscriptions()
+            try:
+                async for marketdata in stream:
+                    last_price = getattr(marketdata, "last_price", None)
+                    if last_price:
+                        self._on_price(last_price.figi, self.brackets.executor._quotation_to_decimal(last_price.price))
+            finally:
+                self._stream = None
+                stream.stop()
+
+    def _sync_subscriptions(self):
+        wanted = set(self.brackets.brackets) if get_settings().trailing_stop_enabled else set()
+        added, removed = wanted - self._subscribed, self._subscribed - wanted
+        if self._stream is not None:
+            if added:
+                self._stream.last_price.subscribe([LastPriceInstrument(figi=f) for f in added])
+            if removed:
+                self._stream.last_price.unsubscribe([LastPriceInstrument(figi=f) for f in removed])
+            self._subscribed = wanted
+        for figi in removed:
+            self._best.pop(figi, None)
+            self._pending.pop(figi, None)
+
+    def _on_price(self, figi: str, price: Decimal):
+        # Горячий путь: только словари, без задач и запросов
+        settings = get_settings()
+        b = self.brackets.brackets.get(figi)
+        if not settings.trailing_stop_enabled or b is None or b.sl_price is None or price <= 0:
+            return
+
+        distance = Decimal(str(settings.trailing_stop_percent)) / Decimal(100)
+        step = price * Decimal(str(settings.trailing_step_percent)) / Decimal(100)
+        best = self._best.get(figi)
+        if b.direction == "long":
+            best = price if best is None else max(best, price)
+            desired = best * (Decimal(1) - distance)
+            move = desired - b.sl_price
+        else:
+            best = price if best is None else min(best, price)
+            desired = best * (Decimal(1) + distance)
+            move = b.sl_price - desired
+        self._best[figi] = best
+
+        if move >= step and move > 0:
+            self._pending[figi] = desired
+
+    # ---------- отправка правок ----------
+
+    def _take_tokens(self) -> int:
+        now = time.monotonic()
+        self._tokens = min(float(self.burst), self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+        return int(self._tokens)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(TRAILING_FLUSH_MS / 1000)
+            try:
+                self._sync_subscriptions()
+                await self._flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Trailing stop flush error: {e}", exc_info=True)
+
+    async def _flush(self):
+        if not self._pending:
+            return
+        available = self._take_tokens()
+        if available <= 0:
+            self.deferred += 1
+            return
+
+        batch = []
+        for figi in list(self._pending)[:available]:
+            batch.append((figi, self._pending.pop(figi)))
+        self._tokens -= len(batch)
+
+        async with AsyncClient(self.token) as client:
+            results = await asyncio.gather(
+                *(self.brackets.move_stop(client, figi, price) for figi, price in batch),
+                return_exceptions=True,
+            )
+        for (figi, price), result in zip(batch, results):
+            if isinstance(result, Exception):
+                logger.error(f"Trailing stop amend failed for {figi}: {result}")
+            elif result:
+                self.amended += 1
+        if self._pending:
+            logger.debug(f"Trailing stop: {len(self._pending)} amendments deferred by rate limit")
+
+    def metrics(self) -> dict:
+        return {
+            "subscribed": len(self._subscribed),
+            "pending": len(self._pending),
+            "amended": self.amended,
+            "deferred_flushes": self.deferred,
+        }
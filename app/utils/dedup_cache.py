@@ -0,0 +1,167 @@
+# app/utils/dedup_cache.py
+# Защита от повторов вебхука: TradingView переотправляет алерт по таймауту,
+# и без неё один и тот же сигнал исполняется дважды.
+# Длинное окно (WEBHOOK_DEDUP_TTL) — только для сигналов с timestamp или nonce: у них повтор
+# тела означает именно ретрай. Тело без них может законно повториться (разворот обратно
+# в ту же сторону), поэтому такие сигналы склеиваются лишь в коротком окне ретраев.
+import os
+import json
+import time
+import hashlib
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Optional
+
+from utils.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+DEDUP_TTL_SECONDS = int(os.getenv("WEBHOOK_DEDUP_TTL", "600"))
+DEDUP_ANONYMOUS_TTL_SECONDS = int(os.getenv("WEBHOOK_DEDUP_ANONYMOUS_TTL", "5"))
+DEDUP_MAX_ENTRIES = int(os.getenv("WEBHOOK_DEDUP_MAX_ENTRIES", "1024"))
+MAX_SIGNAL_AGE_SECONDS = int(os.getenv("WEBHOOK_MAX_SIGNAL_AGE", "120"))
+MAX_CLOCK_SKEW_SECONDS = int(os.getenv("WEBHOOK_MAX_CLOCK_SKEW", "30"))
+PENDING_WAIT_SECONDS = float(os.getenv("WEBHOOK_DEDUP_PENDING_WAIT", "30"))
+
+_PENDING = "__pending__"
+
+class SignalDeduplicator:
+    """
+    Двухуровневый кэш обработанных сигналов:
+    L1 — ограниченный кэш в памяти процесса (ловит ретраи в пределах воркера),
+    L2 — Redis (SET NX), общий для всех воркеров и контейнеров.
+    Ключ — sha256 тела запроса: HMAC-подпись детерминирована телом,
+    поэтому повтор с той же подписью даёт тот же ключ.
+    """
+
+    def __init__(
+        self,
+        ttl: int = DEDUP_TTL_SECONDS,
+        max_entries: int = DEDUP_MAX_ENTRIES,
+        max_age: int = MAX_SIGNAL_AGE_SECONDS,
+        prefix: str = "webhook:dedup:",
+        anonymous_ttl: int = DEDUP_ANONYMOUS_TTL_SECONDS,
+    ):
+        # TTL не может быть меньше допустимого возраста сигнала,
+        # иначе повтор со свежей меткой времени пройдёт после вытеснения ключа
+        self.ttl = max(ttl, max_age)
+        self.anonymous_ttl = min(anonymous_ttl, self.ttl)
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.prefix = prefix
+        self._entries: OrderedDict[str, tuple[float, asyncio.Future]] = OrderedDict()
+
+    @staticmethod
+    def make_key(body: bytes) -> str:
+        return hashlib.sha256(body).hexdigest()
+
+    def ttl_for(self, timestamp: Optional[datetime], nonce: Optional[str]) -> int:
+        """Окно подавления повторов: длинное, только если тело сигнала уникально по timestamp/nonce"""
+        return self.ttl if timestamp is not None or nonce else self.anonymous_ttl
+
+    def check_freshness(self, timestamp: Optional[datetime]) -> Optional[str]:
+        """Возвращает текст ошибки, если метка времени сигнала устарела или из будущего"""
+        if timestamp is None:
+            return None
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        age = (datetime.now(timezone.utc) - timestamp).total_seconds()
+        if age > self.max_age:
+            return f"Stale signal: age {age:.0f}s exceeds {self.max_age}s"
+        if age < -MAX_CLOCK_SKEW_SECONDS:
+            return f"Signal timestamp is {-age:.0f}s in the future"
+        return None
+
+    def _purge(self, now: float):
+        # Вытесняем с начала (порядок вставки); истёкшие записи с коротким TTL за более
+        # долгими отбрасываются при поиске в run_once
+        while self._entries:
+            key, (expires, fut) = next(iter(self._entries.items()))
+            if expires > now and len(self._entries) <= self.max_entries:
+                break
+            if not fut.done():
+                break  # выполняющиеся задачи не вытесняем
+            self._entries.pop(key)
+
+    async def run_once(self, key: str, job: Callable[[], Awaitable[dict]],
+                       ttl: Optional[int] = None) -> tuple[dict, bool]:
+        """
+        Выполняет job не более одного раза на ключ в пределах TTL (по умолчанию — длинного, см. ttl_for).
+        Returns: (результат, это_дубликат)
+        """
+        ttl = self.ttl if ttl is None else ttl
+        now = time.monotonic()
+        self._purge(now)
+
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] <= now and entry[1].done():
+            self._entries.pop(key)
+            entry = None
+        if entry is not None:
+            return await asyncio.shield(entry[1]), True
+
+        fut: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._entries[key] = (now + ttl, fut)
+
+        try:
+            stored = await self._claim_shared(key, ttl)
+        except Exception as e:
+            logger.warning(f"Dedup L2 unavailable, falling back to memory only: {e}")
+            stored = None
+
+        if stored is not None:
+            fut.set_result(stored)
+            if stored.get("pending"):
+                # Результат ещё не готов — не запоминаем заглушку локально
+                self._entries.pop(key, None)
+            return stored, True
+
+        try:
+            result = await job()
+        except BaseException as e:
+            # Сбой обработки: освобождаем ключ, чтобы ретрай смог выполниться
+            self._entries.pop(key, None)
+            await self._release_shared(key)
+            fut.set_exception(e)
+            fut.exception()  # помечаем исключение как полученное
+            raise
+
+        fut.set_result(result)
+        await self._store_shared(key, result, ttl)
+        return result, False
+
+    async def _claim_shared(self, key: str, ttl: int) -> Optional[dict]:
+        """SET NX в Redis. None — ключ наш; иначе результат оригинальной обработки"""
+        redis = get_redis()
+        rkey = self.prefix + key
+        if await redis.set(rkey, _PENDING, nx=True, ex=ttl):
+            return None
+
+        # Другой воркер уже обрабатывает этот сигнал — ждём его результат
+        deadline = time.monotonic() + PENDING_WAIT_SECONDS
+        while True:
+            raw = await redis.get(rkey)
+            if raw is None:
+                # Оригинальная обработка упала и освободила ключ — пробуем снова
+                if await redis.set(rkey, _PENDING, nx=True, ex=ttl):
+                    return None
+                continue
+            if raw != _PENDING:
+                return json.loads(raw)
+            if time.monotonic() >= deadline:
+                return {"success": False, "pending": True, "error": "Duplicate signal is still being processed"}
+            await asyncio.sleep(0.2)
+
+    async def _store_shared(self, key: str, result: dict, ttl: int):
+        try:
+            await get_redis().set(self.prefix + key, json.dumps(result, default=str), ex=ttl)
+        except Exception as e:
+            logger.warning(f"Failed to store dedup result in redis: {e}")
+
+    async def _release_shared(self, key: str):
+        try:
+            await get_redis().delete(self.prefix + key)
+        except Exception as e:
+            logger.warning(f"Failed to release dedup key in redis: {e}")
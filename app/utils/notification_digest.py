@@ -0,0 +1,86 @@
+# app/utils/notification_digest.py
+# Одно сообщение на сигнал вместо нескольких: события (получен, закрыта позиция,
+# исполнено, SL/TP) копятся и уходят одной сводкой по завершении обработки
+# или по таймауту, если обработка затянулась.
+import os
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+DIGEST_ENABLED = os.getenv("NOTIFY_DIGEST", "1").lower() in ("1", "true", "yes", "on")
+DIGEST_MAX_WAIT = float(os.getenv("NOTIFY_DIGEST_MAX_WAIT", "10"))
+
+class SignalDigest:
+    def __init__(self, title: str, send: Callable[[str], Awaitable[None]], max_wait: float = DIGEST_MAX_WAIT):
+        self.title = title
+        self._send = send
+        self.max_wait = max_wait
+        self._started = time.monotonic()
+        self._events: list[tuple[float, str]] = []
+        self._sent_upto = 0
+        self._timer: Optional[asyncio.Task] = None
+        self._finished = False
+
+    def start(self) -> "SignalDigest":
+        """Запускает таймер: если обработка не уложится в max_wait, уйдёт промежуточная сводка"""
+        if self.max_wait > 0 and self._timer is None:
+            self._timer = asyncio.create_task(self._flush_on_timeout())
+        return self
+
+    def add(self, text: str):
+        self._events.append((time.monotonic() - self._started, text))
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self._started
+
+    async def finish(self, success: bool, summary: str = ""):
+        if self._finished:
+            return
+        self._finished = True
+        if self._timer is not None:
+            self._timer.cancel()
+        icon = "✅" if success else "❌"
+        status = "выполнен" if success else "ошибка"
+        header = f"{icon} {self.title} — {status} за {self.elapsed:.2f} с"
+        if summary:
+            header += f"\n{summary}"
+        await self._flush(header)
+
+    async def _flush_on_timeout(self):
+        try:
+            await asyncio.sleep(self.max_wait)
+            if not self._finished:
+                await self._flush(f"⏳ {self.title} — обработка идёт {self.elapsed:.0f} с")
+        except asyncio.CancelledError:
+            pass
+
+    async def _flush(self, header: str):
+        events = self._events[self._sent_upto:]
+        self._sent_upto = len(self._events)
+        lines = [header] + [f"• +{t:.2f} с {text}" for t, text in events]
+        try:
+            await self._send("\n".join(lines))
+        except Exception as e:
+            logger.error(f"Failed to send signal digest: {e}")
+
+def describe_fill(result) -> list[str]:
+    """Строки сводки по результату OrderExecutor: исполнение, SL и уровни TP"""
+    details = result.details or {}
+    lines = []
+    lots = details.get("lots_traded") or result.executed_lots
+    fill = f"исполнено: {lots} лот(ов)"
+    if result.executed_price:
+        fill += f" по {result.executed_price}"
+    if result.order_id:
+        fill += f", ордер {result.order_id}"
+    lines.append(fill)
+    if details.get("stop_loss_price"):
+        lines.append(f"SL {details['stop_loss_price']}")
+    tps = details.get("multi_tp_orders") or []
+    if tps:
+        lines.append("TP: " + ", ".join(f"{tp['price']} ({tp['lots']} лот.)" for tp in tps))
+    return lines
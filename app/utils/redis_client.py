@@ -0,0 +1,33 @@
+# app/utils/redis_client.py
+import os
+import logging
+from typing import Optional
+
+import redis.asyncio as aioredis
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+
+_client: Optional[aioredis.Redis] = None
+
+def get_redis() -> aioredis.Redis:
+    """Общий асинхронный клиент Redis (пул соединений создаётся лениво)"""
+    global _client
+    if _client is None:
+        _client = aioredis.from_url(
+            REDIS_URL,
+            decode_responses=True,
+            socket_connect_timeout=1.0,
+            socket_timeout=1.0,
+        )
+    return _client
+
+async def close_redis():
+    global _client
+    if _client is not None:
+        try:
+            await _client.aclose()
+        except Exception as e:
+            logger.warning(f"Error closing redis client: {e}")
+        _client = None
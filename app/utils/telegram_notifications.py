@@ -1,12 +1,28 @@
 # Исправление для app/utils/telegram_notifications.py
 
+import os
+import re
+import html
+import time
+import asyncio
 import logging
+from datetime import timedelta
+from typing import Optional
+
 from telegram import Bot
-import html
-import re
+from telegram.error import NetworkError, RetryAfter, TimedOut
 
 logger = logging.getLogger(__name__)
 
+# Лимиты Telegram: ~1 сообщение/сек в один чат, ~30 сообщений/сек на бота
+PER_CHAT_INTERVAL = float(os.getenv("TG_PER_CHAT_INTERVAL", "1.0"))
+GLOBAL_INTERVAL = 1.0 / float(os.getenv("TG_GLOBAL_RATE", "25"))
+# Сообщения в один чат, пришедшие в пределах окна, склеиваются в одно
+COALESCE_WINDOW = float(os.getenv("TG_COALESCE_WINDOW", "0.5"))
+OUTBOX_MAX_QUEUE = int(os.getenv("TG_OUTBOX_MAX_QUEUE", "1000"))
+MAX_MESSAGE_LEN = 4096
+SEND_ATTEMPTS = 5
+
 async def send_telegram_message(bot_token: str, chat_id: str, message: str):
     """
     Отправляет сообщение в Telegram с безопасным экранированием HTML
@@ -56,4 +72,155 @@ def strip_html_tags(text: str) -> str:
     clean = re.sub('<[^<]+?>', '', text)
     # Убираем лишние пробелы и переносы
     clean = re.sub(r'\s+', ' ', clean).strip()
-    return clean
\ No newline at end of file
+    return clean
+
+
+class TelegramOutbox:
+    """
+    Фоновая очередь уведомлений с одним долгоживущим Bot (и HTTP-сессией).
+    send() не ждёт сети и не блокирует торговый код: сообщение кладётся в ограниченную очередь,
+    фоновая задача соблюдает лимиты Telegram на чат и на бота, склеивает близкие по времени
+    сообщения в одно и повторяет отправку после flood-wait (RetryAfter).
+    """
+
+    def __init__(self, bot_token: str):
+        self.bot_token = bot_token
+        self._bot: Optional[Bot] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._pending: dict[str, list[str]] = {}
+        self._first_at: dict[str, float] = {}
+        self._next_chat_at: dict[str, float] = {}
+        self._next_global_at = 0.0
+        self._closing = False
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if self.is_running:
+            return
+        self._bot = Bot(token=self.bot_token)
+        await self._bot.initialize()
+        self._queue = asyncio.Queue(maxsize=OUTBOX_MAX_QUEUE)
+        self._closing = False
+        self._task = asyncio.create_task(self._run())
+        logger.info("Telegram outbox started")
+
+    def send(self, chat_id: str, message: str) -> bool:
+        """Ставит сообщение в очередь. Никогда не ждёт; при переполнении вытесняет самое старое"""
+        if self._queue is None or self._closing:
+            logger.warning("Telegram outbox is not running, message dropped")
+            return False
+        item = (str(chat_id), message)
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            try:
+                self._queue.get_nowait()
+                logger.warning("Telegram outbox is full, dropping oldest message")
+            except asyncio.QueueEmpty:
+                pass
+            self._queue.put_nowait(item)
+        return True
+
+    async def stop(self, timeout: float = 5.0):
+        """Досылает накопленное (не дольше timeout) и закрывает сессию бота"""
+        if self._task is None:
+            return
+        self._closing = True
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+            logger.warning("Telegram outbox stopped with undelivered messages")
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        try:
+            await self._bot.shutdown()
+        except Exception as e:
+            logger.warning(f"Error shutting down telegram bot session: {e}")
+
+    def _due_at(self, chat_id: str) -> float:
+        window = 0.0 if self._closing else COALESCE_WINDOW
+        return max(self._first_at[chat_id] + window, self._next_chat_at.get(chat_id, 0.0), self._next_global_at)
+
+    async def _run(self):
+        while True:
+            if self._closing and not self._pending and self._queue.empty():
+                return
+
+            now = time.monotonic()
+            timeout = None
+            if self._pending:
+                timeout = max(0.0, min(self._due_at(c) for c in self._pending) - now)
+            elif self._closing:
+                timeout = 0.0
+            else:
+                timeout = 0.5  # периодически проверяем флаг остановки
+
+            try:
+                chat_id, message = await asyncio.wait_for(self._queue.get(), timeout)
+                if chat_id not in self._pending:
+                    self._pending[chat_id] = []
+                    self._first_at[chat_id] = time.monotonic()
+                self._pending[chat_id].append(message)
+                continue
+            except asyncio.TimeoutError:
+                pass
+
+            now = time.monotonic()
+            for chat_id in [c for c in self._pending if self._due_at(c) <= now]:
+                messages = self._pending.pop(chat_id)
+                self._first_at.pop(chat_id, None)
+                for chunk in self._merge(messages):
+                    await self._deliver(chat_id, chunk)
+
+    @staticmethod
+    def _merge(messages: list[str]) -> list[str]:
+        """Склеивает сообщения, не превышая лимит длины Telegram"""
+        chunks, current = [], ""
+        for m in messages:
+            m = m[:MAX_MESSAGE_LEN]
+            candidate = f"{current}\n\n{m}" if current else m
+            if len(escape_telegram_html(candidate)) > MAX_MESSAGE_LEN and current:
+                chunks.append(current)
+                current = m
+            else:
+                current = candidate
+        if current:
+            chunks.append(current)
+        return chunks
+
+    async def _deliver(self, chat_id: str, message: str):
+        for attempt in range(1, SEND_ATTEMPTS + 1):
+            wait = max(self._next_global_at, self._next_chat_at.get(chat_id, 0.0)) - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            now = time.monotonic()
+            self._next_global_at = now + GLOBAL_INTERVAL
+            self._next_chat_at[chat_id] = now + PER_CHAT_INTERVAL
+            try:
+                try:
+                    await self._bot.send_message(chat_id=chat_id, text=escape_telegram_html(message), parse_mode="HTML")
+                except (RetryAfter, NetworkError):
+                    raise
+                except Exception as e:
+                    logger.warning(f"HTML send failed, falling back to plain text: {e}")
+                    await self._bot.send_message(chat_id=chat_id, text=strip_html_tags(message))
+                return
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                delay = retry_after.total_seconds() if isinstance(retry_after, timedelta) else float(retry_after)
+                logger.warning(f"Telegram flood wait {delay:.0f}s for chat {chat_id} (attempt {attempt})")
+                self._next_chat_at[chat_id] = time.monotonic() + delay
+            except (TimedOut, NetworkError) as e:
+                delay = min(2 ** attempt, 30)
+                logger.warning(f"Telegram network error, retry in {delay}s: {e}")
+                self._next_chat_at[chat_id] = time.monotonic() + delay
+            except Exception as e:
+                logger.error(f"Failed to send telegram message: {e}")
+                return
+        logger.error(f"Telegram message to {chat_id} dropped after {SEND_ATTEMPTS} attempts")
@@ -0,0 +1,177 @@
+# app/utils/tiered_cache.py
+# Двухуровневый кэш справочных данных (FIGI, параметры инструментов), общих для всех процессов.
+# L1 — LRU с TTL в памяти процесса: попадание без сетевых вызовов.
+# L2 — асинхронный Redis: данные, уже полученные другим воркером или ботом, не запрашиваются у API.
+# Отсутствующие значения тоже кэшируются (на NEGATIVE_TTL), запись значения с TTL — одним пайплайном.
+# При недоступном Redis кэш работает только на L1 и загрузчике.
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+from utils.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+CACHE_L1_MAX_ENTRIES = int(os.getenv("CACHE_L1_MAX_ENTRIES", "4096"))
+CACHE_L1_TTL = float(os.getenv("CACHE_L1_TTL", "3600"))
+CACHE_L2_TTL = int(os.getenv("CACHE_L2_TTL", "86400"))
+CACHE_NEGATIVE_TTL = int(os.getenv("CACHE_NEGATIVE_TTL", "300"))
+# Повторное предупреждение о недоступном Redis — не чаще раза в этот интервал (сек)
+_L2_WARN_INTERVAL = 60.0
+
+_NONE = "__none__"
+
+class TieredCache:
+    def __init__(
+        self,
+        namespace: str,
+        l1_ttl: float = CACHE_L1_TTL,
+        l2_ttl: int = CACHE_L2_TTL,
+        negative_ttl: int = CACHE_NEGATIVE_TTL,
+        max_entries: int = CACHE_L1_MAX_ENTRIES,
+        encode: Callable[[Any], Any] = lambda v: v,
+        decode: Callable[[Any], Any] = lambda v: v,
+    ):
+        self.prefix = f"cache:{namespace}:"
+        self.l1_ttl = l1_ttl
+        self.l2_ttl = l2_ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        # Значение → JSON-совместимый вид и обратно (например, Quotation → dict)
+        self._encode = encode
+        self._decode = decode
+        self._l1: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._warned_at = 0.0
+        self.stats = {
+            "l1_hits": 0, "l1_misses": 0,
+            "l2_hits": 0, "l2_misses": 0, "l2_errors": 0,
+            "negative_hits": 0, "coalesced": 0, "loads": 0, "load_errors": 0,
+        }
+
+    # ---------- L1 ----------
+
+    def _l1_get(self, key: str) -> tuple[bool, Any]:
+        entry = self._l1.get(key)
+        if entry is None:
+            return False, None
+        if entry[0] <= time.monotonic():
+            del self._l1[key]
+            return False, None
+        self._l1.move_to_end(key)
+        return True, entry[1]
+
+    def _l1_put(self, key: str, value: Any):
+        ttl = self.l1_ttl if value is not None else min(self.l1_ttl, self.negative_ttl)
+        self._l1[key] = (time.monotonic() + ttl, value)
+        self._l1.move_to_end(key)
+        while len(self._l1) > self.max_entries:
+            self._l1.popitem(last=False)
+
+    # ---------- L2 ----------
+
+    def _l2_failed(self, e: Exception):
+        self.stats["l2_errors"] += 1
+        now = time.monotonic()
+        if now - self._warned_at >= _L2_WARN_INTERVAL:
+            self._warned_at = now
+            logger.warning(f"Cache {self.prefix} L2 unavailable, using memory only: {e}")
+
+    async def _l2_get_many(self, keys: list[str]) -> dict[str, Any]:
+        """Найденные в Redis значения (None — закэшированное отсутствие)"""
+        try:
+            raws = await get_redis().mget([self.prefix + k for k in keys])
+        except Exception as e:
+            self._l2_failed(e)
+            return {}
+        found = {}
+        for key, raw in zip(keys, raws):
+            if raw is None:
+                continue
+            found[key] = None if raw == _NONE else self._decode(json.loads(raw))
+        return found
+
+    async def _l2_put_many(self, items: dict[str, Any]):
+        if not items:
+            return
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            for key, value in items.items():
+                if value is None:
+                    pipe.set(self.prefix + key, _NONE, ex=self.negative_ttl)
+                else:
+                    pipe.set(self.prefix + key, json.dumps(self._encode(value), default=str), ex=self.l2_ttl)
+            await pipe.execute()
+        except Exception as e:
+            self._l2_failed(e)
+
+    # ---------- API ----------
+
+    async def get_or_load(self, key: str, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Значение из L1, затем L2, иначе из loader (один вызов на ключ для одновременных запросов)"""
+        hit, value = self._l1_get(key)
+        if hit:
+            self.stats["l1_hits"] += 1
+            if value is None:
+                self.stats["negative_hits"] += 1
+            return value
+        self.stats["l1_misses"] += 1
+
+        future = self._inflight.get(key)
+        if future is not None:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(future)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await self._fill(key, loader)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # исключение получат ожидающие, не оставляем его "never retrieved"
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _fill(self, key: str, loader: Callable[[], Awaitable[Any]]) -> Any:
+        found = await self._l2_get_many([key])
+        if key in found:
+            self.stats["l2_hits"] += 1
+            value = found[key]
+            if value is None:
+                self.stats["negative_hits"] += 1
+            self._l1_put(key, value)
+            return value
+        self.stats["l2_misses"] += 1
+
+        self.stats["loads"] += 1
+        try:
+            value = await loader()
+        except Exception:
+            self.stats["load_errors"] += 1
+            raise
+        self._l1_put(key, value)
+        await self._l2_put_many({key: value})
+        return value
+
+    async def invalidate(self, key: str):
+        self._l1.pop(key, None)
+        try:
+            await get_redis().delete(self.prefix + key)
+        except Exception as e:
+            self._l2_failed(e)
+
+    def metrics(self) -> dict:
+        lookups = self.stats["l1_hits"] + self.stats["l1_misses"]
+        # Ожидавшие чужую загрузку того же ключа тоже обслужены без своего вызова API
+        served = self.stats["l1_hits"] + self.stats["l2_hits"] + self.stats["coalesced"]
+        return {
+            **self.stats,
+            "l1_size": len(self._l1),
+            "hit_ratio": round(served / lookups, 3) if lookups else None,
+        }
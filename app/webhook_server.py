@@ -1,23 +1,41 @@
 # app/webhook_server.py - ИСПРАВЛЕННАЯ ВЕРСИЯ с логированием
 import os
-import json
 import hmac
 import hashlib
 import logging
 import asyncio
-from datetime import datetime, time, timedelta, timezone
+import time
+import traceback
+from datetime import datetime, timedelta, timezone
 from decimal import Decimal, ROUND_DOWN
 from typing import Optional
+from uuid import UUID
 
 from aiohttp import web, web_request
+from pydantic import ValidationError
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.date import DateTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 
 from trading.tinkoff_client import TinkoffClient
 from trading.order_executor import OrderExecutor
-from trading.settings_manager import get_settings
-from trading.db_logger import log_event  # ДОБАВЛЕНО
-from utils.telegram_notifications import send_telegram_message
+from trading.accounts import TradingAccount, load_accounts
+from trading.market_cache import MarketCache
+from trading.candle_store import get_candle_store
+from trading.settings_manager import get_settings, get_settings_manager
+from trading.trading_calendar import TradingCalendar
+from trading.liquidation import LiquidationRunner
+from trading.settings_sync import SettingsSync
+from trading.models import WebhookSignal, WebhookBatch, format_validation_error
+from trading.db_logger import log_event, record_error, record_signal, start_event_logger, stop_event_logger  # ДОБАВЛЕНО
+from trading.db_maintenance import maintain_event_logs, run_migrations
+from trading.analytics import get_report_engine
+from trading.operations_sync import BROKER_SYNC_ENABLED, BROKER_SYNC_INTERVAL_MINUTES, OperationsSync
+from utils.telegram_notifications import TelegramOutbox, send_telegram_message
+from utils.dedup_cache import SignalDeduplicator
+from utils.notification_digest import DIGEST_ENABLED, SignalDigest, describe_fill
+from utils.redis_client import close_redis
 
 # Настройка временной зоны МСК
 try:
@@ -38,6 +56,17 @@ webhook_secret = os.getenv("WEBHOOK_SECRET", "")
 
 # ИСПРАВЛЕНИЕ: планировщик инициализируется позже, когда event loop работает
 scheduler = None
+candle_task: asyncio.Task | None = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+# Календарь торговых сессий: окна блокировки и время ликвидации считаются заранее
+trading_calendar = TradingCalendar(tinkoff_token)
+trading_calendar.rebuild(get_settings())
+
+# Счета исполнения сигналов; справочные и рыночные данные общие для всех
+market_cache = MarketCache(tinkoff_token)
+accounts: list[TradingAccount] = load_accounts(market_cache)
+liquidation_runners = {a.name: LiquidationRunner(a.token, a.account_id) for a in accounts}
 
 try:
     leverage = Decimal(os.getenv("LEVERAGE", "1"))
@@ -46,6 +75,10 @@ try:
 except Exception:
     leverage = Decimal("1")
 
+deduplicator = SignalDeduplicator()
+notification_outbox = TelegramOutbox(bot_token) if bot_token else None
+settings_sync = SettingsSync()
+
 class WebhookError(Exception):
     pass
 
@@ -58,11 +91,15 @@ def verify_signature(payload: bytes, signature: str) -> bool:
     return hmac.compare_digest(expected_signature, signature)
 
 async def send_notification(message: str):
+    """Кладёт уведомление в фоновую очередь и сразу возвращает управление торговому коду"""
     if not bot_token or not chat_id:
         logger.warning("Telegram credentials not configured")
         return
     try:
-        await send_telegram_message(bot_token, chat_id, message)
+        if notification_outbox is not None and notification_outbox.is_running:
+            notification_outbox.send(chat_id, message)
+        else:
+            await send_telegram_message(bot_token, chat_id, message)
     except Exception as e:
         logger.error(f"Ошибка отправки уведомления: {e}")
 
@@ -73,28 +110,21 @@ def _fmt_money(x: Decimal) -> str:
     return f"{x.quantize(Decimal('0.01'), rounding=ROUND_DOWN)} RUB"
 
 def _is_block_window_now() -> tuple[bool, str]:
-    """Проверяет, находимся ли мы в окне блокировки авто-ликвидации"""
-    s = get_settings()
-    if not s.auto_liquidation_enabled:
-        return False, ""
-    
-    now_msk = datetime.now(timezone.utc).astimezone(MSK)
-    
-    # День недели (0=Пн)
-    if now_msk.weekday() not in s.auto_liquidation_days:
+    """Проверяет, находимся ли мы в окне блокировки авто-ликвидации (поиск по предрасчитанным интервалам)"""
+    until = trading_calendar.block_until()
+    if until is None:
         return False, ""
-    
+    return True, until.strftime("%H:%M")
+
+async def warm_up_liquidation():
+    """Прогрев за auto_liquidation_warmup_seconds до ликвидации: канал, снимок позиций и ордеров"""
     try:
-        hh, mm = map(int, s.auto_liquidation_time.split(":"))
-    except Exception:
-        hh, mm = 21, 44
-    
-    start = now_msk.replace(hour=hh, minute=mm, second=0, microsecond=0)
-    end = start + timedelta(minutes=int(s.auto_liquidation_block_minutes))
-    
-    if start <= now_msk < end:
-        return True, end.strftime("%H:%M")
-    return False, ""
+        if not get_settings().auto_liquidation_enabled:
+            return
+        await asyncio.gather(*(runner.warm_up() for runner in liquidation_runners.values()))
+    except Exception as e:
+        # Не фатально: в T-0 ликвидация выполнится "холодной"
+        logger.error(f"Liquidation warm-up error: {e}", exc_info=True)
 
 async def scheduled_liquidation():
     """Планируемая авто-ликвидация всех позиций"""
@@ -103,72 +133,50 @@ async def scheduled_liquidation():
         if not s.auto_liquidation_enabled:
             logger.info("Auto-liquidation is disabled, skipping")
             return
-        
-        # ДОБАВЛЕНО: логирование события авто-ликвидации
-        await log_event(
-            event_type="auto_liquidation_start",
-            symbol=None,
-            details={"time": s.auto_liquidation_time},
-            message="Auto liquidation started"
-        )
-        
-        client = TinkoffClient(tinkoff_token, account_id)
-        executor = OrderExecutor(tinkoff_token, account_id)
-        
-        await send_notification("⏱ Авто-ликвидация: закрываю все позиции и снимаю все ордера…")
-        
-        # Закрыть все позиции
-        positions = await client.get_positions_async()
-        closed_count = 0
-        
-        for p in positions:
-            try:
-                result = await executor.execute_smart_order(
-                    figi=p.figi, 
-                    desired_direction=p.direction, 
-                    amount=Decimal(0), 
-                    close_only=True
-                )
-                if result.success:
-                    closed_count += 1
-                    logger.info(f"Auto-closed position: {p.ticker}")
-                else:
-                    logger.error(f"Failed to auto-close {p.ticker}: {result.message}")
-                await asyncio.sleep(0.3)
-            except Exception as e:
-                logger.error(f"Auto close error {p.ticker}: {e}")
-        
-        # Снять все ордера
-        try:
-            cancelled = await executor.cancel_all_orders()
-            limit_cancelled = cancelled["limit_orders"]
-            stop_cancelled = cancelled["stop_orders"]
-        except Exception as e:
-            logger.error(f"Error cancelling orders during auto-liquidation: {e}")
-            limit_cancelled = 0
-            stop_cancelled = 0
-        
-        # Отчет
-        summary = (
-            f"✅ Авто-ликвидация завершена на {datetime.now(MSK).strftime('%H:%M:%S')} МСК\n"
-            f"📊 Закрыто позиций: {closed_count}\n"
-            f"🚫 Отменено лимитных: {limit_cancelled}\n"
-            f"🛑 Отменено стопов: {stop_cancelled}"
-        )
-        await send_notification(summary)
-        
-        # ДОБАВЛЕНО: логирование завершения
-        await log_event(
-            event_type="auto_liquidation_complete",
-            symbol=None,
-            details={
-                "closed_positions": closed_count,
-                "cancelled_limits": limit_cancelled,
-                "cancelled_stops": stop_cancelled
-            },
-            message=f"Auto liquidation completed: {closed_count} positions closed"
-        )
-        
+
+        # Сначала заявки по всем счетам параллельно, всё остальное (уведомления, журнал) — после них
+        names = list(liquidation_runners)
+        reports = await asyncio.gather(*(liquidation_runners[n].execute() for n in names), return_exceptions=True)
+
+        for name, report in zip(names, reports):
+            if isinstance(report, Exception):
+                logger.error(f"Auto liquidation error [{name}]: {report}")
+                await send_notification(f"❌ Ошибка авто-ликвидации [{name}]: {report}")
+                continue
+            header = f"✅ Авто-ликвидация завершена на {datetime.now(MSK).strftime('%H:%M:%S')} МСК"
+            if len(names) > 1:
+                header += f" [{name}]"
+            summary = (
+                f"{header}\n"
+                f"📊 Закрыто позиций: {len(report.closed)}\n"
+                f"🚫 Отменено лимитных: {report.cancelled_limits}\n"
+                f"🛑 Отменено стопов: {report.cancelled_stops}\n"
+                f"⚡ Исполнение: {report.duration_ms} мс (цель {report.target_ms} мс"
+                f"{', без прогрева' if not report.warmed_up else ''})"
+            )
+            if report.failed:
+                summary += f"\n❌ Не закрыты: {', '.join(report.failed)}"
+            await send_notification(summary)
+
+            # ДОБАВЛЕНО: логирование завершения
+            await log_event(
+                event_type="auto_liquidation_complete",
+                symbol=None,
+                details={
+                    "account": name,
+                    "time": s.auto_liquidation_time,
+                    "closed_positions": len(report.closed),
+                    "failed_positions": report.failed,
+                    "cancelled_limits": report.cancelled_limits,
+                    "cancelled_stops": report.cancelled_stops,
+                    "warmed_up": report.warmed_up,
+                    "duration_ms": report.duration_ms,
+                    "target_ms": report.target_ms,
+                    "within_target": report.within_target,
+                },
+                message=f"Auto liquidation completed: {len(report.closed)} positions closed in {report.duration_ms} ms"
+            )
+
     except Exception as e:
         logger.error(f"Auto liquidation error: {e}", exc_info=True)
         await send_notification(f"❌ Ошибка авто-ликвидации: {e}")
@@ -179,95 +187,210 @@ async def scheduled_liquidation():
             details={"exception": str(e)},
             message=f"Auto liquidation error: {str(e)}"
         )
+    finally:
+        for runner in liquidation_runners.values():
+            await runner.close()
+
+def _arm_liquidation_job():
+    """Ставит задачу авто-ликвидации на ближайший торговый день по календарю"""
+    if scheduler is None:
+        return
+    next_run = trading_calendar.next_liquidation()
+    if next_run is None:
+        for job_id in ("auto_liquidation", "auto_liquidation_warmup"):
+            if scheduler.get_job(job_id):
+                scheduler.remove_job(job_id)
+        logger.info("Auto-liquidation not armed: disabled or no trading days ahead")
+        return
+
+    warmup = int(get_settings().auto_liquidation_warmup_seconds)
+    warmup_at = next_run - timedelta(seconds=warmup)
+    if warmup > 0 and warmup_at > datetime.now(MSK):
+        scheduler.add_job(
+            warm_up_liquidation,
+            DateTrigger(run_date=warmup_at),
+            id="auto_liquidation_warmup",
+            replace_existing=True,
+            misfire_grace_time=warmup,
+        )
+    elif scheduler.get_job("auto_liquidation_warmup"):
+        scheduler.remove_job("auto_liquidation_warmup")
+    scheduler.add_job(
+        _run_liquidation_and_rearm,
+        DateTrigger(run_date=next_run),
+        id="auto_liquidation",
+        replace_existing=True,
+        misfire_grace_time=60,
+    )
+    logger.info(f"Auto-liquidation armed for {next_run.strftime('%Y-%m-%d %H:%M')} MSK")
+
+async def _run_liquidation_and_rearm():
+    try:
+        await scheduled_liquidation()
+    finally:
+        _arm_liquidation_job()
+
+async def _refresh_calendar():
+    """Ежедневное обновление расписания биржи"""
+    await trading_calendar.refresh()
+    trading_calendar.rebuild(get_settings())
+    _arm_liquidation_job()
+
+async def _maintain_event_logs():
+    """Ежедневно: секции event_logs на месяцы вперёд и архивирование старых"""
+    try:
+        await maintain_event_logs()
+    except Exception as e:
+        logger.error(f"Event logs maintenance failed: {e}")
+
+async def _sync_broker_operations():
+    """Периодическая догрузка операций счёта в broker_operations"""
+    try:
+        for account in accounts:
+            await OperationsSync(account.token, account.account_id).run()
+    except Exception as e:
+        logger.error(f"Broker operations sync failed: {e}")
+
+def _on_settings_changed(settings, source: str):
+    # Может вызываться из потока наблюдения за файлом — пересчёт в event loop
+    if _loop is None:
+        return
+    def _apply():
+        trading_calendar.rebuild(settings)
+        _arm_liquidation_job()
+    _loop.call_soon_threadsafe(_apply)
 
 async def _init_scheduler_async():
     """ИСПРАВЛЕНИЕ: Асинхронная инициализация планировщика"""
-    global scheduler
+    global scheduler, _loop
     try:
-        s = get_settings()
-        if not s.auto_liquidation_enabled:
-            logger.info("Auto-liquidation disabled, scheduler not started")
-            return
-        
-        # Создаем планировщик только когда event loop уже работает
+        _loop = asyncio.get_running_loop()
+
+        # Создаем планировщик только когда event loop уже работает.
+        # Запускаем его всегда: авто-ликвидацию могут включить позже без рестарта
         scheduler = AsyncIOScheduler(timezone="Europe/Moscow")
-        
-        # Разбор времени
-        try:
-            hh, mm = map(int, s.auto_liquidation_time.split(":"))
-        except Exception:
-            hh, mm = 21, 44
-        
-        # Дни недели для планировщика (0-6, где 0=Пн)
-        days = ",".join(str(d) for d in s.auto_liquidation_days) if s.auto_liquidation_days else "*"
-        
-        # Создаем триггер
-        trigger = CronTrigger(hour=hh, minute=mm, day_of_week=days, timezone="Europe/Moscow")
-        
-        # Добавляем задачу
+
+        await trading_calendar.refresh()
+        trading_calendar.rebuild(get_settings())
+
         scheduler.add_job(
-            scheduled_liquidation, 
-            trigger, 
-            id="auto_liquidation", 
-            replace_existing=True
+            _refresh_calendar,
+            CronTrigger(hour=6, minute=0, timezone="Europe/Moscow"),
+            id="trading_calendar_refresh",
+            replace_existing=True,
         )
-        
-        # Запускаем планировщик
+        scheduler.add_job(
+            _maintain_event_logs,
+            CronTrigger(hour=3, minute=0, timezone="Europe/Moscow"),
+            id="event_logs_maintenance",
+            replace_existing=True,
+        )
+        if BROKER_SYNC_ENABLED and os.getenv("DB_URL") and accounts:
+            scheduler.add_job(
+                _sync_broker_operations,
+                IntervalTrigger(minutes=BROKER_SYNC_INTERVAL_MINUTES),
+                id="broker_operations_sync",
+                replace_existing=True,
+                max_instances=1,
+                coalesce=True,
+                next_run_time=datetime.now(timezone.utc) + timedelta(seconds=30),
+            )
+        get_settings_manager().add_listener(_on_settings_changed)
+
         scheduler.start()
-            
-        logger.info(f"Auto-liquidation scheduler started: {hh:02d}:{mm:02d} MSK on days {days}")
+        _arm_liquidation_job()
+        logger.info("Auto-liquidation scheduler started")
         
     except Exception as e:
         logger.error(f"Failed to initialize scheduler: {e}", exc_info=True)
 
-async def process_trade_webhook(action: str, symbol: str, risk_percent: float | None = None, quantity: int | None = None, tp_percent: float | None = None, sl_percent: float | None = None):
-    try:
-        client = TinkoffClient(tinkoff_token, account_id)
-        executor = OrderExecutor(tinkoff_token, account_id)
-        
-        # Настройки риска
+def _resolve_risk(signal: WebhookSignal, account: TradingAccount | None = None) -> Decimal:
+    """Доля риска сигнала; если не задана — из настроек счёта или бота для направления"""
+    risk_percent = signal.risk_percent
+    if risk_percent is None and account is not None and account.risk_percent(signal.action) is not None:
+        risk_percent = account.risk_percent(signal.action) / 100.0
+    if risk_percent is None:
         settings = get_settings()
-        if risk_percent is None:
-            if action == "buy":
-                risk_percent = settings.risk_long_percent / 100.0
-            else:
-                risk_percent = settings.risk_short_percent / 100.0
-
-        risk_d = Decimal(str(risk_percent or 0))
-        
-        # Формируем сообщение в зависимости от режима торговли
-        if quantity is not None:
-            await send_notification(
-                f"✅ {action.upper()} {symbol}: {quantity} лот(ов), плечо {leverage}"
-            )
+        if signal.action == "buy":
+            risk_percent = settings.risk_long_percent / 100.0
         else:
-            await send_notification(
-                f"✅ {action.upper()} {symbol}: риск {_fmt_pct(risk_d * 100)}, плечо {leverage}"
-            )
+            risk_percent = settings.risk_short_percent / 100.0
+    return Decimal(str(risk_percent or 0))
+
+async def _execute_trade_leg(client: TinkoffClient, executor: OrderExecutor, signal: WebhookSignal, positions=None, balance: Decimal | None = None, digest: SignalDigest | None = None, account: TradingAccount | None = None) -> dict:
+    """
+    Исполняет один торговый сигнал без уведомлений.
+    positions/balance можно передать заранее (пакетный режим), иначе запрашиваются у брокера.
+    account задаёт переопределения риска и плеча счёта.
+    """
+    symbol = signal.symbol
+    risk_d = _resolve_risk(signal, account)
+    lev = account.config.leverage if account is not None and account.config.leverage else leverage
 
-        figi = await client.get_figi(symbol)
-        if not figi:
-            raise WebhookError(f"Инструмент {symbol} не найден")
+    figi = await client.get_figi(symbol)
+    if not figi:
+        raise WebhookError(f"Инструмент {symbol} не найден")
 
+    if positions is None:
         positions = await client.get_positions_async()
 
-        if action == "buy":
-            result = await _execute_buy_operation(client, executor, figi, symbol, positions, risk_d, quantity, tp_percent, sl_percent)
-        elif action == "sell":
-            result = await _execute_sell_operation(client, executor, figi, symbol, positions, risk_d, quantity, tp_percent, sl_percent)
+    if signal.action == "buy":
+        return await _execute_buy_operation(client, executor, figi, symbol, positions, risk_d, signal.quantity, signal.tp_percent, signal.sl_percent, balance, digest, signal.id, lev)
+    if signal.action == "sell":
+        return await _execute_sell_operation(client, executor, figi, symbol, positions, risk_d, signal.quantity, signal.tp_percent, signal.sl_percent, balance, digest, signal.id, lev)
+    raise WebhookError(f"Неподдерживаемое действие: {signal.action}")
+
+async def process_trade_webhook(signal: WebhookSignal):
+    if not accounts:
+        return {"success": False, "error": "Нет настроенных торговых счетов"}
+    if len(accounts) > 1:
+        return await process_trade_fanout(signal)
+
+    action = signal.action
+    symbol = signal.symbol
+    account = accounts[0]
+    # В режиме дайджеста все события сигнала уходят одним сообщением
+    digest = SignalDigest(f"{action.upper()} {symbol}", send_notification).start() if DIGEST_ENABLED else None
+    try:
+        client = account.client
+        executor = account.new_executor()
+
+        risk_d = _resolve_risk(signal, account)
+
+        # Формируем сообщение в зависимости от режима торговли
+        lev = account.config.leverage or leverage
+        if signal.quantity is not None:
+            received = f"{action.upper()} {symbol}: {signal.quantity} лот(ов), плечо {lev}"
         else:
-            raise WebhookError(f"Неподдерживаемое действие: {action}")
+            received = f"{action.upper()} {symbol}: риск {_fmt_pct(risk_d * 100)}, плечо {lev}"
+        if digest:
+            digest.add(f"сигнал получен: {received}")
+        else:
+            await send_notification(f"✅ {received}")
 
-        if result.get("success"):
+        result = await _execute_trade_leg(client, executor, signal, digest=digest, account=account)
+
+        if digest:
+            if result.get("success"):
+                await digest.finish(True, f"📊 {result.get('details')}")
+            else:
+                await digest.finish(False, f"Причина: {result.get('error')}")
+        elif result.get("success"):
             await send_notification(f"✅ {action.upper()} {symbol} выполнен\n📊 {result.get('details')}")
         else:
             await send_notification(f"❌ Ошибка {action.upper()} {symbol}: {result.get('error')}")
         return result
 
     except Exception as e:
-        msg = f"❌ Критическая ошибка {action.upper()} {symbol}: {str(e)}"
-        await send_notification(msg)
+        if digest:
+            await digest.finish(False, f"Критическая ошибка: {str(e)}")
+        else:
+            await send_notification(f"❌ Критическая ошибка {action.upper()} {symbol}: {str(e)}")
         logger.error(f"Trade processing error: {e}", exc_info=True)
+        await record_error(
+            "webhook", f"Critical webhook processing error: {str(e)}",
+            traceback=traceback.format_exc(), signal_id=signal.id, symbol=symbol
+        )
         
         # ДОБАВЛЕНО: логирование критической ошибки
         await log_event(
@@ -279,10 +402,163 @@ async def process_trade_webhook(action: str, symbol: str, risk_percent: float |
         
         return {"success": False, "error": str(e)}
 
-async def _amount_with_leverage(client: TinkoffClient, figi: str, risk_d: Decimal) -> tuple[Decimal, Decimal]:
-    balance = await client.get_balance_async()
+async def process_trade_fanout(signal: WebhookSignal) -> dict:
+    """
+    Мультисчётный режим: сигнал исполняется на всех счетах параллельно.
+    Инструмент и котировки берутся из общего MarketCache, поэтому каждый следующий счёт
+    добавляет только свои торговые запросы. Время исполнения фиксируется по каждому счёту.
+    """
+    action = signal.action
+    symbol = signal.symbol
+    started = time.monotonic()
+
+    async def run(account: TradingAccount) -> dict:
+        account_started = time.monotonic()
+        try:
+            res = await _execute_trade_leg(account.client, account.new_executor(), signal, account=account)
+        except Exception as e:
+            logger.error(f"Fan-out {action.upper()} {symbol} [{account.name}] error: {e}", exc_info=True)
+            await record_error(
+                "webhook_fanout", f"{action.upper()} {symbol} [{account.name}] error: {str(e)}",
+                traceback=traceback.format_exc(), signal_id=signal.id, symbol=symbol
+            )
+            res = {"success": False, "error": str(e)}
+        return {"account": account.name, "elapsed_ms": int((time.monotonic() - account_started) * 1000), **res}
+
+    results = await asyncio.gather(*(run(account) for account in accounts))
+
+    elapsed = time.monotonic() - started
+    executed = sum(1 for r in results if r.get("success"))
+    lines = [f"📡 {action.upper()} {symbol}: выполнено на {executed}/{len(results)} счетах за {elapsed:.1f} с"]
+    for r in results:
+        if r.get("success"):
+            lines.append(f"✅ {r['account']} ({r['elapsed_ms']} мс): {r.get('details')}")
+        else:
+            lines.append(f"❌ {r['account']} ({r['elapsed_ms']} мс): {r.get('error')}")
+    await send_notification("\n".join(lines))
+
+    await log_event(
+        event_type="signal_fanout",
+        symbol=symbol,
+        details={
+            "action": action,
+            "signal_id": str(signal.id),
+            "elapsed_ms": int(elapsed * 1000),
+            "accounts": results,
+            "market_cache": market_cache.metrics(),
+        },
+        message=f"Fan-out {action.upper()} {symbol}: {executed}/{len(results)} accounts"
+    )
+    failed = [f"{r['account']}: {r.get('error')}" for r in results if not r.get("success")]
+    return {
+        "success": not failed,
+        "executed": executed,
+        "results": results,
+        "error": "; ".join(failed) if failed else None,
+    }
+
+async def process_trade_batch(batch: WebhookBatch) -> dict:
+    """
+    Исполняет корзину сигналов на всех счетах параллельно: баланс и позиции счёта запрашиваются
+    один раз, ноги по разным символам идут параллельно, по одному символу — строго по порядку.
+    Вместо N×2 уведомлений отправляется одна сводка.
+    """
+    started = time.monotonic()
+    legs = batch.signals
+    multi = len(accounts) > 1
+
+    per_account = await asyncio.gather(*(_run_batch_for_account(account, legs) for account in accounts))
+    results = [r for account_results in per_account for r in account_results]
+    if not results:
+        return {"success": False, "error": "Не удалось получить баланс/позиции", "results": []}
+
+    elapsed = time.monotonic() - started
+    executed = sum(1 for r in results if r.get("success"))
+    lev = "" if multi else f", плечо {accounts[0].config.leverage or leverage}"
+    lines = [f"📦 Пакет сигналов: выполнено {executed}/{len(results)} за {elapsed:.1f} с{lev}"]
+    for r in results:
+        where = f" [{r['account']}]" if multi else ""
+        if r.get("success"):
+            lines.append(f"✅ {r['action'].upper()} {r['symbol']}{where}: {r.get('details')}")
+        else:
+            lines.append(f"❌ {r['action'].upper()} {r['symbol']}{where}: {r.get('error')}")
+    await send_notification("\n".join(lines))
+
+    await log_event(
+        event_type="signal_batch_result",
+        symbol=None,
+        details={"legs": len(legs), "executed": executed, "elapsed_ms": int(elapsed * 1000), "results": results},
+        message=f"Batch executed {executed}/{len(results)} legs"
+    )
+    return {"success": executed == len(results) == len(legs) * len(accounts), "executed": executed, "results": results}
+
+async def _run_batch_for_account(account: TradingAccount, legs: list[WebhookSignal]) -> list[dict]:
+    """Ноги пакета на одном счёте; пустой список, если не удалось получить баланс/позиции"""
+    started = time.monotonic()
+    client = account.client
+
+    try:
+        balance, positions = await asyncio.gather(client.get_balance_async(), client.get_positions_async())
+        balance = Decimal(str(balance))
+    except Exception as e:
+        logger.error(f"Batch shared state error [{account.name}]: {e}", exc_info=True)
+        await send_notification(f"❌ Пакет сигналов ({len(legs)}) [{account.name}]: не удалось получить баланс/позиции: {e}")
+        await log_event(
+            event_type="error",
+            symbol=None,
+            details={"account": account.name, "legs": len(legs), "exception": str(e)},
+            message=f"Batch shared state error: {str(e)}"
+        )
+        return []
+
+    groups: dict[str, list[tuple[int, WebhookSignal]]] = {}
+    for i, leg in enumerate(legs):
+        groups.setdefault(leg.symbol, []).append((i, leg))
+
+    results: list[dict] = [{} for _ in legs]
+
+    async def run_symbol(symbol_legs: list[tuple[int, WebhookSignal]]):
+        # Свой executor на символ: он хранит промежуточное состояние расчёта лотов
+        executor = account.new_executor()
+        snapshot = positions
+        for i, leg in symbol_legs:
+            try:
+                res = await _execute_trade_leg(client, executor, leg, snapshot, balance, account=account)
+            except Exception as e:
+                logger.error(f"Batch leg {leg.action.upper()} {leg.symbol} error: {e}", exc_info=True)
+                await record_error(
+                    "webhook_batch", f"Batch leg {leg.action.upper()} {leg.symbol} error: {str(e)}",
+                    traceback=traceback.format_exc(), signal_id=leg.id, symbol=leg.symbol
+                )
+                res = {"success": False, "error": str(e)}
+            results[i] = {"action": leg.action, "symbol": leg.symbol, "account": account.name, **res}
+            # Следующая нога по тому же символу должна видеть актуальные позиции
+            snapshot = None
+
+    await asyncio.gather(*(run_symbol(symbol_legs) for symbol_legs in groups.values()))
+    elapsed_ms = int((time.monotonic() - started) * 1000)
+    for r in results:
+        r["account_elapsed_ms"] = elapsed_ms
+    return results
+
+async def _amount_with_leverage(client: TinkoffClient, figi: str, risk_d: Decimal, balance: Decimal | None = None, lev: Decimal | None = None) -> tuple[Decimal, Decimal]:
+    if balance is None:
+        balance = await client.get_balance_async()
     bal_d = Decimal(str(balance))
-    amount = (bal_d * risk_d * leverage).quantize(Decimal("0.01"), rounding=ROUND_DOWN)
+    amount = (bal_d * risk_d * (lev or leverage)).quantize(Decimal("0.01"), rounding=ROUND_DOWN)
+
+    if client.market is not None:
+        # Цена и лот общие для всех счетов — из MarketCache
+        try:
+            current_price, instrument = await asyncio.gather(
+                client.market.get_price(figi), client.market.get_instrument(figi)
+            )
+            if not current_price:
+                return amount, Decimal("0")
+            lot = int((instrument or {}).get("lot") or 1)
+            return amount, (current_price * Decimal(lot)).quantize(Decimal("0.01"), rounding=ROUND_DOWN)
+        except Exception:
+            return amount, Decimal("0")
 
     # Оценка цены лота
     from tinkoff.invest import AsyncClient
@@ -317,7 +593,7 @@ async def _amount_with_leverage(client: TinkoffClient, figi: str, risk_d: Decima
 
     return amount, price_per_lot
 
-async def _execute_buy_operation(client, executor, figi, symbol, positions, risk_d: Decimal, quantity: int | None = None, tp_percent: float | None = None, sl_percent: float | None = None):
+async def _execute_buy_operation(client, executor, figi, symbol, positions, risk_d: Decimal, quantity: int | None = None, tp_percent: float | None = None, sl_percent: float | None = None, balance: Decimal | None = None, digest: SignalDigest | None = None, signal_id: UUID | None = None, lev: Decimal | None = None):
     try:
         short_position = next((p for p in positions if p.ticker == symbol and p.direction == "short"), None)
         if short_position:
@@ -326,15 +602,18 @@ async def _execute_buy_operation(client, executor, figi, symbol, positions, risk
                 figi=figi, 
                 desired_direction="short",
                 amount=Decimal(0), 
-                close_only=True
+                close_only=True,
+                signal_id=signal_id
             )
             if not close_result.success:
                 return {"success": False, "error": f"Не удалось закрыть короткую позицию: {close_result.message}"}
+            if digest:
+                digest.add(f"закрыта SHORT позиция: {short_position.lots} лот(ов)")
             await asyncio.sleep(1)
 
         # Если quantity указан, используем его; иначе вычисляем по риску
         if quantity is not None:
-            _, price_per_lot = await _amount_with_leverage(client, figi, risk_d)
+            _, price_per_lot = await _amount_with_leverage(client, figi, risk_d, balance, lev)
             amount = Decimal(quantity) * price_per_lot
             buy_result = await executor.execute_smart_order(
                 figi=figi, 
@@ -342,10 +621,11 @@ async def _execute_buy_operation(client, executor, figi, symbol, positions, risk
                 amount=amount, 
                 lots_override=quantity,
                 tp_percent=tp_percent,
-                sl_percent=sl_percent
+                sl_percent=sl_percent,
+                signal_id=signal_id
             )
         else:
-            amount, price_per_lot = await _amount_with_leverage(client, figi, risk_d)
+            amount, price_per_lot = await _amount_with_leverage(client, figi, risk_d, balance, lev)
             if amount <= 0:
                 return {"success": False, "error": "Недостаточно средств"}
             if price_per_lot > 0 and amount < price_per_lot:
@@ -358,17 +638,21 @@ async def _execute_buy_operation(client, executor, figi, symbol, positions, risk
                 desired_direction="long",
                 amount=amount,
                 tp_percent=tp_percent,
-                sl_percent=sl_percent
+                sl_percent=sl_percent,
+                signal_id=signal_id
             )
 
         if buy_result.success:
+            if digest:
+                for line in describe_fill(buy_result):
+                    digest.add(line)
             return {"success": True, "details": f"Сумма: {_fmt_money(amount)}; {buy_result.message}"}
         return {"success": False, "error": buy_result.message}
     except Exception as e:
         logger.error(f"Buy operation error: {e}", exc_info=True)
         return {"success": False, "error": str(e)}
 
-async def _execute_sell_operation(client, executor, figi, symbol, positions, risk_d: Decimal, quantity: int | None = None, tp_percent: float | None = None, sl_percent: float | None = None):
+async def _execute_sell_operation(client, executor, figi, symbol, positions, risk_d: Decimal, quantity: int | None = None, tp_percent: float | None = None, sl_percent: float | None = None, balance: Decimal | None = None, digest: SignalDigest | None = None, signal_id: UUID | None = None, lev: Decimal | None = None):
     try:
         long_position = next((p for p in positions if p.ticker == symbol and p.direction == "long"), None)
         if long_position:
@@ -377,15 +661,18 @@ async def _execute_sell_operation(client, executor, figi, symbol, positions, ris
                 figi=figi, 
                 desired_direction="long",
                 amount=Decimal(0), 
-                close_only=True
+                close_only=True,
+                signal_id=signal_id
             )
             if not close_result.success:
                 return {"success": False, "error": f"Не удалось закрыть длинную позицию: {close_result.message}"}
+            if digest:
+                digest.add(f"закрыта LONG позиция: {long_position.lots} лот(ов)")
             await asyncio.sleep(1)
 
         # Поддержка явного количества
         if quantity is not None:
-            _, price_per_lot = await _amount_with_leverage(client, figi, risk_d)
+            _, price_per_lot = await _amount_with_leverage(client, figi, risk_d, balance, lev)
             amount = Decimal(quantity) * price_per_lot
             sell_result = await executor.execute_smart_order(
                 figi=figi, 
@@ -393,10 +680,11 @@ async def _execute_sell_operation(client, executor, figi, symbol, positions, ris
                 amount=amount, 
                 lots_override=quantity,
                 tp_percent=tp_percent,
-                sl_percent=sl_percent
+                sl_percent=sl_percent,
+                signal_id=signal_id
             )
         else:
-            amount, price_per_lot = await _amount_with_leverage(client, figi, risk_d)
+            amount, price_per_lot = await _amount_with_leverage(client, figi, risk_d, balance, lev)
             if amount <= 0:
                 return {"success": False, "error": "Недостаточно средств"}
             if price_per_lot > 0 and amount < price_per_lot:
@@ -409,10 +697,14 @@ async def _execute_sell_operation(client, executor, figi, symbol, positions, ris
                 desired_direction="short",
                 amount=amount,
                 tp_percent=tp_percent,
-                sl_percent=sl_percent
+                sl_percent=sl_percent,
+                signal_id=signal_id
             )
 
         if sell_result.success:
+            if digest:
+                for line in describe_fill(sell_result):
+                    digest.add(line)
             return {"success": True, "details": f"Сумма: {_fmt_money(amount)}; {sell_result.message}"}
         return {"success": False, "error": sell_result.message}
     except Exception as e:
@@ -427,25 +719,25 @@ async def handle_webhook(request: web_request.Request):
             logger.warning("Invalid webhook signature")
             return web.json_response({"status": "error", "message": "Invalid signature"}, status=401)
 
+        # Разбор и валидация до любых обращений к БД и брокеру
         try:
-            data = json.loads(body.decode())
-        except json.JSONDecodeError:
-            return web.json_response({"status": "error", "message": "Invalid JSON"}, status=400)
+            signal = WebhookSignal.parse(body)
+        except ValidationError as e:
+            message = format_validation_error(e)
+            logger.warning(f"Rejected webhook payload: {message}")
+            return web.json_response({"status": "error", "message": message}, status=400)
 
-        action = (data.get("action") or "").lower()
-        if not action:
-            return web.json_response({"status": "error", "message": "Missing action field"}, status=400)
+        action = signal.action
+        symbol = signal.symbol
 
-        # ДОБАВЛЕНО: логирование входящего webhook
-        symbol = data.get("symbol", "").upper() if data.get("symbol") else None
-        await log_event(
-            event_type="signal",
-            symbol=symbol,
-            details=data,
-            message=f"Webhook {action.upper()} {symbol or 'N/A'}"
-        )
+        stale = deduplicator.check_freshness(signal.timestamp)
+        if stale:
+            logger.warning(f"Rejected webhook: {stale}")
+            return web.json_response({"status": "error", "message": stale}, status=400)
+        dedup_key = deduplicator.make_key(body)
+        dedup_ttl = deduplicator.ttl_for(signal.timestamp, signal.nonce)
 
-        if action in ["buy", "sell"]:
+        if signal.is_trade:
             # НОВОЕ: проверка окна блокировки
             block, until_str = _is_block_window_now()
             if block:
@@ -459,31 +751,30 @@ async def handle_webhook(request: web_request.Request):
                     message=f"Signal blocked due to auto-liquidation window"
                 )
                 return web.json_response({"status": "success", "result": msg})
-            
-            if not symbol:
-                return web.json_response({"status": "error", "message": "Missing symbol field"}, status=400)
-            
-            risk_percent = data.get("risk_percent")
-            quantity = data.get("quantity")
-            tp_percent = data.get("tp_percent")  # НОВЫЙ параметр
-            sl_percent = data.get("sl_percent")  # НОВЫЙ параметр
-            
-            result = await process_trade_webhook(action, symbol, risk_percent, quantity, tp_percent, sl_percent)
+
+            result, duplicate = await deduplicator.run_once(
+                dedup_key, lambda: _accept_signal(signal, lambda: process_trade_webhook(signal)), ttl=dedup_ttl
+            )
+            if duplicate:
+                await _log_duplicate(signal, dedup_key)
             if result.get("success"):
-                return web.json_response({"status": "success", "result": f"✅ {action.upper()} {symbol} выполнен успешно"})
-            return web.json_response({"status": "error", "message": result.get("error")}, status=500)
+                return web.json_response({"status": "success", "result": f"✅ {action.upper()} {symbol} выполнен успешно", "duplicate": duplicate})
+            return web.json_response({"status": "error", "message": result.get("error"), "duplicate": duplicate}, status=500)
 
         if action == "balance":
+            await _record_signal(signal)
             result = await handle_balance_request()
             return web.json_response({"status": "success", "balance": result})
 
         if action == "close_all":
-            result = await handle_close_all_request()
+            result, duplicate = await deduplicator.run_once(
+                dedup_key, lambda: _accept_signal(signal, handle_close_all_request), ttl=dedup_ttl
+            )
+            if duplicate:
+                await _log_duplicate(signal, dedup_key)
             if result.get("success"):
-                return web.json_response({"status": "success", "result": result.get("message")})
-            return web.json_response({"status": "error", "message": result.get("error")}, status=500)
-
-        return web.json_response({"status": "error", "message": f"Unknown action: {action}"}, status=400)
+                return web.json_response({"status": "success", "result": result.get("message"), "duplicate": duplicate})
+            return web.json_response({"status": "error", "message": result.get("error"), "duplicate": duplicate}, status=500)
 
     except Exception as e:
         logger.error(f"Webhook handler error: {e}", exc_info=True)
@@ -499,17 +790,123 @@ async def handle_webhook(request: web_request.Request):
             pass  # Не падаем если логирование не работает
         return web.json_response({"status": "error", "message": "Internal server error"}, status=500)
 
+async def handle_webhook_batch(request: web_request.Request):
+    try:
+        body = await request.read()
+        signature = request.headers.get("X-Signature-256", "")
+        if not verify_signature(body, signature):
+            logger.warning("Invalid batch webhook signature")
+            return web.json_response({"status": "error", "message": "Invalid signature"}, status=401)
+
+        try:
+            batch = WebhookBatch.parse(body)
+        except ValidationError as e:
+            message = format_validation_error(e)
+            logger.warning(f"Rejected batch payload: {message}")
+            return web.json_response({"status": "error", "message": message}, status=400)
+
+        stale = deduplicator.check_freshness(batch.timestamp)
+        if stale:
+            logger.warning(f"Rejected batch webhook: {stale}")
+            return web.json_response({"status": "error", "message": stale}, status=400)
+        dedup_key = deduplicator.make_key(body)
+        dedup_ttl = deduplicator.ttl_for(batch.timestamp, batch.nonce)
+
+        block, until_str = _is_block_window_now()
+        if block:
+            msg = f"⏳ Режим авто-ликвидации: входящие сигналы игнорируются до {until_str} МСК"
+            await send_notification(msg)
+            await log_event(
+                event_type="signal_blocked",
+                symbol=None,
+                details={"block_until": until_str, "legs": len(batch.signals)},
+                message=f"Batch blocked due to auto-liquidation window"
+            )
+            return web.json_response({"status": "success", "result": msg})
+
+        result, duplicate = await deduplicator.run_once(dedup_key, lambda: _accept_batch(batch), ttl=dedup_ttl)
+        if duplicate:
+            logger.info(f"Duplicate batch webhook suppressed ({dedup_key[:12]})")
+        executed = result.get("executed", 0)
+        if result.get("success"):
+            status, http_status = "success", 200
+        elif executed:
+            status, http_status = "partial", 200
+        else:
+            status, http_status = "error", 500
+        return web.json_response({
+            "status": status,
+            "executed": executed,
+            "results": result.get("results", []),
+            "message": result.get("error"),
+            "duplicate": duplicate,
+        }, status=http_status)
+
+    except Exception as e:
+        logger.error(f"Batch webhook handler error: {e}", exc_info=True)
+        try:
+            await log_event(
+                event_type="error",
+                symbol=None,
+                details={"exception": str(e)},
+                message=f"Critical batch webhook handler error: {str(e)}"
+            )
+        except Exception:
+            pass
+        return web.json_response({"status": "error", "message": "Internal server error"}, status=500)
+
+# Строки signals пишутся только для сигналов, обработка которых действительно запускается:
+# повторы, подавленные дедупликацией, и сигналы в окне авто-ликвидации остаются только в event_logs
+async def _record_signal(signal: WebhookSignal):
+    payload = signal.model_dump(mode="json", exclude_none=True)
+    await record_signal(signal.id, signal.action, signal.symbol, signal.risk_percent, payload, signal.price)
+    await log_event(
+        event_type="signal",
+        symbol=signal.symbol,
+        details={**payload, "signal_id": str(signal.id)},
+        message=f"Webhook {signal.action.upper()} {signal.symbol or 'N/A'}"
+    )
+
+async def _accept_signal(signal: WebhookSignal, job):
+    await _record_signal(signal)
+    return await job()
+
+async def _accept_batch(batch: WebhookBatch):
+    for leg in batch.signals:
+        await record_signal(leg.id, leg.action, leg.symbol, leg.risk_percent, leg.model_dump(mode="json", exclude_none=True), leg.price)
+    legs_desc = ", ".join(f"{leg.action.upper()} {leg.symbol}" for leg in batch.signals)
+    await log_event(
+        event_type="signal_batch",
+        symbol=None,
+        details=batch.model_dump(mode="json", exclude_none=True),
+        message=f"Webhook batch: {legs_desc}"
+    )
+    return await process_trade_batch(batch)
+
+async def _log_duplicate(signal: WebhookSignal, dedup_key: str):
+    logger.info(f"Duplicate webhook {signal.action.upper()} {signal.symbol or 'N/A'} suppressed ({dedup_key[:12]})")
+    await log_event(
+        event_type="signal_duplicate",
+        symbol=signal.symbol,
+        details={"action": signal.action, "dedup_key": dedup_key, "nonce": signal.nonce},
+        message=f"Duplicate webhook {signal.action.upper()} {signal.symbol or 'N/A'} suppressed"
+    )
+
 async def handle_balance_request():
     try:
-        client = TinkoffClient(tinkoff_token, account_id)
-        balance = await client.get_balance_async()
-        await send_notification(f"💰 Баланс: {Decimal(str(balance)).quantize(Decimal('0.01'))} RUB")
+        balances = await asyncio.gather(*(a.client.get_balance_async() for a in accounts))
+        balance = sum((Decimal(str(b)) for b in balances), Decimal(0))
+        if len(accounts) > 1:
+            lines = [f"• {a.name}: {Decimal(str(b)).quantize(Decimal('0.01'))} RUB" for a, b in zip(accounts, balances)]
+            await send_notification(f"💰 Баланс: {balance.quantize(Decimal('0.01'))} RUB\n" + "\n".join(lines))
+        else:
+            await send_notification(f"💰 Баланс: {balance.quantize(Decimal('0.01'))} RUB")
         
         # ДОБАВЛЕНО: логирование запроса баланса
         await log_event(
             event_type="balance_request",
             symbol=None,
-            details={"balance": str(balance)},
+            details={"balance": str(balance), "accounts": {a.name: str(b) for a, b in zip(accounts, balances)}},
             message=f"Balance request: {balance:.2f} RUB"
         )
         
@@ -529,11 +926,23 @@ async def handle_balance_request():
         return 0
 
 async def handle_close_all_request():
+    if not accounts:
+        return {"success": False, "error": "Нет настроенных торговых счетов"}
+    if len(accounts) > 1:
+        results = await asyncio.gather(*(_close_all_for_account(a) for a in accounts))
+        failed = [f"{a.name}: {r.get('error')}" for a, r in zip(accounts, results) if not r.get("success")]
+        if failed:
+            return {"success": False, "error": "; ".join(failed)}
+        return {"success": True, "message": "\n\n".join(r["message"] for r in results)}
+    return await _close_all_for_account(accounts[0])
+
+async def _close_all_for_account(account: TradingAccount):
+    where = f" [{account.name}]" if len(accounts) > 1 else ""
     try:
-        client = TinkoffClient(tinkoff_token, account_id)
-        executor = OrderExecutor(tinkoff_token, account_id)
+        client = account.client
+        executor = account.new_executor()
 
-        await send_notification("🔄 Начинаю закрытие всех позиций...")
+        await send_notification(f"🔄 Начинаю закрытие всех позиций{where}...")
 
         positions = await client.get_positions_async()
 
@@ -557,7 +966,7 @@ async def handle_close_all_request():
 
         cancelled = await executor.cancel_all_orders()
 
-        message = (f"✅ Закрытие позиций завершено!\n"
+        message = (f"✅ Закрытие позиций завершено{where}!\n"
                    f"📊 Закрыто позиций: {closed_count}\n"
                    f"🚫 Отменено лимитных ордеров: {cancelled['limit_orders']}\n"
                    f"🛑 Отменено стоп-ордеров: {cancelled['stop_orders']}")
@@ -568,6 +977,7 @@ async def handle_close_all_request():
             event_type="close_all",
             symbol=None,
             details={
+                "account": account.name,
                 "closed_positions": closed_count,
                 "cancelled_limits": cancelled["limit_orders"],
                 "cancelled_stops": cancelled["stop_orders"]
@@ -578,7 +988,7 @@ async def handle_close_all_request():
         return {"success": True, "message": message}
 
     except Exception as e:
-        error_msg = f"❌ Ошибка закрытия позиций: {str(e)}"
+        error_msg = f"❌ Ошибка закрытия позиций{where}: {str(e)}"
         await send_notification(error_msg)
         logger.error(f"Close all error: {e}", exc_info=True)
         
@@ -592,13 +1002,50 @@ async def handle_close_all_request():
         
         return {"success": False, "error": str(e)}
 
+async def handle_report(request: web_request.Request):
+    """GET /report?days=30&symbol=NG — PnL-отчёт в JSON; доступ по токену REPORT_TOKEN"""
+    report_token = os.getenv("REPORT_TOKEN")
+    provided = request.headers.get("X-Report-Token") or request.query.get("token", "")
+    if not report_token or not hmac.compare_digest(report_token, provided):
+        return web.json_response({"status": "error", "message": "Forbidden"}, status=403)
+    if not os.getenv("DB_URL"):
+        return web.json_response({"status": "error", "message": "Database is not configured"}, status=503)
+    try:
+        days = int(request.query.get("days", "30"))
+    except ValueError:
+        return web.json_response({"status": "error", "message": "days must be an integer"}, status=400)
+    try:
+        report = await get_report_engine().build(days=days, symbol=request.query.get("symbol"))
+    except Exception as e:
+        logger.error(f"Report error: {e}", exc_info=True)
+        return web.json_response({"status": "error", "message": str(e)}, status=500)
+    return web.json_response({"status": "success", "report": report.to_dict()})
+
 async def handle_health(request):
-    return web.json_response({"status": "healthy", "service": "trading-webhook-bot"})
+    return web.json_response({
+        "status": "healthy",
+        "service": "trading-webhook-bot",
+        "accounts": [a.name for a in accounts],
+    })
 
 # ИСПРАВЛЕНИЕ: Callback для инициализации планировщика
 async def init_app(app):
     """Вызывается после создания приложения, когда event loop уже работает"""
+    if notification_outbox is not None:
+        try:
+            await notification_outbox.start()
+        except Exception as e:
+            logger.error(f"Failed to start telegram outbox, sending inline: {e}")
+    try:
+        await run_migrations()
+    except Exception as e:
+        logger.error(f"Database migrations failed: {e}")
+    await start_event_logger()
+    await settings_sync.start()
     await _init_scheduler_async()
+    # История свечей для режима SL/TP от ATR догружается в фоне
+    global candle_task
+    candle_task = asyncio.create_task(get_candle_store(tinkoff_token).run())
     
     # ДОБАВЛЕНО: тестовое логирование при запуске
     await log_event(
@@ -608,18 +1055,32 @@ async def init_app(app):
         message="Webhook server started"
     )
 
+async def cleanup_app(app):
+    if candle_task is not None:
+        candle_task.cancel()
+    if notification_outbox is not None:
+        await notification_outbox.stop()
+    await settings_sync.stop()
+    await stop_event_logger()
+    await close_redis()
+
 def create_app():
     app = web.Application()
     app.router.add_post("/webhook", handle_webhook)
+    app.router.add_post("/webhook/batch", handle_webhook_batch)
+    app.router.add_get("/report", handle_report)
     app.router.add_get("/health", handle_health)
     
     # ИСПРАВЛЕНИЕ: планировщик инициализируется через callback
     app.on_startup.append(init_app)
+    app.on_cleanup.append(cleanup_app)
     
     return app
 
 if __name__ == "__main__":
-    required_vars = ["TINKOFF_TOKEN", "ACCOUNT_ID", "BOT_TOKEN", "TG_CHAT_ID"]
+    required_vars = ["TINKOFF_TOKEN", "BOT_TOKEN", "TG_CHAT_ID"]
+    if not (os.getenv("TRADING_ACCOUNTS_FILE") or os.getenv("TRADING_ACCOUNTS")):
+        required_vars.append("ACCOUNT_ID")
     missing = [v for v in required_vars if not os.getenv(v)]
     if missing:
         logger.error(f"Missing required environment variables: {missing}")